@@ -0,0 +1,166 @@
+""" Many GetFeature checks in one POST
+
+    Logical checks, each a typeName and an optional filter, are packed
+    into wfs:GetFeature requests with one wfs:Query per check and the
+    FeatureCollection that comes back is split into one QueryResult per
+    query while it streams in.
+
+    WFS 1.1 returns the features of all queries in a single flat
+    collection, so a feature can only be attributed to its query by its
+    typeName. Each batch therefore holds at most one query per typeName;
+    checks on the same survey go into successive batches. Spreading
+    checks over many surveys is what cuts the round trips.
+"""
+import feature_stream
+import rewriting
+import spatial_index
+import transport
+
+WFS_NS = 'http://www.opengis.net/wfs'
+GET_FEATURE = ('<wfs:GetFeature service="WFS" version="1.1.0"'
+               ' xmlns:wfs="%s" xmlns:ogc="%s" xmlns:gml="%s">%s'
+               '</wfs:GetFeature>')
+
+
+def equal_filter(name, value):
+    return ('<ogc:Filter><ogc:PropertyIsEqualTo><ogc:PropertyName>%s'
+            '</ogc:PropertyName><ogc:Literal>%s</ogc:Literal>'
+            '</ogc:PropertyIsEqualTo></ogc:Filter>' % (
+                rewriting.escape(name), rewriting.escape(value)))
+
+
+def bbox_filter(bbox):
+    """ Returns the filter for a (lower_a, lower_b, upper_a, upper_b) bbox """
+    return ('<ogc:Filter><ogc:BBOX><gml:Envelope srsName="EPSG:4326">'
+            '<gml:lowerCorner>%s %s</gml:lowerCorner>'
+            '<gml:upperCorner>%s %s</gml:upperCorner>'
+            '</gml:Envelope></ogc:BBOX></ogc:Filter>' % tuple(bbox))
+
+
+class BatchError(ValueError):
+    """ Raised for a batched response holding features of typeNames that
+        none of its queries asked for
+    """
+
+    def __init__(self, unexpected):
+        ValueError.__init__(self, '%d features of typeNames not queried'
+                            % unexpected)
+        self.unexpected = unexpected
+
+
+class Query(object):
+    """ One check: a typeName and the text of an ogc:Filter or None """
+
+    def __init__(self, typeName, filter=None, name=None):
+        self.typeName = typeName
+        self.filter = filter
+        self.name = name or typeName
+
+    def xml(self):
+        return '<wfs:Query typeName="%s">%s</wfs:Query>' % (
+            rewriting.escape(self.typeName, True), self.filter or '')
+
+
+def batches(queries, max_queries=50):
+    """ Splits queries into lists with distinct typeNames, keeping their
+        order, each at most max_queries long
+    """
+    result = []
+    for query in queries:
+        for batch in result:
+            if (len(batch) < max_queries and
+                    all(q.typeName != query.typeName for q in batch)):
+                batch.append(query)
+                break
+        else:
+            result.append([query])
+    return result
+
+
+def payload(queries):
+    """ Returns the wfs:GetFeature body for a batch """
+    return GET_FEATURE % (WFS_NS, rewriting.OGC_NS, rewriting.GML_NS,
+                          ''.join(query.xml() for query in queries))
+
+
+class QueryResult(object):
+    """ The part of a batched response that belongs to one Query, with
+        the attributes of a FeatureStreamValidator
+    """
+
+    def __init__(self, query):
+        self.query = query
+        self.features = 0
+        self.userids = 0
+        self.violations = []
+        self.store = spatial_index.CoordinateStore()
+
+    def count(self, typeName=None):
+        return self.features
+
+
+class _Router(object):
+    """ Stands in for a CoordinateStore, adding each position to the
+        store of the query the current feature belongs to
+    """
+
+    def __init__(self, validator):
+        self.validator = validator
+
+    def add_pos(self, fid, pos):
+        current = self.validator.current
+        if current is not None:
+            current.store.add_pos(fid, pos)
+
+
+class BatchValidator(feature_stream.FeatureStreamValidator):
+    """ Validates a batched response as a whole and per query. Features
+        of a typeName no query asked for are counted in unexpected.
+    """
+
+    def __init__(self, queries, expected_userid=None, max_violations=10):
+        feature_stream.FeatureStreamValidator.__init__(
+            self, expected_userid, False, max_violations, _Router(self))
+        self.results = [QueryResult(query) for query in queries]
+        self._by_type = dict((r.query.typeName, r) for r in self.results)
+        self.current = None
+        self.unexpected = 0
+
+    def _start(self, name, attrs):
+        if self._stack and self._stack[-1] in feature_stream.MEMBER_TAGS:
+            self.current = self._by_type.get(name)
+            if self.current is None:
+                self.unexpected += 1
+            else:
+                self.current.features += 1
+        feature_stream.FeatureStreamValidator._start(self, name, attrs)
+
+    def _userid(self, userid):
+        feature_stream.FeatureStreamValidator._userid(self, userid)
+        current = self.current
+        if current is None:
+            return
+        current.userids += 1
+        if (self.expected_userid is not None and
+                userid != self.expected_userid and
+                len(current.violations) < self.max_violations):
+            current.violations.append((current.features, userid))
+
+
+def perform(url, queries, uuid, max_queries=50, http=None):
+    """ Sends queries in as few POSTs as possible and returns a
+        QueryResult for each, in order, and the number of requests made.
+        Raises BatchError if a response holds features no query asked for.
+    """
+    results = {}
+    groups = batches(queries, max_queries)
+    for group in groups:
+        request = transport.post(url, payload(group),
+                                 ['Content-type: text/xml', 'uuid: %s' % uuid])
+        validator = feature_stream.validate(
+            request, BatchValidator(group, uuid), http)
+        if validator.unexpected:
+            raise BatchError(validator.unexpected)
+        for result in validator.results:
+            results[id(result.query)] = result
+    return [results[id(query)] for query in queries], len(groups)
@@ -0,0 +1,70 @@
+import unittest
+
+import batch_query
+import transport
+
+
+RESPONSE = ('<wfs:FeatureCollection xmlns:wfs="http://www.opengis.net/wfs"'
+            ' xmlns:gml="http://www.opengis.net/gml"'
+            ' xmlns:cobweb="http://cobweb.eu">'
+            '<gml:featureMembers>%s</gml:featureMembers>'
+            '</wfs:FeatureCollection>')
+FEATURE = '<%s gml:id="f%d"><cobweb:userid>%s</cobweb:userid></%s>'
+
+
+""" Stands in for a Transport, answering every request with body
+"""
+class _CannedTransport(object):
+
+    def __init__(self, body):
+        self.body = body
+        self.requests = []
+
+    def perform(self, request, sink=None):
+        self.requests.append(request)
+        sink(self.body.encode('utf-8'))
+        return transport.Response(200, None, False)
+
+
+def _features(*features):
+    return RESPONSE % ''.join(FEATURE % (typeName, i, userid, typeName)
+                              for i, (typeName, userid) in enumerate(features))
+
+
+""" TestPerform splits canned batched responses into query results,
+    without a PEP
+"""
+class TestPerform(unittest.TestCase):
+
+    def test_features_are_attributed_by_typeName(self):
+        http = _CannedTransport(_features(('cobweb:a', 'Joe'),
+                                          ('cobweb:b', 'Joe'),
+                                          ('cobweb:b', 'Ann')))
+        queries = [batch_query.Query('cobweb:a'), batch_query.Query('cobweb:b')]
+        results, requests = batch_query.perform('http://pep/wfs', queries,
+                                                'Joe', http=http)
+        self.assertEqual(requests, 1)
+        self.assertEqual([r.features for r in results], [1, 2])
+        self.assertEqual(results[0].violations, [])
+        self.assertEqual(results[1].violations, [(2, 'Ann')])
+
+    def test_unqueried_typeName_raises_batch_error(self):
+        http = _CannedTransport(_features(('cobweb:a', 'Joe'),
+                                          ('cobweb:other', 'Joe')))
+        with self.assertRaises(batch_query.BatchError) as raised:
+            batch_query.perform('http://pep/wfs',
+                                [batch_query.Query('cobweb:a')], 'Joe',
+                                http=http)
+        self.assertEqual(raised.exception.unexpected, 1)
+        self.assertTrue(isinstance(raised.exception, ValueError))
+
+    def test_same_typeName_goes_into_separate_batches(self):
+        queries = [batch_query.Query('cobweb:a'), batch_query.Query('cobweb:a'),
+                   batch_query.Query('cobweb:b')]
+        self.assertEqual([[q.typeName for q in batch]
+                          for batch in batch_query.batches(queries)],
+                         [['cobweb:a', 'cobweb:b'], ['cobweb:a']])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+""" Start-up cost of the suites and tools
+
+    Starts a fresh interpreter per sample that imports one module, and
+    reports the wall time of the whole process and the time the import
+    itself took, the fastest and the median over the samples, next to a
+    bare interpreter for reference. Also lists which of the heavy
+    modules the import pulled in; pycurl should only load once a request
+    is made.
+
+    python bench_startup.py --repeat 50
+    python bench_startup.py --python python2.7 endpoint_tests
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+DEFAULT_MODULES = ['pep_rewriting_tests', 'endpoint_tests', 'filter_fuzzer',
+                   'shard_runner']
+HEAVY_MODULES = ['pycurl', 'xml.dom.minidom', 'numpy', 'multiprocessing']
+CHILD = ('import sys, time\n'
+         'started = time.time()\n'
+         '%s\n'
+         'elapsed = time.time() - started\n'
+         'import json\n'
+         'print(json.dumps({"import_s": elapsed, "heavy": [m for m in %r'
+         ' if m in sys.modules]}))\n')
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def sample(python, module):
+    """ Returns (process seconds, import seconds, heavy modules) of one
+        interpreter importing module, None for a bare interpreter
+    """
+    code = CHILD % ('import %s' % module if module else 'pass',
+                    HEAVY_MODULES)
+    started = time.time()
+    output = subprocess.check_output([python, '-c', code], cwd=HERE)
+    elapsed = time.time() - started
+    result = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+    return elapsed, result['import_s'], result['heavy']
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def run(python, modules, repeat):
+    """ Returns one result dict per module, the bare interpreter first """
+    results = []
+    for module in [None] + list(modules):
+        processes, imports, heavy = [], [], []
+        for _ in range(repeat):
+            process_s, import_s, heavy = sample(python, module)
+            processes.append(process_s)
+            imports.append(import_s)
+        results.append({'module': module or '(interpreter)',
+                        'process_min_ms': min(processes) * 1000,
+                        'process_median_ms': _median(processes) * 1000,
+                        'import_min_ms': min(imports) * 1000,
+                        'import_median_ms': _median(imports) * 1000,
+                        'heavy_modules': heavy})
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('modules', nargs='*', default=DEFAULT_MODULES)
+    parser.add_argument('--python', default=sys.executable,
+                        help='interpreter to start, this one by default')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--json', help='write the results here as JSON')
+    args = parser.parse_args(argv)
+
+    results = run(args.python, args.modules, args.repeat)
+    print('%-22s %12s %12s %12s %12s  %s' % (
+        'module', 'process min', 'median', 'import min', 'median', 'loaded'))
+    for r in results:
+        print('%-22s %10.1fms %10.1fms %10.1fms %10.1fms  %s' % (
+            r['module'], r['process_min_ms'], r['process_median_ms'],
+            r['import_min_ms'], r['import_median_ms'],
+            ', '.join(r['heavy_modules']) or '-'))
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump({'python': args.python, 'repeat': args.repeat,
+                       'results': results}, out, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
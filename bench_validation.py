@@ -0,0 +1,144 @@
+""" Validation throughput against feature count
+
+    Generates synthetic FeatureCollections of increasing size with
+    feature_generator.py, then times how fast the client-side checks get
+    through them, reporting features and megabytes per second for each
+    validator and size.
+
+    python bench_validation.py --counts 1000,100000,1000000 --minidom
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import feature_columns
+import feature_generator
+import feature_stream
+
+READ_SIZE = 1 << 16
+
+
+# Each validator returns the number of userids it checked and
+# whether any of them was foreign
+def _stream(path, expected_userid):
+    validator = feature_stream.FeatureStreamValidator(expected_userid)
+    with open(path, 'rb') as data:
+        for chunk in iter(lambda: data.read(READ_SIZE), b''):
+            validator.feed(chunk)
+    validator.close()
+    return validator.userids, bool(validator.violations)
+
+
+def _columns(path, expected_userid):
+    extractor = feature_columns.ColumnExtractor()
+    with open(path, 'rb') as data:
+        for chunk in iter(lambda: data.read(READ_SIZE), b''):
+            extractor.feed(chunk)
+    columns = extractor.close()
+    return len(columns), bool(columns.foreign_userids(expected_userid))
+
+
+def _minidom(path, expected_userid):
+    from xml.dom.minidom import parse as parse_dom
+    dom = parse_dom(path)
+    userids = [node.firstChild.nodeValue
+               for node in dom.getElementsByTagName('cobweb:userid')]
+    dom.unlink()
+    return len(userids), any(u != expected_userid for u in userids)
+
+
+VALIDATORS = [('stream', _stream), ('columns', _columns),
+              ('minidom', _minidom)]
+
+
+def run(counts, surveys, users, seed, repeat, validators, workdir):
+    """ Returns one result dict per (validator, feature count) """
+    survey_ids = feature_generator.synthetic_ids(surveys, seed, 'cobweb:sid-')
+    user_ids = feature_generator.synthetic_ids(users, seed)
+    results = []
+    for count in counts:
+        path = os.path.join(workdir, 'features-%d.gml' % count)
+        # whether any feature belongs to another user than the first,
+        # which every validator has to report
+        expected = {'foreign': False}
+
+        def features():
+            for typeName, feature in feature_generator.generate(
+                    count, survey_ids, user_ids, seed):
+                if feature.userid != user_ids[0]:
+                    expected['foreign'] = True
+                yield typeName, feature
+        with open(path, 'wb') as out:
+            size = feature_generator.write_feature_collection(out.write,
+                                                              features())
+        for name, validate in validators:
+            best = None
+            for _ in range(repeat):
+                started = time.time()
+                seen, foreign = validate(path, user_ids[0])
+                elapsed = time.time() - started
+                best = elapsed if best is None else min(best, elapsed)
+            if seen != count:
+                raise RuntimeError('%s validator counted %d of %d features'
+                                   % (name, seen, count))
+            if foreign != expected['foreign']:
+                raise RuntimeError('%s validator reported foreign=%s on %d '
+                                   'features, expected %s' % (
+                                       name, foreign, count,
+                                       expected['foreign']))
+            results.append({'validator': name, 'features': count,
+                            'bytes': size, 'seconds': best,
+                            'features_per_s': count / best,
+                            'mb_per_s': size / 1e6 / best})
+        os.remove(path)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--counts', default='1000,10000,100000',
+                        help='comma separated feature counts')
+    parser.add_argument('--surveys', type=int, default=10)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per size, the fastest is reported')
+    parser.add_argument('--minidom', action='store_true',
+                        help='also time the old minidom based check')
+    parser.add_argument('--json', help='write the results here as JSON')
+    args = parser.parse_args(argv)
+    for option in ('surveys', 'users', 'repeat'):
+        if getattr(args, option) < 1:
+            parser.error('--%s must be at least 1' % option)
+    try:
+        counts = [int(c) for c in args.counts.split(',')]
+    except ValueError:
+        parser.error('--counts must be comma separated integers')
+    if min(counts) < 1:
+        parser.error('--counts must be at least 1')
+
+    validators = [v for v in VALIDATORS if args.minidom or v[0] != 'minidom']
+    workdir = tempfile.mkdtemp(prefix='cobweb-bench-')
+    try:
+        results = run(counts, args.surveys, args.users, args.seed, args.repeat,
+                      validators, workdir)
+    finally:
+        shutil.rmtree(workdir)
+
+    print('%-10s %12s %10s %10s %14s %10s' % (
+        'validator', 'features', 'MB', 'seconds', 'features/s', 'MB/s'))
+    for r in results:
+        print('%-10s %12d %10.1f %10.3f %14.0f %10.1f' % (
+            r['validator'], r['features'], r['bytes'] / 1e6, r['seconds'],
+            r['features_per_s'], r['mb_per_s']))
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump(results, out, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
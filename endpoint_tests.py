@@ -1,104 +1,100 @@
+import os
+import sys
 import unittest
-import pycurl
 
-from StringIO import StringIO
-from xml.dom.minidom import parseString
+import batch_query
+import environment
+import feature_columns
+import feature_stream
+import isolation_matrix
+import request_timing
+import scheduler
+import spatial_index
+import transport
 
-# The following define the base URLs we will use for WFS request
-WFS_POST_URL = "https://dyfi.cobwebproject.eu/test/service/wfs"
-WFS_URL = "https://dyfi.cobwebproject.eu/test/service/wfs?request=GetFeature&service=WFS&version=1.1.0&"
+# The base URLs, users and surveys live in suite_config.py, set
+# COBWEB_WFS_URL to test another deployment such as stub_server.py
+from suite_config import (WFS_POST_URL, WFS_URL, ECHO_POST_URL, ECHO_URL,
+                          USER1, USER2, SURVEY1, SURVEY2, FILTER_ATTR,
+                          FILTER_VAL, BBOX_CONTAINS_OBS, BBOX_NO_CONTAIN_OBS)
 
-# The following are the UUID of users and surveys for this test
-# Both users should have observations on both surveys
-# Each user should only see their own observations (because we 
-# do not pass the cookie "surveys" parameter).
-USER1 = "UUID"
-USER2 = "UUID"
-SURVEY1 = "cobweb:sid-UUID"
-SURVEY2 = "cobweb:sid-UUID"
-FILTER_ATTR = "cobweb:pos_acc"
-FILTER_VAL = "-1.0"
-BBOX_CONTAINS_OBS = (50,-5,55,0)
-BBOX_NO_CONTAIN_OBS = (1, 2, 2, 3)
+# Number of random envelopes checked against the client-side index
+BBOX_RANDOM_ENVELOPES = int(os.environ.get('COBWEB_BBOX_ENVELOPES', 20))
 
 
 # The following is a group of convenience functions
 # to make request handling simpler
 
 """ Convenience function to perform a GET request constructing a filter and
-    returning a parsed dom object
+    returning the response as feature_columns.FeatureColumns
 """
 def _performFilterRequestParseResponse(filterAttr, filterVal, surveys, user):
     filterString = _makeEqualFilter(filterAttr, filterVal)
     request = 'typeName=%s&%s'%(','.join(surveys), filterString)
-    return _performDOMGetRequest(request, user)
+    return _performColumnarGetRequest(request, user)
 
+""" Convenience function to perform a bbox GET request. The coordinates
+    of the returned features are collected in result.store
+"""
 def _performBBoxRequestParseResponse(left, lower, right, upper, surveys, user):
     bboxString = ','.join(str(x) for x in [left, lower, right, upper])
-    request = 'typeName=%s&%s'%(','.join(surveys), bboxString)
-    return _performDOMGetRequest(request, user)
+    request = 'typeName=%s&bbox=%s'%(','.join(surveys), bboxString)
+    return _performStreamingGetRequest(request, user,
+                                       spatial_index.CoordinateStore())
     
-""" Convenience function to perform a GET request and return a DOM
-    Parameters are the url to GET and the uuid to use in the header
+""" Convenience function to perform a GET request, validating the
+    FeatureCollection as it streams in. Parameters are the url to GET
+    and the uuid to use in the header, which is the only userid the
+    response may contain. The transfer stops at the first foreign userid.
+    An optional spatial_index.CoordinateStore receives the coordinates.
+"""
+def _performStreamingGetRequest(url, uuid, store=None):
+    validator = feature_stream.FeatureStreamValidator(uuid, True, store=store)
+    request = transport.get(WFS_URL + url, ['uuid: %s'%uuid])
+    return feature_stream.validate(request, validator)
+
+""" Convenience function to perform a GET request, extracting the userid,
+    typeName, pos_acc and position of every feature into typed columns
+    that the assertions check in bulk
 """
-def _performDOMGetRequest(url, uuid):
-    return parseString(_performRequest(''.join(WFS_URL, url), uuid))
+def _performColumnarGetRequest(url, uuid):
+    request = transport.get(WFS_URL + url, ['uuid: %s'%uuid])
+    return feature_columns.extract(request)
+
+""" Convenience function to send many checks as batched POST requests.
+    Returns a batch_query.QueryResult per query and the number of
+    requests made.
+"""
+def _performBatchedRequest(queries, uuid):
+    return batch_query.perform(WFS_POST_URL, queries, uuid)
 
 """ Convenience function to perform a GET
-    WFS request.
+    WFS request. Returns the response body decoded.
 """
 def _performRequest(url, uuid):
-    buffer = StringIO()
-    c = pycurl.Curl()
-    c.setopt(c.URL, url)
-    c.setopt(pycurl.SSL_VERIFYPEER, 0)
-    c.setopt(pycurl.SSL_VERIFYHOST, 0)
-    c.setopt(c.WRITEDATA, buffer)
-    c.setopt(pycurl.HTTPHEADER, ['uuid: %s'%uuid])
-    c.perform()
-    c.close()
-    return buffer.getvalue()
+    request = transport.get(url, ['uuid: %s'%uuid])
+    return transport.default_transport().perform(request).body.decode('utf-8')
 
 """ Convenience function to perform a POST
-    WFS request.
+    WFS request against the echoing deployment. Returns the response
+    body decoded.
 """
 def _performPostRequest(payload):
-    buffer = StringIO()
-    c = pycurl.Curl()
-    c.setopt(c.URL, WFS_POST_URL)
-    c.setopt(c.POSTFIELDS, payload)
-    c.setopt(pycurl.SSL_VERIFYPEER, 0)
-    c.setopt(pycurl.SSL_VERIFYHOST, 0)
-    c.setopt(pycurl.HTTPHEADER, ['Content-type: text/xml', 'uuid: Joe'])
-    c.setopt(c.WRITEDATA, buffer)
-    c.perform()
-    c.close()
-    return buffer.getvalue()
+    request = transport.post(ECHO_POST_URL, payload,
+                             ['Content-type: text/xml', 'uuid: Joe'])
+    return transport.default_transport().perform(request).body.decode('utf-8')
 
 """ Convenience function to print which environment is tested on
 """
 def _printLiveOrDev():
-    import socket
-    address = socket.gethostbyname_ex('dyfi.cobwebproject.eu')
-    print(address[2][0])
-    if '192.168.10.100' in address[2]:
-        print("Testing on DEV!")
-    else:
-        print("Testing on LIVE!")
+    print(environment.describe(WFS_POST_URL))
 
-""" Convenience function to return a list uuids from a
-    feature collection, one from each observation
-"""
-def _getUserIDsFromFeatures(self, wfsFeatureCollectionDom):
-        return (x.firstChild.nodeValue for x in
-                wfsFeatureCollectionDom.getElementsByTagName('cobweb:userid'))
-    
 """ Makes a WFS Filter to match a parameter
     with a value
 """
 def _makeEqualFilter(param, value):
-    return 'Filter=<Filter><PropertyIsEqualTo><PropertyName>\%s</PropertyName> \
-            <Literal>%s</Literal></PropertyIsEqualTo></Filter>'%(param, value)
+    return 'Filter=<Filter><PropertyIsEqualTo><PropertyName>%s</PropertyName>' \
+           '<Literal>%s</Literal></PropertyIsEqualTo></Filter>'%(param, value)
 
 
 # Now come the main test classes
@@ -120,12 +116,10 @@ class TestSimpleGetFeature(unittest.TestCase):
     def testSingleTypeName(self):
         # Make a valid request simple request, check filter is applied
         request = "typeName=%s"%SURVEY1
-        result = _performDOMGetRequest(request, USER1)
+        result = _performStreamingGetRequest(request, USER1)
         
         # check that the result contains results for this UUID only
-        userIDs = _getUserIDsFromFeatures(result)
-        for userID in userIDs:
-            self.assertEqual(userID, USER1)
+        self.assertEqual(result.violations, [])
 
     """ Test that a request for multiple surveys
         is rewritten and actioned correctly
@@ -133,16 +127,14 @@ class TestSimpleGetFeature(unittest.TestCase):
     def testMultipleTypeNames(self):
         # Make a valid request with two surveys
         request = "typeName=%s,%s"%(SURVEY1,SURVEY2)
-        result = _performDOMGetRequest(request, USER2)
+        result = _performStreamingGetRequest(request, USER2)
         
         # Make sure we only see our observations
-        userIDs = _getUserIDsFromFeatures(result)
-        for userID in userIDs:
-            self.assertEqual(userID, USER2)
+        self.assertEqual(result.violations, [])
             
         # Make sure there are observations for both surveys
-        self.assertGreater(len(result.getElementsByTagName(SURVEY1)), 0)
-        self.assertGreater(len(result.getElementsByTagName(SURVEY2)), 0)
+        self.assertGreater(result.count(SURVEY1), 0)
+        self.assertGreater(result.count(SURVEY2), 0)
     
         
 """ Tests HTTP Get with WFS Filter applied
@@ -160,40 +152,38 @@ class TestFilteredGetFeature(unittest.TestCase):
         result = _performFilterRequestParseResponse(FILTER_ATTR, '1.0',
                                                     [SURVEY1], USER1)  
         # should not contain observation
-        self.assertEqual(len(_getUserIDsFromFeatures(result)), 0)
+        self.assertEqual(len(result), 0)
         
         # do the test with correct filter
         result = _performFilterRequestParseResponse(FILTER_ATTR, FILTER_VAL,
                                                     [SURVEY1], USER1)
         # should contain some observations
-        userIDs = _getUserIDsFromFeatures(result)
-        self.assertGreater(len(userIDs), 0)
+        self.assertGreater(len(result), 0)
         
-        # should only be those belonging to USER1
-        for uuid in userIDs:
-            self.assertEqual(uuid, USER1)
+        # should only be those belonging to USER1, matching the filter
+        self.assertEqual(result.foreign_userids(USER1), [])
+        self.assertEqual(result.mismatches('pos_acc', FILTER_VAL), [])
     
         
     def test_multiple_name_filter(self):
         result = _performFilterRequestParseResponse(FILTER_ATTR, '1.0',
                                                     [SURVEY1,SURVEY2], USER1)
         # should not contain observation
-        self.assertEqual(len(_getUserIDsFromFeatures(result)), 0)
+        self.assertEqual(len(result), 0)
         
         # do the test with correct filter
         result = _performFilterRequestParseResponse(FILTER_ATTR, FILTER_VAL,
                                                     [SURVEY1,SURVEY2], USER1)
         # should contain some observations
-        userIDs = _getUserIDsFromFeatures(result)
-        self.assertGreater(len(userIDs), 0)
+        self.assertGreater(len(result), 0)
         
-        # should only be those belonging to USER1
-        for uuid in userIDs:
-            self.assertEqual(uuid, USER1)
+        # should only be those belonging to USER1, matching the filter
+        self.assertEqual(result.foreign_userids(USER1), [])
+        self.assertEqual(result.mismatches('pos_acc', FILTER_VAL), [])
          
         # should be across both surveys
-        self.assertGreater(len(result.getElementsByTagName(SURVEY1)), 0)
-        self.assertGreater(len(result.getElementsByTagName(SURVEY2)), 0)
+        self.assertGreater(result.count(SURVEY1), 0)
+        self.assertGreater(result.count(SURVEY2), 0)
         
 
 """ Tests the rewriting of WFS requests that use a bounding box parameter
@@ -206,34 +196,145 @@ class TestBoundedGetFeature(unittest.TestCase):
         u, l, b, r = BBOX_CONTAINS_OBS 
         result = _performBBoxRequestParseResponse(u, l, b, r, [SURVEY1], USER1)
         
-        # assert that we have observations returned, only for user1
-        userIDs = _getUserIDsFromFeatures(result)
-        self.assertGreater(len(userIDs), 0)
-        for user in userIDs:
-            self.assertEqual(user, USER1)
+        # assert that we have observations returned, only for user1,
+        # all of them inside the bbox
+        self.assertGreater(result.userids, 0)
+        self.assertEqual(result.violations, [])
+        self.assertEqual(result.store.outside(BBOX_CONTAINS_OBS), [])
         
         # request with bbox containing no observations, should contain none
         u, l, b, r = BBOX_NO_CONTAIN_OBS
         result = _performBBoxRequestParseResponse(u, l, b, r, [SURVEY1], USER1)
-        self.assertEqual(len(_getUserIDsFromFeatures(result)), 0)
+        self.assertEqual(result.userids, 0)
         
     def test_multiple_type_name(self):
         u, l, b, r = BBOX_CONTAINS_OBS
         result = _performBBoxRequestParseResponse(u, l, b, r,
                                                   [SURVEY1,SURVEY2], USER1)
         # should contain at least one observation from each survey, only USER1
-        self.assertGreater(len(result.getElementsByTagName(SURVEY1)), 0)
-        self.assertGreater(len(result.getElementsByTagName(SURVEY2)), 0)
-        for user in _getUserIDsFromFeatures(result):
-            self.assertEqual(user, USER1)
+        self.assertGreater(result.count(SURVEY1), 0)
+        self.assertGreater(result.count(SURVEY2), 0)
+        self.assertEqual(result.violations, [])
+        self.assertEqual(result.store.outside(BBOX_CONTAINS_OBS), [])
         
         # request with bbox containing no observations, should contain none 
         u, l, b, r = BBOX_NO_CONTAIN_OBS
         result = _performBBoxRequestParseResponse(u, l, b, r,
                                                   [SURVEY1,SURVEY2], USER1)
-        self.assertEqual(len(_getUserIDsFromFeatures(result)), 0)
+        self.assertEqual(result.userids, 0)
+
+    """ Downloads a survey once, indexes it and then checks that random
+        bbox requests return exactly the observations the index finds
+        inside them. Set COBWEB_BBOX_ENVELOPES to check more envelopes.
+    """
+    def test_random_envelopes(self):
+        store = spatial_index.CoordinateStore()
+        result = _performStreamingGetRequest('typeName=%s'%SURVEY1, USER1,
+                                             store)
+        self.assertEqual(result.violations, [])
+        self.assertGreater(len(store), 0)
+        index = spatial_index.GridIndex(store)
+
+        for envelope in spatial_index.random_envelopes(
+                store.extent(), BBOX_RANDOM_ENVELOPES):
+            u, l, b, r = envelope
+            result = _performBBoxRequestParseResponse(u, l, b, r,
+                                                      [SURVEY1], USER1)
+            self.assertEqual(result.violations, [])
+            self.assertEqual(set(result.store.fids), index.fids(envelope),
+                             'bbox %s' % (envelope,))
         
 
+""" TestBatchedGetFeature runs the checks above for every user and survey
+    as wfs:Query elements of a few POST requests, exercising the PEP's
+    rewriting of multi-query GetFeature requests
+"""
+class TestBatchedGetFeature(unittest.TestCase):
+
+    def _queries(self):
+        queries = []
+        for survey in sorted(set([SURVEY1, SURVEY2])):
+            queries += [
+                batch_query.Query(survey, name='plain'),
+                batch_query.Query(survey, batch_query.equal_filter(
+                    FILTER_ATTR, FILTER_VAL), 'filter'),
+                batch_query.Query(survey, batch_query.bbox_filter(
+                    BBOX_CONTAINS_OBS), 'bbox'),
+                batch_query.Query(survey, batch_query.bbox_filter(
+                    BBOX_NO_CONTAIN_OBS), 'empty bbox')]
+        return queries
+
+    def test_all_users_and_surveys(self):
+        for user in sorted(set([USER1, USER2])):
+            try:
+                results, requests = _performBatchedRequest(self._queries(),
+                                                           user)
+            except batch_query.BatchError as error:
+                self.fail('%s for %s' % (error, user))
+            for result in results:
+                query = result.query
+                message = '%s %s for %s' % (query.name, query.typeName, user)
+                self.assertEqual(result.violations, [], message)
+                if query.name == 'empty bbox':
+                    self.assertEqual(result.features, 0, message)
+                    continue
+                self.assertGreater(result.features, 0, message)
+                if query.name == 'bbox':
+                    self.assertEqual(
+                        result.store.outside(BBOX_CONTAINS_OBS), [], message)
+
+
+""" TestIsolationMatrix checks every user against every survey, alone
+    and together with the others, with requests in flight concurrently.
+    isolation_matrix.py runs the same check over large sampled matrices.
+"""
+class TestIsolationMatrix(unittest.TestCase):
+
+    def test_users_by_surveys(self):
+        users = sorted(set([USER1, USER2]))
+        surveys = sorted(set([SURVEY1, SURVEY2]))
+        cells = isolation_matrix.plan(users, surveys, 'full', multi_share=1.0)
+        http = scheduler.MultiTransport(max_concurrent=4)
+        try:
+            run = isolation_matrix.MatrixRun(cells, users, surveys, http,
+                                             WFS_POST_URL, 4)
+            run.run()
+        finally:
+            http.close()
+        self.assertEqual(run.errors, [])
+        self.assertEqual([leak.report() for leak in run.leaks], [])
+        self.assertEqual(run.checked, set(cells))
+
+
+""" TestAccessDenied checks that requests without a uuid header return
+    no features, whether the PEP refuses them with an error status or
+    answers with an empty FeatureCollection, instead of being forwarded
+    without a userid filter. filter_fuzzer.py covers many more request
+    variants.
+"""
+class TestAccessDenied(unittest.TestCase):
+
+    def _assertDenied(self, request):
+        validator = feature_stream.FeatureStreamValidator()
+        try:
+            feature_stream.validate(request, validator)
+        except feature_stream.HTTPError:
+            return
+        self.assertEqual(validator.features, 0,
+                         'features of %s returned without a uuid'
+                         % sorted(validator.counts))
+
+    def test_get_without_uuid(self):
+        self._assertDenied(transport.get(WFS_URL + 'typeName=%s'%SURVEY1))
+
+    def test_post_without_uuid(self):
+        payload = '<wfs:GetFeature service="WFS" version="1.1.0" ' \
+                  'xmlns:wfs="http://www.opengis.net/wfs">' \
+                  '<wfs:Query typeName="%s"/></wfs:GetFeature>'%SURVEY1
+        self._assertDenied(transport.post(WFS_POST_URL, payload,
+                                          ['Content-type: text/xml']))
+
+
 class TestFeatureIDGetFeature(unittest.TestCase):
     
     def test_single_feature(self):
@@ -245,7 +346,7 @@ class TestFeatureIDGetFeature(unittest.TestCase):
                         '://www.opengis.net/ogc"><fes:PropertyName>userid</fes:' \
                         'PropertyName><fes:Literal>Joe</fes:Literal></fes:Prope' \
                         'rtyIsEqualTo></fes:And></fes:Filter>)'
-        result = performRequest(WFS_URL + "typeName=A&featureid=id_4711")
+        result = _performRequest(ECHO_URL + "typeName=A&featureid=id_4711", 'Joe')
         self.assertEqual(result, desiredResult)
         
     def test_multiple_features(self):
@@ -258,7 +359,7 @@ class TestFeatureIDGetFeature(unittest.TestCase):
                         'xmlns:fes="http://www.opengis.net/ogc"><fes:PropertyNa' \
                         'me>userid</fes:PropertyName><fes:Literal>Joe</fes:Lite' \
                         'ral></fes:PropertyIsEqualTo></fes:And></fes:Filter>)'
-        result = performRequest(WFS_URL + "typeName=A&featureid=id_4711,id_4712")
+        result = _performRequest(ECHO_URL + "typeName=A&featureid=id_4711,id_4712", 'Joe')
         self.assertEqual(result, desiredResult)
 
 
@@ -277,7 +378,7 @@ class TestPostFeature(unittest.TestCase):
                         'pertyIsEqualTo></fes:Filter></wfs:Query>   <wfs:Query ' \
                         'typeName="B">    <ogc:Filter><And><fes:PropertyIsEqual' \
                         'To xmlns:fes="http://www.opengis.net/ogc"><fes:Propert' \
-                        'yName>userid</fes:PropertyName><fes:Literal>Joe</fes:L' \ 
+                        'yName>userid</fes:PropertyName><fes:Literal>Joe</fes:L' \
                         'iteral></fes:PropertyIsEqualTo><ogc:F1 xmlns:ogc="http' \
                         '://www.opengis.net/ogc"/></And></ogc:Filter>   </wfs:Q' \
                         'uery>   <wfs:Query typeName="C">    <ogc:Filter><ogc:A' \
@@ -302,11 +403,19 @@ class TestPostFeature(unittest.TestCase):
                      'er><ogc:And><ogc:F2/><ogc:F3/></ogc:And></ogc:Filter>   <' \
                      '/wfs:Query>   <wfs:Query typeName="D"/></wfs:GetFeature>'
 
-        result = performPostRequest(requestXml)
+        result = _performPostRequest(requestXml)
         self.assertEqual(result, desiredResult)
         
 if __name__ == '__main__':
-    printLiveOrDev()
-    # TODO: Add tests for AccessDenied requests
-    unittest.main()
+    # resolved while the tests run, reported at the end
+    environment.start(WFS_POST_URL)
+    concurrency = scheduler.configured_concurrency()
+    if concurrency > 1:
+        result = scheduler.run_tests(sys.modules[__name__], concurrency)
+    else:
+        result = unittest.main(exit=False,
+                               testRunner=request_timing.TimedTestRunner).result
+        print(transport.default_transport().report())
+    _printLiveOrDev()
+    sys.exit(not result.wasSuccessful())
     
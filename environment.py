@@ -0,0 +1,87 @@
+""" Which deployment a run is testing, without blocking on DNS
+
+    The test deployment and the live one share a hostname and differ
+    only in the address it resolves to. Resolving it used to hold up the
+    start of every run, for the whole resolver timeout when the name
+    server was unreachable. start() now resolves the host on a daemon
+    thread as soon as a run begins; describe() waits for the answer for
+    at most COBWEB_DNS_TIMEOUT seconds (default 1) and says so if it did
+    not come. Each host is resolved once per process.
+
+    A driver that starts the suites many times can set
+    COBWEB_ENVIRONMENT to the name of the deployment to skip the lookup
+    altogether.
+"""
+import os
+import socket
+import threading
+
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse
+
+PROJECT_HOST = 'dyfi.cobwebproject.eu'
+# The address PROJECT_HOST has on the development network
+DEV_ADDRESS = '192.168.10.100'
+DEFAULT_TIMEOUT = 1.0
+
+_probes = {}
+_lock = threading.Lock()
+
+
+class _Probe(object):
+    """ Resolves a host on a daemon thread """
+
+    def __init__(self, host):
+        self.host = host
+        self.addresses = None
+        self.error = None
+        self.done = threading.Event()
+        thread = threading.Thread(target=self._resolve)
+        thread.daemon = True
+        thread.start()
+
+    def _resolve(self):
+        try:
+            self.addresses = socket.gethostbyname_ex(self.host)[2]
+        except (socket.error, UnicodeError) as error:
+            self.error = error
+        finally:
+            self.done.set()
+
+
+def start(url):
+    """ Starts resolving the host of url unless that is under way or
+        not needed, and returns its probe or None
+    """
+    host = urlparse(url).hostname
+    if host != PROJECT_HOST or os.environ.get('COBWEB_ENVIRONMENT'):
+        return None
+    with _lock:
+        probe = _probes.get(host)
+        if probe is None:
+            probe = _probes[host] = _Probe(host)
+    return probe
+
+
+def describe(url, timeout=None):
+    """ Returns the text telling which environment url is, waiting at
+        most timeout seconds for the host to resolve
+    """
+    override = os.environ.get('COBWEB_ENVIRONMENT')
+    if override:
+        return 'Testing on %s' % override
+    probe = start(url)
+    if probe is None:
+        return 'Testing on %s' % url
+    if timeout is None:
+        timeout = float(os.environ.get('COBWEB_DNS_TIMEOUT', DEFAULT_TIMEOUT))
+    if not probe.done.wait(timeout):
+        return 'Testing on %s, %s did not resolve within %.1fs' % (
+            url, probe.host, timeout)
+    if probe.error is not None:
+        return 'Testing on %s, %s did not resolve: %s' % (
+            url, probe.host, probe.error)
+    return '%s\nTesting on %s!' % (
+        probe.addresses[0], 'DEV' if DEV_ADDRESS in probe.addresses else 'LIVE')
@@ -0,0 +1,276 @@
+""" Typed columns of a FeatureCollection for bulk assertions
+
+    A ColumnExtractor is a body sink like FeatureStreamValidator, but
+    instead of checking each feature as it arrives it turns the stream
+    into one row per feature in a FeatureColumns: the userid and the
+    survey typeName as small integer codes, pos_acc and the gml:pos
+    coordinates as doubles, all in array columns. Strings are interned,
+    so a response from a handful of users costs a few bytes per feature
+    whatever the length of their uuids.
+
+    Assertions then run over whole columns at C speed: "all userids are
+    X" is one array.count, "each survey has features" one count per
+    typeName. With NumPy installed the columns are viewed as ndarrays
+    without copying and the mismatching rows found by a vectorised
+    comparison; without it the arrays alone are used and only responses
+    that fail a check are walked row by row. NumPy is only imported
+    once a check needs it, so runs that never compare columns do not
+    pay for loading it.
+
+    Missing values are -1 in the code columns and NaN in the float ones.
+"""
+import xml.parsers.expat
+from array import array
+
+import feature_stream
+import lazy_import
+
+numpy = lazy_import.module('numpy')
+
+MISSING = -1
+NAN = float('nan')
+POS_ACC_TAG = 'cobweb:pos_acc'
+# Elements whose text goes into a column
+TEXT_TAGS = frozenset([feature_stream.USERID_TAG, POS_ACC_TAG,
+                       feature_stream.POS_TAG])
+
+
+class Interner(object):
+    """ Gives each distinct string a small integer code, in order of
+        first appearance
+    """
+
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def __len__(self):
+        return len(self.values)
+
+    def code(self, value):
+        """ Returns the code of value, assigning the next one if new """
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def get(self, value):
+        """ Returns the code of value, None if it has not been seen """
+        return self.codes.get(value)
+
+    def value(self, code):
+        return None if code == MISSING else self.values[code]
+
+
+def _view(column):
+    """ Returns column as an ndarray sharing its memory """
+    dtype = numpy.float64 if column.typecode == 'd' else numpy.intc
+    return numpy.frombuffer(column, dtype) if len(column) else \
+        numpy.zeros(0, dtype)
+
+
+def _float(text):
+    try:
+        return float(text)
+    except ValueError:
+        return NAN
+
+
+def _has_nan(column):
+    """ Returns True if a float column holds a NaN, summing it in C """
+    total = sum(column)
+    return total != total
+
+
+def _rows_not_equal(column, value, limit):
+    """ Returns the indexes of up to limit rows of column != value """
+    if column.count(value) == len(column):
+        return []
+    if lazy_import.available('numpy'):
+        return [int(i) for i in
+                numpy.flatnonzero(_view(column) != value)[:limit]]
+    rows = []
+    for row, item in enumerate(column):
+        if item != value:
+            rows.append(row)
+            if len(rows) == limit:
+                break
+    return rows
+
+
+class FeatureColumns(object):
+    """ One row per feature: userid and typeName codes, pos_acc and the
+        two coordinates of gml:pos in axis order
+    """
+
+    def __init__(self):
+        self.userids = Interner()
+        self.typeNames = Interner()
+        self.userid = array('i')
+        self.type_id = array('i')
+        self.pos_acc = array('d')
+        self.a = array('d')
+        self.b = array('d')
+
+    def __len__(self):
+        return len(self.type_id)
+
+    def append(self, typeName, userid=None, pos_acc=NAN, a=NAN, b=NAN):
+        self.type_id.append(self.typeNames.code(typeName))
+        self.userid.append(MISSING if userid is None
+                           else self.userids.code(userid))
+        self.pos_acc.append(pos_acc)
+        self.a.append(a)
+        self.b.append(b)
+
+    def nbytes(self):
+        """ Returns the memory held by the columns, without the interned
+            strings
+        """
+        return sum(column.itemsize * len(column) for column in
+                   (self.userid, self.type_id, self.pos_acc, self.a, self.b))
+
+    def count(self, typeName):
+        code = self.typeNames.get(typeName)
+        return 0 if code is None else self.type_id.count(code)
+
+    def counts(self):
+        """ Returns the number of features per typeName """
+        if len(self) and lazy_import.available('numpy'):
+            per_code = numpy.bincount(_view(self.type_id),
+                                      minlength=len(self.typeNames))
+            return dict((name, int(per_code[code]))
+                        for code, name in enumerate(self.typeNames.values))
+        return dict((name, self.type_id.count(code))
+                    for code, name in enumerate(self.typeNames.values))
+
+    def foreign_userids(self, userid, limit=10):
+        """ Returns (row, userid) for up to limit features whose userid is
+            not userid, in the form of FeatureStreamValidator.violations
+        """
+        code = self.userids.get(userid)
+        rows = _rows_not_equal(self.userid,
+                               MISSING - 1 if code is None else code, limit)
+        return [(row, self.userids.value(self.userid[row])) for row in rows]
+
+    def mismatches(self, column, value, limit=10):
+        """ Returns (row, value) for up to limit rows of the named float
+            column that are not equal to value
+        """
+        values = getattr(self, column)
+        rows = _rows_not_equal(values, float(value), limit)
+        return [(row, values[row]) for row in rows]
+
+    def outside(self, envelope, limit=10):
+        """ Returns the rows of up to limit features whose position is
+            missing or lies outside envelope
+        """
+        lower_a, lower_b, upper_a, upper_b = envelope
+        if not len(self):
+            return []
+        # min and max are only meaningful once no position is missing
+        if (not _has_nan(self.a) and not _has_nan(self.b) and
+                lower_a <= min(self.a) and max(self.a) <= upper_a and
+                lower_b <= min(self.b) and max(self.b) <= upper_b):
+            return []
+        if lazy_import.available('numpy'):
+            a, b = _view(self.a), _view(self.b)
+            inside = ((lower_a <= a) & (a <= upper_a) &
+                      (lower_b <= b) & (b <= upper_b))
+            return [int(i) for i in numpy.flatnonzero(~inside)[:limit]]
+        rows = []
+        for row, (a, b) in enumerate(zip(self.a, self.b)):
+            if not (lower_a <= a <= upper_a and lower_b <= b <= upper_b):
+                rows.append(row)
+                if len(rows) == limit:
+                    break
+        return rows
+
+
+class ColumnExtractor(object):
+    """ Fills a FeatureColumns from a FeatureCollection as it streams in
+
+        Has the feed and close methods of FeatureStreamValidator, so it
+        can be handed to feature_stream.validate. It never stops a
+        transfer early: every feature ends up in columns.
+    """
+
+    def __init__(self, columns=None):
+        self.columns = FeatureColumns() if columns is None else columns
+        self.stopped = False
+        self.error = None
+        self._depth = 0
+        # depths of the open member element, -2 if none, and feature
+        self._member = -2
+        self._feature = None
+        self._text = None
+        self._parser = xml.parsers.expat.ParserCreate()
+        self._parser.buffer_text = True
+        self._parser.StartElementHandler = self._start
+        self._parser.EndElementHandler = self._end
+        self._parser.CharacterDataHandler = self._data
+
+    def _start(self, name, attrs):
+        depth = self._depth = self._depth + 1
+        if depth == self._member + 1:
+            self.columns.append(name)
+            self._feature = depth
+        elif name in feature_stream.MEMBER_TAGS:
+            self._member = depth
+        if self._feature is not None and name in TEXT_TAGS:
+            self._text = []
+
+    def _data(self, data):
+        if self._text is not None:
+            self._text.append(data)
+
+    def _end(self, name):
+        depth = self._depth
+        self._depth = depth - 1
+        if self._text is not None and name in TEXT_TAGS:
+            text = ''.join(self._text).strip()
+            self._text = None
+            columns = self.columns
+            if name == feature_stream.USERID_TAG:
+                columns.userid[-1] = columns.userids.code(text)
+            elif name == POS_ACC_TAG:
+                columns.pos_acc[-1] = _float(text)
+            else:
+                coordinates = text.split()
+                if len(coordinates) >= 2:
+                    columns.a[-1] = _float(coordinates[0])
+                    columns.b[-1] = _float(coordinates[1])
+        elif depth == self._feature:
+            self._feature = None
+        elif depth == self._member:
+            self._member = -2
+
+    def feed(self, chunk):
+        """ Parses the next chunk of the response, returning 0 to make
+            pycurl abort the transfer once it failed to parse
+        """
+        if self.error is not None:
+            return 0
+        try:
+            self._parser.Parse(chunk, False)
+        except xml.parsers.expat.ExpatError as error:
+            self.error = error
+            return 0
+        return None
+
+    def close(self):
+        """ Finishes parsing and returns the FeatureColumns, raising the
+            ExpatError of a response that failed to parse
+        """
+        if self.error is not None:
+            raise self.error
+        self._parser.Parse(b'', True)
+        return self.columns
+
+
+def extract(request, http=None):
+    """ Performs request and returns the FeatureColumns of the response """
+    extractor = ColumnExtractor()
+    feature_stream.validate(request, extractor, http)
+    return extractor.columns
@@ -0,0 +1,166 @@
+""" Reproducible synthetic survey FeatureCollections at any scale
+
+    Features are generated lazily from a seed, so the same arguments
+    always produce the same bytes and memory use does not depend on the
+    feature count. Output is written in fixed size chunks to a file,
+    stdout or a TCP socket.
+
+    python feature_generator.py --features 10000000 --surveys 100 \
+        --users 5000 --output survey.gml
+"""
+import argparse
+import random
+import socket
+import sys
+import time
+import uuid
+
+FEATURE_COLLECTION_START = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<wfs:FeatureCollection xmlns:wfs="http://www.opengis.net/wfs"'
+    ' xmlns:gml="http://www.opengis.net/gml"'
+    ' xmlns:cobweb="http://www.cobwebproject.eu">')
+FEATURE_COLLECTION_END = '</wfs:FeatureCollection>'
+FEATURE_TEMPLATE = (
+    '<gml:featureMember><%s gml:id="%s">'
+    '<cobweb:userid>%s</cobweb:userid>'
+    '<cobweb:pos_acc>%s</cobweb:pos_acc>'
+    '<cobweb:the_geom><gml:Point srsName="EPSG:4326">'
+    '<gml:pos>%r %r</gml:pos></gml:Point></cobweb:the_geom>'
+    '</%s></gml:featureMember>')
+POS_ACCURACIES = ('-1.0', '3.0', '5.0', '10.0', '50.0')
+# Observations fall inside the British Isles, given as lat/lon
+EXTENT = (49.9, -8.2, 58.6, 1.7)
+# Every user's first observation in a survey, inside BBOX_CONTAINS_OBS
+ANCHOR = ('-1.0', 52.5, -1.5)
+CHUNK_SIZE = 1 << 16
+
+
+class Feature(object):
+    __slots__ = ('fid', 'userid', 'pos_acc', 'lat', 'lon')
+
+    def __init__(self, fid, userid, pos_acc, lat, lon):
+        self.fid = fid
+        self.userid = userid
+        self.pos_acc = pos_acc
+        self.lat = lat
+        self.lon = lon
+
+    def attribute(self, name):
+        return getattr(self, name.rpartition(':')[2].strip(), None)
+
+
+def format_feature(typeName, feature):
+    """ Returns the gml:featureMember for feature of survey typeName.
+        Userids are expected to be XML safe.
+    """
+    return FEATURE_TEMPLATE % (typeName, feature.fid, feature.userid,
+                               feature.pos_acc, feature.lat, feature.lon,
+                               typeName)
+
+
+def synthetic_ids(count, seed, prefix=''):
+    """ Returns count reproducible uuid strings """
+    rng = random.Random('ids/%s/%s' % (prefix, seed))
+    return [prefix + str(uuid.UUID(int=rng.getrandbits(128), version=4))
+            for _ in range(count)]
+
+
+def survey_features(typeName, users, count, seed=0):
+    """ Yields count Features of one survey with users assigned round
+        robin. The first observation of every user is the ANCHOR one,
+        the rest are spread over EXTENT.
+    """
+    rng = random.Random('%s/%s' % (seed, typeName))
+    local = typeName.rpartition(':')[2]
+    choice, uniform = rng.choice, rng.uniform
+    south, west, north, east = EXTENT
+    users = list(users)
+    for i in range(count):
+        if i < len(users):
+            pos_acc, lat, lon = ANCHOR
+        else:
+            pos_acc = choice(POS_ACCURACIES)
+            lat = round(uniform(south, north), 6)
+            lon = round(uniform(west, east), 6)
+        yield Feature('%s.%d' % (local, i + 1), users[i % len(users)],
+                      pos_acc, lat, lon)
+
+
+def generate(count, surveys, users, seed=0):
+    """ Yields (typeName, Feature) pairs, count features split evenly
+        over the surveys
+    """
+    per_survey, extra = divmod(count, len(surveys))
+    for index, typeName in enumerate(surveys):
+        survey_count = per_survey + (1 if index < extra else 0)
+        for feature in survey_features(typeName, users, survey_count, seed):
+            yield typeName, feature
+
+
+def iter_chunks(features, chunk_size=CHUNK_SIZE):
+    """ Yields a FeatureCollection for (typeName, Feature) pairs as
+        UTF-8 chunks of about chunk_size bytes
+    """
+    parts = [FEATURE_COLLECTION_START]
+    size = len(parts[0])
+    for typeName, feature in features:
+        text = format_feature(typeName, feature)
+        parts.append(text)
+        size += len(text)
+        if size >= chunk_size:
+            yield ''.join(parts).encode('utf-8')
+            parts, size = [], 0
+    parts.append(FEATURE_COLLECTION_END)
+    yield ''.join(parts).encode('utf-8')
+
+
+def write_feature_collection(write, features, chunk_size=CHUNK_SIZE):
+    """ Writes a FeatureCollection through write and returns the number
+        of bytes written
+    """
+    written = 0
+    for chunk in iter_chunks(features, chunk_size):
+        write(chunk)
+        written += len(chunk)
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--features', type=int, default=100000)
+    parser.add_argument('--surveys', type=int, default=10)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--output', default='-',
+                        help='file path, - for stdout or tcp://host:port')
+    args = parser.parse_args(argv)
+
+    surveys = synthetic_ids(args.surveys, args.seed, 'cobweb:sid-')
+    users = synthetic_ids(args.users, args.seed)
+    features = generate(args.features, surveys, users, args.seed)
+    started = time.time()
+    if args.output.startswith('tcp://'):
+        host, _, port = args.output[len('tcp://'):].rpartition(':')
+        conn = socket.create_connection((host, int(port)))
+        try:
+            written = write_feature_collection(conn.sendall, features,
+                                               args.chunk_size)
+        finally:
+            conn.close()
+    elif args.output == '-':
+        out = getattr(sys.stdout, 'buffer', sys.stdout)
+        written = write_feature_collection(out.write, features,
+                                           args.chunk_size)
+    else:
+        with open(args.output, 'wb') as out:
+            written = write_feature_collection(out.write, features,
+                                               args.chunk_size)
+    elapsed = time.time() - started
+    sys.stderr.write('%d features, %d bytes in %.1fs (%.1f MB/s)\n' % (
+        args.features, written, elapsed, written / 1e6 / max(elapsed, 1e-9)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+""" Streaming validation of WFS FeatureCollection responses
+
+    Rather than buffering a whole response and building a DOM, the
+    FeatureStreamValidator is handed to the transport as the body sink
+    and pushes every chunk straight into an expat parser. Only per
+    typeName counts and the offending userids are kept, so memory stays
+    flat however large the collection is.
+"""
+import xml.parsers.expat
+
+import lazy_import
+import transport
+
+pycurl = lazy_import.module('pycurl')
+
+USERID_TAG = 'cobweb:userid'
+POS_TAG = 'gml:pos'
+MEMBER_TAGS = frozenset(['gml:featureMember', 'gml:featureMembers',
+                         'wfs:member'])
+
+
+class HTTPError(Exception):
+    """ Raised by validate for a response with an HTTP error status """
+
+    def __init__(self, status, url):
+        Exception.__init__(self, 'HTTP %d from %s' % (status, url))
+        self.status = status
+
+
+class FeatureStreamValidator(object):
+    """ Counts features per typeName and checks each userid against
+        expected_userid as the response arrives
+
+        With stop_on_violation the transfer is aborted at the first
+        foreign userid, which is all a negative test needs to know. A
+        spatial_index.CoordinateStore passed as store receives the id
+        and gml:pos of every feature. A response that is not well-formed
+        XML aborts the transfer too; the ExpatError is kept in error and
+        raised by close().
+    """
+
+    def __init__(self, expected_userid=None, stop_on_violation=False,
+                 max_violations=10, store=None):
+        self.expected_userid = expected_userid
+        self.store = store
+        self.stop_on_violation = stop_on_violation
+        self.max_violations = max_violations
+        self.counts = {}
+        self.features = 0
+        self.userids = 0
+        self.violations = []
+        self.stopped = False
+        self.error = None
+        self._stack = []
+        self._text = None
+        self._fid = None
+        self._parser = xml.parsers.expat.ParserCreate()
+        self._parser.buffer_text = True
+        self._parser.StartElementHandler = self._start
+        self._parser.EndElementHandler = self._end
+        self._parser.CharacterDataHandler = self._data
+
+    def _start(self, name, attrs):
+        if self._stack and self._stack[-1] in MEMBER_TAGS:
+            self.counts[name] = self.counts.get(name, 0) + 1
+            self.features += 1
+            self._fid = attrs.get('gml:id') or attrs.get('fid')
+        self._stack.append(name)
+        if name == USERID_TAG or (name == POS_TAG and self.store is not None):
+            self._text = []
+
+    def _data(self, data):
+        if self._text is not None:
+            self._text.append(data)
+
+    def _end(self, name):
+        self._stack.pop()
+        if name == USERID_TAG:
+            self._userid(''.join(self._text).strip())
+            self._text = None
+        elif name == POS_TAG and self._text is not None:
+            self.store.add_pos(self._fid, ''.join(self._text))
+            self._text = None
+
+    def _userid(self, userid):
+        self.userids += 1
+        if self.expected_userid is None or userid == self.expected_userid:
+            return
+        if len(self.violations) < self.max_violations:
+            self.violations.append((self.features, userid))
+        if self.stop_on_violation:
+            self.stopped = True
+
+    def feed(self, chunk):
+        """ Parses the next chunk of the response. Returns 0 to make
+            pycurl abort the transfer once validation has stopped or the
+            response failed to parse.
+        """
+        if self.stopped or self.error is not None:
+            return 0
+        try:
+            self._parser.Parse(chunk, False)
+        except xml.parsers.expat.ExpatError as error:
+            # raised through pycurl it would only be a write error
+            self.error = error
+            return 0
+        if self.stopped:
+            return 0
+        return None
+
+    def close(self):
+        """ Finishes parsing and returns the validator, raising the
+            ExpatError of a response that failed to parse
+        """
+        if self.error is not None:
+            raise self.error
+        if not self.stopped:
+            self._parser.Parse(b'', True)
+        return self
+
+    def count(self, typeName):
+        return self.counts.get(typeName, 0)
+
+
+def validate(request, validator, http=None):
+    """ Performs request, streaming the response into validator, and
+        returns the closed validator. A transfer aborted by the
+        validator stopping early is not an error, one aborted because
+        the response is not well-formed raises its ExpatError and an
+        HTTP error status raises HTTPError.
+    """
+    if http is None:
+        http = transport.default_transport()
+    try:
+        response = http.perform(request, validator.feed)
+    except pycurl.error as error:
+        if validator.error is not None:
+            raise validator.error
+        if not validator.stopped or error.args[0] != pycurl.E_WRITE_ERROR:
+            raise
+        return validator.close()
+    if response.status >= 400:
+        raise HTTPError(response.status, request.url)
+    return validator.close()
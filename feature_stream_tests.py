@@ -0,0 +1,62 @@
+import unittest
+import xml.parsers.expat
+
+import feature_columns
+import feature_stream
+import stub_server
+import transport
+from suite_config import WFS_URL, SINGLE_TYPE_NAME
+
+COLLECTION = (b'<wfs:FeatureCollection xmlns:wfs="http://www.opengis.net/wfs"'
+              b' xmlns:gml="http://www.opengis.net/gml"'
+              b' xmlns:cobweb="http://cobweb.eu"><gml:featureMembers>'
+              b'<cobweb:a gml:id="f1"><cobweb:userid>Joe</cobweb:userid>'
+              b'</cobweb:a></gml:featureMembers></wfs:FeatureCollection>')
+
+
+""" TestMalformedResponses checks that a response which is not XML
+    raises its ExpatError rather than a bare pycurl write error
+"""
+class TestMalformedResponses(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        users = stub_server.default_users()
+        cls.server = stub_server.start(stub_server.SyntheticSurveys(users))
+        # the echo endpoint answers with plain text
+        cls.request = transport.get(
+            cls.server.url('/echo/wfs') +
+            WFS_URL[WFS_URL.index('?'):] + SINGLE_TYPE_NAME, ['uuid: Joe'])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_validator(self):
+        validator = feature_stream.FeatureStreamValidator('Joe')
+        with self.assertRaises(xml.parsers.expat.ExpatError):
+            feature_stream.validate(self.request, validator,
+                                    transport.Transport())
+        self.assertTrue(validator.error is not None)
+
+    def test_column_extractor(self):
+        with self.assertRaises(xml.parsers.expat.ExpatError):
+            feature_columns.extract(self.request, transport.Transport())
+
+    def test_feed_after_an_error_aborts(self):
+        validator = feature_stream.FeatureStreamValidator('Joe')
+        self.assertEqual(validator.feed(b'<a></b>'), 0)
+        self.assertEqual(validator.feed(COLLECTION), 0)
+        self.assertRaises(xml.parsers.expat.ExpatError, validator.close)
+
+    def test_well_formed_chunks(self):
+        validator = feature_stream.FeatureStreamValidator('Joe')
+        for start in range(0, len(COLLECTION), 7):
+            self.assertEqual(validator.feed(COLLECTION[start:start + 7]),
+                             None)
+        self.assertEqual(validator.close().features, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,525 @@
+""" Grammar based fuzzer for the PEP's userid injection
+
+    Generates GetFeature requests from a small grammar of OGC filters,
+    typeNames, bbox and featureid parameters: nested And/Or/Not,
+    prefix and default namespace tricks, entities, character references,
+    CDATA and percent-encoding edge cases, parenthesized filter lists
+    that do or do not match the typeNames, POST bodies with several
+    Queries and requests without a uuid header.
+
+    Every case is sent to a rewriting echo endpoint, such as the test
+    deployment or stub_server.py's /echo/wfs, and the echoed request is
+    checked: each data query must still carry the userid predicate at
+    the top level of its filter, and requests without a uuid header must
+    be refused. Failures are deduplicated by what went wrong, keeping
+    the shortest example and the grammar features that produced it.
+
+    python stub_server.py --port 8099 &
+    COBWEB_WFS_URL=http://127.0.0.1:8099/echo/wfs \
+        python filter_fuzzer.py --cases 100000 --concurrency 32
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+import time
+from collections import namedtuple
+
+try:
+    from urllib import quote
+except ImportError:
+    from urllib.parse import quote
+
+import lazy_import
+import rewriting
+import scheduler
+import suite_config
+import transport
+import xml_compare
+
+pycurl = lazy_import.module('pycurl')
+
+OGC_NS = rewriting.OGC_NS
+EVIL_NS = 'urn:example:not-ogc'
+# Operations that return features and so must be filtered
+DATA_OPERATIONS = ('getfeature', 'getfeaturewithlock', 'getpropertyvalue',
+                   'getgmlobject')
+OPERATIONS = ('GetFeature', 'getfeature', 'GETFEATURE', 'GetFeatureWithLock',
+              'GetPropertyValue', 'GetGmlObject', 'DescribeFeatureType',
+              ' GetFeature', 'GetFeature%00')
+PROPERTIES = ('userid', 'cobweb:userid', 'UserID', 'pos_acc', 'userid ')
+LITERALS = ('Bob', '-1.0', "' or '1'='1", '&amp;Joe', '&#74;oe',
+            '<![CDATA[Joe]]>', u'J\xf6e', '%s', '', ' Joe ')
+TYPE_NAMES = ('A', 'B', 'C', 'cobweb:sid-x', '*')
+
+# Characters left as they are in parameters that are not percent-encoded,
+# '&' included so that values can smuggle in extra parameters
+RAW_SAFE = "<>/=:,()'\"!*;&?@[]$+~"
+
+FuzzCase = namedtuple('FuzzCase', 'method data uuid features')
+
+
+class Grammar(object):
+    """ Draws random FuzzCases from a seeded random.Random. features
+        collects the names of the productions a case used.
+    """
+
+    def __init__(self, seed=0, user=None):
+        self.rng = random.Random(seed)
+        self.user = user or suite_config.USER_UUID
+
+    def _chance(self, p):
+        return self.rng.random() < p
+
+    def _pick(self, choices):
+        return self.rng.choice(choices)
+
+    def _element(self, name, prefix, body=None, attrs=''):
+        tag = '%s:%s' % (prefix, name) if prefix else name
+        if body is None:
+            return '<%s%s/>' % (tag, attrs)
+        return '<%s%s>%s</%s>' % (tag, attrs, body, tag)
+
+    def _literal(self, features):
+        value = self._pick(LITERALS)
+        if value == '%s':
+            value = 'Joe'
+            features.add('literal-user')
+        elif value:
+            features.add('literal-%s' % LITERALS.index(value))
+        return value
+
+    def operator(self, prefix, features, depth=0):
+        """ Returns a filter operator, a comparison, id, bbox or a
+            nested And/Or/Not
+        """
+        if depth < 3 and self._chance(0.45):
+            name = self._pick(('And', 'Or', 'Not'))
+            features.add(name.lower())
+            count = 1 if name == 'Not' else self.rng.randint(0, 3)
+            if count == 0:
+                features.add('empty-' + name.lower())
+            body = ''.join(self.operator(prefix, features, depth + 1)
+                           for _ in range(count))
+            return self._element(name, prefix, body)
+        kind = self.rng.randint(0, 4)
+        if kind <= 1:
+            prop = self._pick(PROPERTIES)
+            if prop.strip().lower().endswith('userid'):
+                features.add('userid-property')
+            body = (self._element('PropertyName', prefix, prop) +
+                    self._element('Literal', prefix,
+                                  self._literal(features)))
+            return self._element(self._pick(('PropertyIsEqualTo',
+                                              'PropertyIsNotEqualTo')),
+                                 prefix, body)
+        if kind == 2:
+            features.add('featureid')
+            return self._element('FeatureId', prefix, None,
+                                 attrs=' fid="id_%d"' % self.rng.randint(1, 9))
+        if kind == 3:
+            features.add('bbox-operator')
+            return self._element('BBOX', prefix, (
+                '<gml:Envelope xmlns:gml="%s"><gml:lowerCorner>0 1'
+                '</gml:lowerCorner><gml:upperCorner>2 3</gml:upperCorner>'
+                '</gml:Envelope>' % rewriting.GML_NS))
+        features.add('unknown-operator')
+        return self._element('F%d' % self.rng.randint(1, 3), prefix)
+
+    def filter(self, features, declared=False):
+        """ Returns the text of a Filter element with a random prefix
+            and namespace binding
+        """
+        prefix = self._pick(('', '', 'ogc', 'fes', 'p%d' % self.rng.randint(0, 9)))
+        declaration = ' xmlns%s="%%s"' % (':' + prefix if prefix else '')
+        binding = self._pick(('ogc', 'ogc', 'none', 'foreign'))
+        attrs = ''
+        if binding == 'ogc':
+            attrs = declaration % OGC_NS
+            if not prefix:
+                features.add('default-namespace')
+        elif binding == 'foreign':
+            features.add('foreign-namespace')
+            attrs = declaration % EVIL_NS
+        elif prefix and not (declared and prefix in ('ogc', 'fes')):
+            features.add('unbound-prefix')
+        if prefix:
+            features.add('prefix')
+        body = ''.join(self.operator(prefix, features)
+                       for _ in range(self.rng.randint(0, 2)))
+        if not body:
+            features.add('empty-filter')
+        if self._chance(0.1):
+            features.add('comment')
+            body = '<!-- x -->' + body
+        text = self._element('Filter', prefix, body, attrs)
+        if self._chance(0.05):
+            features.add('doctype')
+            text = ('<!DOCTYPE Filter [<!ENTITY u "%s">]>' % self.user) + text
+        elif self._chance(0.05):
+            features.add('xml-declaration')
+            text = '<?xml version="1.0" encoding="ISO-8859-1"?>' + text
+        return text
+
+    def _key(self, name, features):
+        variant = self.rng.randint(0, 5)
+        if variant == 0:
+            features.add('upper-key')
+            return name.upper()
+        if variant == 1:
+            features.add('lower-key')
+            return name.lower()
+        return name
+
+    def get(self):
+        """ Returns a GET FuzzCase, its data being the query string """
+        features = set(['get'])
+        operation = self._pick(OPERATIONS) if self._chance(0.2) else 'GetFeature'
+        if operation != 'GetFeature':
+            features.add('operation-%s' % operation.strip().lower())
+        names = [self._pick(TYPE_NAMES) for _ in range(self.rng.randint(1, 3))]
+        if self._chance(0.05):
+            features.add('empty-typename')
+            names.insert(self.rng.randint(0, len(names)), '')
+        params = [('request', operation), ('service', 'WFS'),
+                  ('version', self._pick(('1.1.0', '1.0.0', '2.0.0'))),
+                  (self._key('typeName', features), ','.join(names))]
+        spatial = self.rng.randint(0, 9)
+        if spatial <= 4:
+            count = len(names)
+            if self._chance(0.3):
+                features.add('filter-count-mismatch')
+                count = self.rng.randint(1, 4)
+            filters = [self.filter(features) for _ in range(count)]
+            if count == 1 and self._chance(0.5):
+                value = filters[0]
+            else:
+                features.add('filter-list')
+                separator = self._pick(('),(', ') , (', '),('))
+                value = '(' + separator.join(filters) + ')'
+            params.append((self._key('filter', features), value))
+            if self._chance(0.1):
+                features.add('duplicate-filter')
+                params.append((self._key('filter', features),
+                               self.filter(features)))
+        if spatial in (5, 6) or self._chance(0.05):
+            features.add('bbox')
+            params.append((self._key('bbox', features), self._pick(
+                ('0,1,2,3', '0,1,2,3,EPSG:4326', '0,1,2', 'a,b,c,d',
+                 '0,1,2,3)&filter=(<Filter/>'))))
+        if spatial in (7, 8) or self._chance(0.05):
+            features.add('featureid')
+            params.append((self._key('featureid', features), self._pick(
+                ('id_4711', 'id_4711,id_4712', ',', 'id_4711&typeName=B'))))
+        if self._chance(0.05):
+            features.add('resourceid')
+            params.append(('resourceId', 'id_4711'))
+        parts = []
+        for key, value in params:
+            if not isinstance(value, bytes):
+                value = value.encode('utf-8')
+            if self._chance(0.3):
+                features.add('percent-encoded')
+                value = quote(value, safe='')
+            else:
+                value = quote(value, safe=RAW_SAFE)
+            parts.append('%s=%s' % (key, value))
+        if self._chance(0.1):
+            features.add('shuffled')
+            self.rng.shuffle(parts)
+        return FuzzCase('GET', '&'.join(parts), self._uuid(features),
+                        frozenset(features))
+
+    def post(self):
+        """ Returns a POST FuzzCase, its data being a wfs:GetFeature """
+        features = set(['post'])
+        operation = 'GetFeature'
+        if self._chance(0.1):
+            operation = self._pick(('GetFeatureWithLock', 'GetPropertyValue',
+                                    'Transaction'))
+            features.add('operation-%s' % operation.lower())
+        queries = []
+        for _ in range(self.rng.randint(1, 3)):
+            count = self._pick((0, 1, 1, 1, 2))
+            if count == 2:
+                features.add('two-filters')
+            filters = ''.join(self.filter(features, True)
+                              for _ in range(count))
+            if filters and self._chance(0.1):
+                features.add('nested-query')
+                filters = '<wfs:Wrapper>%s</wfs:Wrapper>' % filters
+            queries.append('<wfs:Query typeName="%s">%s</wfs:Query>' % (
+                self._pick(TYPE_NAMES), filters))
+        if self._chance(0.05):
+            features.add('nested-query')
+            queries.append('<wfs:Wrapper>%s</wfs:Wrapper>' % queries.pop())
+        body = ('<wfs:%s service="WFS" version="1.1.0"'
+                ' xmlns:wfs="http://www.opengis.net/wfs"'
+                ' xmlns:ogc="%s" xmlns:fes="%s">%s</wfs:%s>' % (
+                    operation, OGC_NS, OGC_NS, ''.join(queries), operation))
+        if self._chance(0.05):
+            features.add('doctype')
+            body = '<!DOCTYPE wfs:GetFeature [<!ENTITY x "y">]>' + body
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        return FuzzCase('POST', body, self._uuid(features),
+                        frozenset(features))
+
+    def _uuid(self, features):
+        if self._chance(0.05):
+            features.add('no-uuid')
+            return None
+        if self._chance(0.02):
+            features.add('empty-uuid')
+            return ''
+        return self.user
+
+    def case(self):
+        return self.post() if self._chance(0.25) else self.get()
+
+
+def request_for(case, url=None):
+    """ Returns the transport.Request sending case to the echo endpoint """
+    url = url or suite_config.WFS_POST_URL
+    if case.uuid is None:
+        headers = []
+    elif case.uuid == '':
+        headers = ['uuid;']
+    else:
+        headers = ['uuid: %s' % case.uuid]
+    if case.method == 'POST':
+        return transport.post(url, case.data,
+                              ['Content-type: text/xml'] + headers)
+    return transport.get(url + '?' + case.data, headers)
+
+
+class Oracle(object):
+    """ Decides whether an echoed request keeps every query restricted
+        to user, the identity the endpoint echoes
+    """
+
+    def __init__(self, user='Joe'):
+        self.predicate = xml_compare.canonical(rewriting.userid_predicate(user))
+
+    def _ogc(self, name, local):
+        return name in (local, '{%s}%s' % (OGC_NS, local))
+
+    def filter_problem(self, tree):
+        """ Returns why a canonical Filter does not restrict to the user,
+            None if it does
+        """
+        name, attrs, text, children = tree
+        if name == '#unparseable':
+            return 'unparseable filter'
+        if not self._ogc(name, 'Filter'):
+            return 'filter element %s' % name
+        if children == (self.predicate,):
+            return None
+        if len(children) != 1 or not children[0][0].endswith('And'):
+            return 'predicate not at top level'
+        if not self._ogc(children[0][0], 'And'):
+            return 'And in namespace %s' % children[0][0]
+        if self.predicate not in children[0][3]:
+            return 'predicate missing from And'
+        if children[0][2]:
+            return 'text in And'
+        return None
+
+    def get_problem(self, echoed):
+        form = xml_compare.canonical_get(echoed)
+        params = dict((key.strip().lower(), value) for key, value in form[1])
+        operation = params.get('request', '').strip().lower()
+        if operation not in DATA_OPERATIONS:
+            return None
+        for key in rewriting.SPATIAL_PARAMETERS:
+            if key in params:
+                return 'unrewritten %s parameter' % key
+        if not form[2]:
+            return 'request=%s without filter' % operation
+        names = [n for n in params.get('typename', '').split(',') if n]
+        if len(form[2]) != len(names):
+            return '%d filters for %d typeNames' % (len(form[2]), len(names))
+        for tree in form[2]:
+            problem = self.filter_problem(tree)
+            if problem:
+                if operation != 'getfeature':
+                    return 'request=%s not rewritten' % operation
+                return problem
+        return None
+
+    def post_problem(self, echoed):
+        tree = xml_compare.canonical_post(echoed)[1]
+        if tree[0] == '#unparseable':
+            return 'unparseable body'
+        if not tree[0].endswith('GetFeature'):
+            return 'operation %s forwarded' % tree[0]
+        for query in tree[3]:
+            if not query[0].endswith('Query'):
+                if any(c[0].endswith('Query') or c[0].endswith('Filter')
+                       for c in query[3]):
+                    return 'query hidden in %s' % query[0]
+                continue
+            filters = [c for c in query[3] if c[0].endswith('Filter')]
+            if len(filters) != 1:
+                return '%d filters in a Query' % len(filters)
+            problem = self.filter_problem(filters[0])
+            if problem:
+                return problem
+        return None
+
+    def check(self, case, status, body):
+        """ Returns None or a (kind, reason) finding for a response """
+        if status >= 500:
+            return 'crash', 'http %d' % status
+        if not case.uuid:
+            if status == 403 or 'AccessDenied' in body:
+                return None
+            return 'bypass', 'no uuid header accepted with http %d' % status
+        if status >= 400:
+            return None
+        try:
+            if case.method == 'POST':
+                problem = self.post_problem(body)
+            else:
+                problem = self.get_problem(body)
+        except Exception as error:
+            return 'crash', 'oracle %s' % type(error).__name__
+        if problem:
+            return 'bypass', problem
+        return None
+
+
+def normalize_reason(reason):
+    """ Returns reason with numbers masked, for deduplication """
+    return re.sub(r'\d+', 'N', reason)
+
+
+class Finding(object):
+    def __init__(self, kind, reason, case):
+        self.kind = kind
+        self.reason = reason
+        self.example = case
+        self.count = 0
+
+    def add(self, case):
+        self.count += 1
+        if len(case.data) < len(self.example.data):
+            self.example = case
+
+    def to_dict(self):
+        data = self.example.data
+        if isinstance(data, bytes):
+            data = data.decode('utf-8', 'replace')
+        return {'kind': self.kind, 'reason': self.reason, 'count': self.count,
+                'features': sorted(self.example.features),
+                'method': self.example.method,
+                'uuid': self.example.uuid,
+                'data': data}
+
+
+class FuzzRun(object):
+    """ Sends cases from grammar with up to concurrency requests in flight
+        and collects deduplicated findings
+    """
+
+    def __init__(self, grammar, oracle, http, concurrency=32, url=None):
+        self.grammar = grammar
+        self.oracle = oracle
+        self.http = http
+        self.url = url
+        self.findings = {}
+        self.sent = 0
+        self.outcomes = {}
+        self._slots = threading.Semaphore(concurrency)
+        self._lock = threading.Lock()
+        self._concurrency = concurrency
+
+    def _record(self, case, pending):
+        # the slot is given back even if the oracle raises, or run()
+        # would wait for it forever
+        try:
+            try:
+                response = pending.result(0)
+            except pycurl.error as error:
+                found, outcome = ('crash', 'curl %s' % error.args[0]), 'error'
+            else:
+                body = response.body.decode('utf-8', 'replace')
+                found = self.oracle.check(case, response.status, body)
+                outcome = 'http_%d' % response.status
+            with self._lock:
+                self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+                if found:
+                    kind, reason = found
+                    key = (kind, normalize_reason(reason), case.method)
+                    finding = self.findings.get(key)
+                    if finding is None:
+                        finding = self.findings[key] = Finding(kind, reason,
+                                                               case)
+                    finding.add(case)
+        finally:
+            self._slots.release()
+
+    def run(self, cases=None, duration=None):
+        """ Sends cases until either limit is reached, returns the
+            elapsed seconds
+        """
+        started = time.time()
+        deadline = started + duration if duration else None
+        while cases is None or self.sent < cases:
+            if deadline and time.time() >= deadline:
+                break
+            case = self.grammar.case()
+            self._slots.acquire()
+            self.sent += 1
+            self.http.submit(request_for(case, self.url),
+                             callback=lambda p, case=case: self._record(case, p))
+        for _ in range(self._concurrency):
+            self._slots.acquire()
+        return time.time() - started
+
+    def report(self, elapsed):
+        return {'target': self.url or suite_config.WFS_POST_URL,
+                'cases': self.sent,
+                'duration_s': elapsed,
+                'requests_per_s': self.sent / elapsed if elapsed else 0.0,
+                'outcomes': self.outcomes,
+                'findings': [f.to_dict() for f in sorted(
+                    self.findings.values(), key=lambda f: (f.kind, -f.count))]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--cases', type=int, default=10000)
+    parser.add_argument('--duration', type=float,
+                        help='stop after this many seconds')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--user', help='uuid header to send')
+    parser.add_argument('--echo-user', default='Joe',
+                        help='identity the endpoint puts in the predicate')
+    parser.add_argument('--url', help='echo endpoint, COBWEB_WFS_URL by default')
+    parser.add_argument('--output', help='write the JSON report here')
+    args = parser.parse_args(argv)
+
+    http = scheduler.MultiTransport(max_concurrent=args.concurrency)
+    try:
+        run = FuzzRun(Grammar(args.seed, args.user), Oracle(args.echo_user),
+                      http, args.concurrency, args.url)
+        report = run.report(run.run(args.cases, args.duration))
+        report['transport'] = http.stats()
+    finally:
+        http.close()
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as out:
+            out.write(text + '\n')
+    else:
+        print(text)
+    return 1 if report['findings'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,274 @@
+""" Runs only the tests whose inputs changed since they last passed
+
+    Each test gets a fingerprint of what decides its outcome: the source
+    of the test, of its class's helpers and of the module's helper
+    functions, the values of the module's constants (the URL, users and
+    surveys, so the request shape), and the source of the repository
+    modules it imports. A passing test is stored in a local index with
+    that fingerprint and with the PEP rules its requests went through,
+    taken from the request shapes request_timing recorded for it.
+
+    The next run reuses the result of every test whose fingerprint and
+    PEP rules are unchanged and runs the rest. The PEP rules are
+    identified by
+
+    COBWEB_PEP_VERSION  a version string of the deployed PEP, covering
+                        every rule
+    COBWEB_PEP_CONFIG   a file: either JSON {"version": ..., "rules":
+                        {"bbox": ..., ...}} with a fingerprint per rule,
+                        or any other configuration file, hashed whole
+    local               with COBWEB_PEP_VERSION=local each rule is the
+                        source of the rewriting.py functions that
+                        implement it, for runs against stub_server.py
+
+    Without either the PEP rules are unknown and every test that made a
+    request runs again; only tests that made none are reused. The index
+    lives in .cobweb-selection.json, or COBWEB_SELECTION_INDEX.
+
+    COBWEB_PEP_VERSION=local COBWEB_WFS_URL=http://127.0.0.1:8099/wfs \
+        python incremental_runner.py endpoint_tests
+"""
+import argparse
+import hashlib
+import importlib
+import inspect
+import json
+import os
+import sys
+import time
+import types
+import unittest
+
+import request_timing
+
+DEFAULT_INDEX = '.cobweb-selection.json'
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Every request goes through the userid rule, spatial parameters and
+# POST bodies through their own as well
+BASE_RULE = 'userid'
+RULES = ('userid', 'filter', 'bbox', 'featureid', 'post')
+# The rewriting.py functions implementing each rule, for
+# COBWEB_PEP_VERSION=local
+RULE_SOURCES = {
+    'userid': ('userid_predicate', 'userid_filter', 'parse_query',
+               'query_filters', 'rewrite_get'),
+    'filter': ('parse', 'check_prefixes', 'rewrite_filter',
+               'split_filter_list'),
+    'bbox': ('_and_filter', 'bbox_filter'),
+    'featureid': ('_and_filter', 'featureid_filter'),
+    'post': ('parse', 'check_prefixes', 'rewrite_filter', 'rewrite_post',
+             'rewrite_post_tree'),
+}
+
+
+def _sha1(*parts):
+    digest = hashlib.sha1()
+    for part in parts:
+        if not isinstance(part, bytes):
+            part = part.encode('utf-8')
+        digest.update(part)
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def rules_for_shape(shape):
+    """ Returns the PEP rules a request_timing shape goes through """
+    if shape == 'post':
+        return [BASE_RULE, 'post']
+    kind = shape[len('get_'):].replace('_multi', '')
+    return [BASE_RULE] + ([kind] if kind in RULES else [])
+
+
+def pep_fingerprints(environ=os.environ):
+    """ Returns a fingerprint per PEP rule, None where it is not known """
+    version = environ.get('COBWEB_PEP_VERSION')
+    if version == 'local':
+        import rewriting
+        return dict((rule, _sha1(*[inspect.getsource(getattr(rewriting, name))
+                                   for name in names]))
+                    for rule, names in RULE_SOURCES.items())
+    path = environ.get('COBWEB_PEP_CONFIG')
+    if path:
+        with open(path, 'rb') as config:
+            text = config.read()
+        try:
+            data = json.loads(text.decode('utf-8'))
+        except ValueError:
+            data = None
+        if isinstance(data, dict) and isinstance(data.get('rules'), dict):
+            common = _sha1(str(data.get('version')), version or '')
+            return dict((rule, _sha1(common, str(data['rules'].get(rule))))
+                        for rule in RULES)
+        return dict((rule, _sha1(text, version or '')) for rule in RULES)
+    return dict((rule, version) for rule in RULES)
+
+
+class Fingerprints(object):
+    """ Computes test fingerprints, caching the per module parts """
+
+    def __init__(self):
+        self._modules = {}
+        self._files = {}
+
+    def _file(self, path):
+        if path not in self._files:
+            with open(path, 'rb') as source:
+                self._files[path] = _sha1(source.read())
+        return self._files[path]
+
+    def module(self, module):
+        """ Returns the fingerprint of a test module: helper functions,
+            constants and the repository modules it imports
+        """
+        name = module.__name__
+        if name in self._modules:
+            return self._modules[name]
+        parts = []
+        for key, value in sorted(vars(module).items()):
+            if isinstance(value, types.FunctionType):
+                if value.__module__ == name:
+                    parts.append(inspect.getsource(value))
+            elif isinstance(value, types.ModuleType):
+                path = getattr(value, '__file__', None) or ''
+                if os.path.dirname(os.path.abspath(path)) == HERE:
+                    parts.append('%s %s' % (key, self._file(
+                        os.path.splitext(path)[0] + '.py')))
+            elif key.isupper() and isinstance(
+                    value, (str, int, float, tuple, list, bool)):
+                parts.append('%s=%r' % (key, value))
+        self._modules[name] = _sha1(*parts)
+        return self._modules[name]
+
+    def test(self, test):
+        """ Returns the fingerprint of a TestCase instance """
+        cls = type(test)
+        module = sys.modules[cls.__module__]
+        parts = [test.id(), self.module(module),
+                 inspect.getsource(getattr(cls, test._testMethodName))]
+        for klass in inspect.getmro(cls):
+            if klass.__module__ != cls.__module__:
+                continue
+            for key, value in sorted(vars(klass).items()):
+                if (isinstance(value, types.FunctionType) and
+                        not key.startswith('test')):
+                    parts.append(inspect.getsource(value))
+        return _sha1(*parts)
+
+
+class Index(object):
+    """ The last passing fingerprint and PEP rules of each test """
+
+    def __init__(self, path=None):
+        self.path = path or os.environ.get('COBWEB_SELECTION_INDEX',
+                                           DEFAULT_INDEX)
+        self.entries = {}
+        if os.path.exists(self.path):
+            with open(self.path) as data:
+                self.entries = json.load(data).get('tests', {})
+
+    def unchanged(self, test_id, fingerprint, rules):
+        """ Returns True if test_id last passed with fingerprint and the
+            rules it used still have the fingerprints in rules. A rule
+            whose fingerprint is not known counts as changed.
+        """
+        entry = self.entries.get(test_id)
+        return (entry is not None and entry['fingerprint'] == fingerprint and
+                all(value is not None and rules.get(rule) == value
+                    for rule, value in entry['rules'].items()))
+
+    def passed(self, test_id, fingerprint, rules):
+        self.entries[test_id] = {'fingerprint': fingerprint, 'rules': rules,
+                                 'passed_at': time.time()}
+
+    def failed(self, test_id):
+        self.entries.pop(test_id, None)
+
+    def save(self):
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as out:
+            json.dump({'tests': self.entries}, out, indent=1, sort_keys=True)
+        os.rename(temporary, self.path)
+
+
+class _SelectionResult(request_timing.TimedTestResult):
+    """ Also keeps the tests that passed """
+
+    def __init__(self, *args, **kwargs):
+        request_timing.TimedTestResult.__init__(self, *args, **kwargs)
+        self.passed = []
+
+    def addSuccess(self, test):
+        request_timing.TimedTestResult.addSuccess(self, test)
+        self.passed.append(test)
+
+
+def _tests(suite):
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            for inner in _tests(test):
+                yield inner
+        else:
+            yield test
+
+
+def run_tests(module_names, full=False, index=None, stream=sys.stderr,
+              verbosity=2):
+    """ Runs the changed tests of the named modules, or all of them when
+        full, updates the index and returns the unittest result
+    """
+    index = index or Index()
+    fingerprints = Fingerprints()
+    rules = pep_fingerprints()
+    if not full and None in rules.values():
+        stream.write('Neither COBWEB_PEP_VERSION nor COBWEB_PEP_CONFIG is '
+                     'set, rerunning every test that makes requests\n')
+    tests = [test for name in module_names
+             for test in _tests(unittest.defaultTestLoader.loadTestsFromModule(
+                 importlib.import_module(name)))]
+    selected = []
+    reused = 0
+    for test in tests:
+        if not full and index.unchanged(test.id(), fingerprints.test(test),
+                                        rules):
+            reused += 1
+            if verbosity > 1:
+                stream.write('%s ... ok (unchanged)\n' % test)
+        else:
+            selected.append(test)
+
+    runner = request_timing.TimedTestRunner(stream, verbosity=verbosity,
+                                            resultclass=_SelectionResult)
+    log = request_timing.enable()
+    result = runner.run(unittest.TestSuite(selected))
+    used = {}
+    for record in log.records:
+        used.setdefault(record['test'], set()).update(
+            rules_for_shape(record['shape']))
+    passed = set(test.id() for test in result.passed)
+    for test in selected:
+        if test.id() in passed:
+            index.passed(test.id(), fingerprints.test(test),
+                         dict((rule, rules.get(rule))
+                              for rule in used.get(test.id(), ())))
+        else:
+            index.failed(test.id())
+    index.save()
+    stream.write('Reused %d unchanged of %d tests, ran %d\n' % (
+        reused, len(tests), result.testsRun))
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('modules', nargs='+')
+    parser.add_argument('--full', action='store_true',
+                        help='run every test, refreshing the index')
+    parser.add_argument('--index', help='index file, %s by default'
+                                        % DEFAULT_INDEX)
+    args = parser.parse_args(argv)
+    result = run_tests(args.modules, args.full, Index(args.index))
+    return 0 if result.wasSuccessful() else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
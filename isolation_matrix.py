@@ -0,0 +1,342 @@
+""" Tenant isolation over a matrix of users and surveys
+
+    Every cell of the matrix is one GetFeature request made as a user
+    for one survey, or for several surveys at once: the PEP has to add
+    the userid filter to each typeName of a multi-survey request. The
+    response streams through a FeatureStreamValidator that aborts the
+    transfer at the first foreign userid, so a leak costs no more than
+    the bytes up to it. Features of a survey the cell did not ask for
+    count as a leak too.
+
+    Users and surveys come from a JSON config, {"users": [...],
+    "surveys": [...]}, from feature_generator.synthetic_ids, or default
+    to the ones endpoint_tests.py uses. Strategies:
+
+    full      every user with every survey, plus the multi-survey cells
+    sample    a covering set that gives every user and every survey at
+              least one cell, filled up with random cells to --budget
+    adaptive  sample, and whenever a cell leaks also check the rest of
+              its user's row and its surveys' columns
+
+    A --time-budget stops new cells from being started once it has
+    passed; the report says how much of the matrix was covered. A run
+    in which no cell finishes for --stall-timeout seconds is abandoned
+    with an error.
+
+    python isolation_matrix.py --generate 1000,100 --stub \
+        --strategy adaptive --budget 5000 --time-budget 120
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import xml.parsers.expat
+from collections import deque
+
+import feature_generator
+import feature_stream
+import lazy_import
+import scheduler
+import suite_config
+import transport
+
+pycurl = lazy_import.module('pycurl')
+
+STRATEGIES = ('full', 'sample', 'adaptive')
+# Seconds without any cell finishing after which run() gives up
+STALL_TIMEOUT = 120
+
+
+def load_config(path):
+    """ Returns the users and surveys listed in a JSON config file """
+    with open(path) as config:
+        data = json.load(config)
+    return list(data['users']), list(data['surveys'])
+
+
+def covering_cells(users, surveys, rng):
+    """ Returns max(N, M) single-survey cells in which every user and
+        every survey appears at least once
+    """
+    users = rng.sample(users, len(users))
+    surveys = rng.sample(surveys, len(surveys))
+    return [(users[i % len(users)], (surveys[i % len(surveys)],))
+            for i in range(max(len(users), len(surveys)))]
+
+
+def multi_cells(users, surveys, count, size, rng):
+    """ Returns count cells asking for size distinct surveys at once """
+    size = min(size, len(surveys))
+    if size < 2:
+        return []
+    return [(rng.choice(users), tuple(rng.sample(surveys, size)))
+            for _ in range(count)]
+
+
+def plan(users, surveys, strategy='sample', budget=1000, multi=2,
+         multi_share=0.2, seed=0):
+    """ Returns the cells to check, (user, surveys) pairs, in order """
+    rng = random.Random(seed)
+    total = len(users) * len(surveys)
+    if strategy == 'full':
+        cells = [(user, (survey,)) for user in users for survey in surveys]
+        return cells + multi_cells(users, surveys,
+                                   int(len(cells) * multi_share), multi, rng)
+    cells = covering_cells(users, surveys, rng)
+    seen = set(cells)
+    singles = min(total, max(int(budget * (1 - multi_share)), len(cells)))
+    # drawing len(cells) more than needed makes up for the duplicates
+    for index in rng.sample(range(total), min(total, singles + len(cells))):
+        if len(cells) >= singles:
+            break
+        cell = (users[index // len(surveys)], (surveys[index % len(surveys)],))
+        if cell not in seen:
+            seen.add(cell)
+            cells.append(cell)
+    rng.shuffle(cells)
+    return cells + multi_cells(users, surveys, max(budget - len(cells), 0),
+                               multi, rng)
+
+
+class Leak(object):
+    """ A cell whose response held another tenant's data """
+
+    def __init__(self, user, surveys, foreign_userids, foreign_surveys):
+        self.user = user
+        self.surveys = surveys
+        self.foreign_userids = foreign_userids
+        self.foreign_surveys = foreign_surveys
+
+    def report(self):
+        return {'user': self.user, 'surveys': list(self.surveys),
+                'foreign_userids': self.foreign_userids,
+                'foreign_surveys': self.foreign_surveys}
+
+
+class MatrixRun(object):
+    """ Checks cells with at most concurrency requests in flight
+
+        With adaptive set, a leaking cell queues the unchecked cells of
+        its user's row and of its surveys' columns ahead of the rest.
+    """
+
+    def __init__(self, cells, users, surveys, http, url, concurrency=16,
+                 adaptive=False, time_budget=None,
+                 stall_timeout=STALL_TIMEOUT):
+        self.users = users
+        self.surveys = surveys
+        self.http = http
+        self.url = url
+        self.concurrency = concurrency
+        self.adaptive = adaptive
+        self.time_budget = time_budget
+        self.stall_timeout = stall_timeout
+        self.checked = set()
+        self.features = 0
+        self.leaks = []
+        self.errors = []
+        self.expanded = 0
+        self._queue = deque(cells)
+        self._queued = set(cells)
+        self._outstanding = 0
+        self._deadline = None
+        self._progress = None
+        # the PendingResponses in flight, cancelled if the run stalls
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._drained = threading.Event()
+
+    def _request(self, user, surveys):
+        return transport.get('%s?request=GetFeature&service=WFS&version=1.1.0'
+                             '&typeName=%s' % (self.url, ','.join(surveys)),
+                             ['uuid: %s' % user])
+
+    def _next(self):
+        """ Starts the next queued cell, if any and time is left """
+        with self._lock:
+            if (not self._queue or
+                    (self._deadline is not None and
+                     time.time() >= self._deadline)):
+                if self._outstanding == 0:
+                    self._drained.set()
+                return
+            user, surveys = cell = self._queue.popleft()
+            self._outstanding += 1
+        validator = feature_stream.FeatureStreamValidator(user, True)
+
+        def done(pending):
+            try:
+                try:
+                    status = pending.result(0).status
+                    error = None if status < 400 else 'HTTP %d' % status
+                except pycurl.error as failure:
+                    if validator.error is not None:
+                        error = 'invalid response: %s' % validator.error
+                    else:
+                        error = None if validator.stopped else str(failure)
+                if error is None and not validator.stopped:
+                    try:
+                        validator.close()
+                    except xml.parsers.expat.ExpatError as failure:
+                        error = 'invalid response: %s' % failure
+                self._finish(cell, validator, error)
+            finally:
+                with self._lock:
+                    self._pending.discard(pending)
+                    self._outstanding -= 1
+                    self._progress = time.time()
+                self._next()
+        pending = self.http.submit(self._request(user, surveys),
+                                   validator.feed, done)
+        with self._lock:
+            # done may already have run on the scheduler thread
+            if not pending.done():
+                self._pending.add(pending)
+
+    def _finish(self, cell, validator, error):
+        user, surveys = cell
+        foreign_surveys = sorted(set(validator.counts) - set(surveys))
+        with self._lock:
+            self.checked.add(cell)
+            self.features += validator.features
+            if error is not None:
+                self.errors.append({'user': user, 'surveys': list(surveys),
+                                    'error': error})
+                return
+            if not validator.violations and not foreign_surveys:
+                return
+            self.leaks.append(Leak(user, surveys,
+                                   sorted(set(u for _, u in
+                                              validator.violations)),
+                                   foreign_surveys))
+            if self.adaptive:
+                self._expand(user, surveys)
+
+    def _expand(self, user, surveys):
+        """ Queues the row and columns of a leaking cell first """
+        cells = [(user, (survey,)) for survey in self.surveys]
+        cells += [(other, (survey,)) for survey in surveys
+                  for other in self.users]
+        for cell in reversed(cells):
+            if cell not in self._queued:
+                self._queued.add(cell)
+                self._queue.appendleft(cell)
+                self.expanded += 1
+
+    def run(self):
+        """ Checks the queued cells and returns the elapsed seconds
+
+            Gives up once no cell has finished for stall_timeout
+            seconds: the requests in flight are cancelled and an error
+            is recorded for the run and for each of their cells.
+        """
+        started = self._progress = time.time()
+        if self.time_budget is not None:
+            self._deadline = started + self.time_budget
+        for _ in range(self.concurrency):
+            self._next()
+        while not self._drained.wait(1.0):
+            with self._lock:
+                if time.time() - self._progress < self.stall_timeout:
+                    continue
+                self._queue.clear()
+                self.errors.append({'error': 'no cell finished for %ds, %d '
+                                             'requests still outstanding'
+                                             % (self.stall_timeout,
+                                                self._outstanding)})
+                pending = list(self._pending)
+            self.http.cancel(pending)
+            break
+        return time.time() - started
+
+    def report(self, elapsed):
+        singles = set((user, surveys[0]) for user, surveys in self.checked
+                      if len(surveys) == 1)
+        users = set(user for user, _ in self.checked)
+        surveys = set(survey for _, cell_surveys in self.checked
+                      for survey in cell_surveys)
+        return {'target': self.url,
+                'users': len(self.users), 'surveys': len(self.surveys),
+                'cells': len(self.checked),
+                'unchecked': len(self._queue),
+                'pair_coverage': float(len(singles)) /
+                                 (len(self.users) * len(self.surveys)),
+                'users_covered': len(users), 'surveys_covered': len(surveys),
+                'features': self.features,
+                'expanded': self.expanded,
+                'duration_s': elapsed,
+                'requests_per_s': len(self.checked) / elapsed if elapsed
+                                  else 0.0,
+                'leaks': [leak.report() for leak in self.leaks],
+                'errors': self.errors}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--config', help='JSON file with users and surveys')
+    parser.add_argument('--generate',
+                        help='USERS,SURVEYS synthetic ids to generate')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--strategy', choices=STRATEGIES, default='sample')
+    parser.add_argument('--budget', type=int, default=1000,
+                        help='cells to check with sample and adaptive')
+    parser.add_argument('--multi', type=int, default=2,
+                        help='surveys per multi-survey cell')
+    parser.add_argument('--multi-share', type=float, default=0.2,
+                        help='share of the cells asking for several surveys')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--time-budget', type=float,
+                        help='seconds after which no new cells are started')
+    parser.add_argument('--stall-timeout', type=float, default=STALL_TIMEOUT,
+                        help='seconds without a finished cell to give up')
+    parser.add_argument('--url', default=suite_config.WFS_POST_URL,
+                        help='PEP WFS endpoint, COBWEB_WFS_URL by default')
+    parser.add_argument('--stub', action='store_true',
+                        help='check a local stub_server.py holding the '
+                             "users' observations instead of --url")
+    parser.add_argument('--features-per-survey', type=int, default=200,
+                        help='observations per survey of the --stub')
+    parser.add_argument('--output', help='write the JSON report here')
+    args = parser.parse_args(argv)
+
+    if args.config:
+        users, surveys = load_config(args.config)
+    elif args.generate:
+        user_count, survey_count = [int(n) for n in args.generate.split(',')]
+        users = feature_generator.synthetic_ids(user_count, args.seed)
+        surveys = feature_generator.synthetic_ids(survey_count, args.seed,
+                                                  'cobweb:sid-')
+    else:
+        users = sorted(set([suite_config.USER1, suite_config.USER2]))
+        surveys = sorted(set([suite_config.SURVEY1, suite_config.SURVEY2]))
+    url = args.url.rstrip('?')
+    if args.stub:
+        import stub_server
+        server = stub_server.start(stub_server.SyntheticSurveys(
+            users, args.features_per_survey, args.seed))
+        url = server.url('/wfs')
+
+    cells = plan(users, surveys, args.strategy, args.budget, args.multi,
+                 args.multi_share, args.seed)
+    http = scheduler.MultiTransport(max_concurrent=args.concurrency)
+    try:
+        run = MatrixRun(cells, users, surveys, http, url, args.concurrency,
+                        args.strategy == 'adaptive', args.time_budget,
+                        args.stall_timeout)
+        report = run.report(run.run())
+    finally:
+        http.close()
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as out:
+            out.write(text + '\n')
+    else:
+        print(text)
+    return 1 if report['leaks'] or report['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,76 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import isolation_matrix
+import scheduler
+import stub_server
+
+USERS = ['user-a', 'user-b']
+SURVEYS = ['cobweb:sid-a', 'cobweb:sid-b']
+
+
+""" TestPlan checks the cells the sampling strategies choose
+"""
+class TestPlan(unittest.TestCase):
+
+    def test_full_covers_every_pair(self):
+        cells = isolation_matrix.plan(USERS, SURVEYS, 'full')
+        self.assertEqual(set(c for c in cells if len(c[1]) == 1),
+                         set((u, (s,)) for u in USERS for s in SURVEYS))
+
+    def test_sample_covers_every_user_and_survey(self):
+        users = ['user-%d' % i for i in range(30)]
+        surveys = ['cobweb:sid-%d' % i for i in range(7)]
+        cells = isolation_matrix.plan(users, surveys, 'sample', budget=40)
+        self.assertEqual(len(cells), 40)
+        self.assertEqual(set(u for u, _ in cells), set(users))
+        self.assertEqual(set(s for _, ss in cells for s in ss), set(surveys))
+
+
+""" TestStall runs the matrix against a server that accepts connections
+    and never answers
+"""
+class TestStall(unittest.TestCase):
+
+    def setUp(self):
+        self.server = stub_server.SilentServer()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.close()
+        shutil.rmtree(self.directory)
+
+    def test_run_gives_up_and_cancels_the_requests(self):
+        http = scheduler.MultiTransport(max_concurrent=2)
+        try:
+            run = isolation_matrix.MatrixRun(
+                isolation_matrix.plan(USERS, SURVEYS, 'full'), USERS,
+                SURVEYS, http, self.server.url(), 2, stall_timeout=1)
+            elapsed = run.run()
+            self.assertLess(elapsed, 5)
+            self.assertIn('no cell finished', run.errors[0]['error'])
+            # the two cancelled cells
+            self.assertEqual(len(run.errors), 3)
+        finally:
+            started = time.time()
+            http.close()
+        self.assertLess(time.time() - started, 2)
+
+    def test_main_exits(self):
+        output = os.path.join(self.directory, 'report.json')
+        started = time.time()
+        status = isolation_matrix.main(
+            ['--url', self.server.url(), '--stall-timeout', '1',
+             '--strategy', 'full', '--concurrency', '2', '--output', output])
+        self.assertLess(time.time() - started, 10)
+        self.assertEqual(status, 1)
+        with open(output) as report:
+            self.assertEqual(json.load(report)['leaks'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+""" HDR-style latency histograms
+
+    Values are recorded in microseconds into log-linear buckets: every
+    power of two is split into a fixed number of linear sub-buckets, so
+    the relative error of any reported percentile is bounded by the
+    precision chosen up front while memory stays a few kilobytes no
+    matter how many samples are recorded.
+"""
+import math
+
+PERCENTILES = (50, 90, 95, 99, 99.9)
+
+
+class LatencyHistogram(object):
+    """ Records latencies with significant_figures decimal digits of
+        precision
+    """
+
+    def __init__(self, significant_figures=2):
+        sub_buckets = 2 * 10 ** significant_figures
+        self.sub_bits = int(math.ceil(math.log(sub_buckets, 2)))
+        self.sub_count = 1 << self.sub_bits
+        self.half_count = self.sub_count >> 1
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def _index(self, value):
+        shift = max(0, value.bit_length() - self.sub_bits)
+        if shift == 0:
+            return value
+        return shift * self.half_count + (value >> shift)
+
+    def _highest_equivalent(self, index):
+        if index < self.sub_count:
+            return index
+        shift, sub = divmod(index - self.sub_count, self.half_count)
+        shift += 1
+        return ((sub + self.half_count + 1) << shift) - 1
+
+    def record(self, seconds):
+        """ Records one latency given in seconds """
+        value = max(0, int(seconds * 1e6))
+        index = self._index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """ Adds the samples of another histogram of the same precision """
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percentile):
+        """ Returns the latency in seconds below which percentile percent
+            of the samples fall
+        """
+        if not self.count:
+            return 0.0
+        wanted = max(1, int(math.ceil(self.count * percentile / 100.0)))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= wanted:
+                return min(self._highest_equivalent(index), self.max) / 1e6
+        return self.max / 1e6
+
+    def summary(self):
+        """ Returns the count, mean, percentiles and max in milliseconds """
+        summary = {'count': self.count,
+                   'mean_ms': self.total / 1e3 / self.count if self.count else 0.0,
+                   'min_ms': (self.min or 0) / 1e3,
+                   'max_ms': self.max / 1e3}
+        for percentile in PERCENTILES:
+            key = 'p%s_ms' % ('%g' % percentile).replace('.', '')
+            summary[key] = self.percentile(percentile) * 1e3
+        return summary
+
+    def to_dict(self):
+        return {'significant_bits': self.sub_bits,
+                'counts': dict((str(k), v) for k, v in self.counts.items()),
+                'count': self.count, 'total': self.total,
+                'min': self.min, 'max': self.max}
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls()
+        histogram.sub_bits = data['significant_bits']
+        histogram.sub_count = 1 << histogram.sub_bits
+        histogram.half_count = histogram.sub_count >> 1
+        histogram.counts = dict((int(k), v) for k, v in data['counts'].items())
+        histogram.count = data['count']
+        histogram.total = data['total']
+        histogram.min = data['min']
+        histogram.max = data['max']
+        return histogram
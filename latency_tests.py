@@ -0,0 +1,85 @@
+import math
+import random
+import unittest
+
+import latency
+
+
+def _true_percentile(values, percentile):
+    """ The sample of rank ceil(count * percentile / 100), in microseconds """
+    values = sorted(int(v * 1e6) for v in values)
+    rank = max(1, int(math.ceil(len(values) * percentile / 100.0)))
+    return values[rank - 1]
+
+
+""" TestPercentileBounds checks that every reported percentile lies
+    within the histogram's precision of the exact one
+"""
+class TestPercentileBounds(unittest.TestCase):
+
+    def _assertWithinPrecision(self, histogram, values):
+        for percentile in latency.PERCENTILES + (1, 25, 75, 100):
+            exact = _true_percentile(values, percentile)
+            reported = histogram.percentile(percentile) * 1e6
+            # never below the exact value, at most one sub-bucket above
+            self.assertGreaterEqual(round(reported), exact, percentile)
+            self.assertLessEqual(round(reported),
+                                 exact + exact // histogram.half_count + 1,
+                                 percentile)
+            self.assertLessEqual(round(reported), histogram.max)
+
+    def test_uniform_samples(self):
+        rng = random.Random(1)
+        values = [rng.uniform(0.0005, 2.0) for _ in range(5000)]
+        histogram = latency.LatencyHistogram()
+        for value in values:
+            histogram.record(value)
+        self._assertWithinPrecision(histogram, values)
+
+    def test_long_tail_samples(self):
+        rng = random.Random(2)
+        values = [rng.expovariate(1 / 0.01) for _ in range(5000)]
+        values += [rng.uniform(5, 60) for _ in range(20)]
+        histogram = latency.LatencyHistogram(significant_figures=3)
+        for value in values:
+            histogram.record(value)
+        self._assertWithinPrecision(histogram, values)
+
+    def test_small_values_are_exact(self):
+        histogram = latency.LatencyHistogram()
+        for microseconds in range(1, 101):
+            histogram.record(microseconds / 1e6)
+        self.assertEqual(round(histogram.percentile(50) * 1e6), 50)
+        self.assertEqual(round(histogram.percentile(100) * 1e6), 100)
+
+    def test_empty_histogram(self):
+        histogram = latency.LatencyHistogram()
+        self.assertEqual(histogram.percentile(99), 0.0)
+        self.assertEqual(histogram.summary()['count'], 0)
+
+
+""" TestMerge checks that merged and serialized histograms report what
+    a single one recording every sample would
+"""
+class TestMerge(unittest.TestCase):
+
+    def test_merge_matches_single_histogram(self):
+        rng = random.Random(3)
+        values = [rng.uniform(0.001, 0.5) for _ in range(2000)]
+        single, first, second = [latency.LatencyHistogram() for _ in range(3)]
+        for i, value in enumerate(values):
+            single.record(value)
+            (first if i % 2 else second).record(value)
+        first.merge(second)
+        self.assertEqual(first.summary(), single.summary())
+
+    def test_dict_round_trip(self):
+        histogram = latency.LatencyHistogram()
+        for value in (0.001, 0.002, 0.25, 1.5):
+            histogram.record(value)
+        copy = latency.LatencyHistogram.from_dict(histogram.to_dict())
+        self.assertEqual(copy.summary(), histogram.summary())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+""" Modules imported on first use
+
+    pycurl costs tens of milliseconds to load, which adds up when the
+    suites or the fuzzer are started thousands of times by a driver, and
+    is wasted on runs that never send a request: listing tests, --help,
+    or an incremental_runner.py run that reuses every result.
+
+    pycurl = lazy_import.module('pycurl')
+
+    binds a stand-in that imports the real module the first time one of
+    its attributes is looked up and then takes over its namespace, so
+    later lookups cost no more than on the module itself. For optional
+    dependencies, available() tells whether the module can be imported
+    before any of its attributes is touched.
+"""
+import importlib
+import sys
+
+# Optional modules found missing, not looked for again
+_missing = set()
+
+
+class LazyModule(object):
+    """ Stands in for the named module until it is needed """
+
+    def __init__(self, name):
+        self.__dict__['_lazy_name'] = name
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self.__dict__['_lazy_name'])
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+    def __repr__(self):
+        return '<lazy module %r>' % self.__dict__['_lazy_name']
+
+
+def module(name):
+    """ Returns the named module if it is loaded, else a LazyModule """
+    return sys.modules.get(name) or LazyModule(name)
+
+
+def loaded(name):
+    """ Returns True once the named module has actually been imported """
+    return name in sys.modules
+
+
+def available(name):
+    """ Returns True if the named module can be imported, importing it
+        on the first call
+    """
+    if sys.modules.get(name) is not None:
+        return True
+    if name in _missing:
+        return False
+    try:
+        importlib.import_module(name)
+    except ImportError:
+        _missing.add(name)
+        return False
+    return True
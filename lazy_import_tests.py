@@ -0,0 +1,39 @@
+import os
+import subprocess
+import sys
+import unittest
+
+import lazy_import
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _loaded_after(statement, name):
+    """ Returns True if running statement in a fresh interpreter imports
+        the named module
+    """
+    output = subprocess.check_output(
+        [sys.executable, '-c', '%s; import sys; print(%r in sys.modules)'
+         % (statement, name)], cwd=HERE)
+    return output.strip() == b'True'
+
+
+""" TestLazyImport checks that optional and heavy modules are only
+    imported when first used
+"""
+class TestLazyImport(unittest.TestCase):
+
+    def test_feature_columns_does_not_import_numpy(self):
+        self.assertFalse(_loaded_after('import feature_columns', 'numpy'))
+
+    def test_transport_does_not_import_pycurl(self):
+        self.assertFalse(_loaded_after('import transport', 'pycurl'))
+
+    def test_available(self):
+        self.assertTrue(lazy_import.available('json'))
+        self.assertFalse(lazy_import.available('cobweb_no_such_module'))
+        self.assertFalse(lazy_import.available('cobweb_no_such_module'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,224 @@
+""" Load and soak generator for the PEP rewriting endpoint
+
+    Replays the request shapes of suite_config.py, round robin,
+    for a fixed duration, either open loop at a target request rate or
+    closed loop with a fixed number of requests in flight. Latency
+    percentiles, throughput and error rates are reported per request
+    shape as JSON so runs can be compared over time.
+
+    python load_generator.py --duration 300 --rate 50 --output run.json
+    python load_generator.py --url http://127.0.0.1:8099/echo/wfs \
+        --duration 10
+"""
+import argparse
+import json
+import platform
+import sys
+import threading
+import time
+
+import latency
+import lazy_import
+import scheduler
+import suite_config
+import transport
+
+pycurl = lazy_import.module('pycurl')
+
+
+def shape_requests(user=None, names=None, url=None):
+    """ Returns (shape name, Request) pairs for the rewriting suite's
+        request shapes, optionally restricted to names, sent to url or
+        the suite's WFS_POST_URL
+    """
+    if user is None:
+        user = suite_config.USER_UUID
+    if url is None:
+        url = suite_config.WFS_POST_URL
+    get_url = url + suite_config.WFS_URL[
+        len(suite_config.WFS_POST_URL):]
+    requests = []
+    for name, method, shape in suite_config.REQUEST_SHAPES:
+        if names and name not in names:
+            continue
+        if method == 'POST':
+            request = transport.post(url, shape,
+                                     ['Content-type: text/xml',
+                                      'uuid: %s' % user])
+        else:
+            request = transport.get(get_url + shape,
+                                    ['uuid: %s' % user])
+        requests.append((name, request))
+    return requests
+
+
+class ShapeStats(object):
+    """ Latency histogram and error counts for one request shape """
+
+    def __init__(self):
+        self.histogram = latency.LatencyHistogram()
+        self.errors = {}
+
+    def record(self, seconds, error):
+        self.histogram.record(seconds)
+        if error is not None:
+            self.errors[error] = self.errors.get(error, 0) + 1
+
+    def report(self, elapsed):
+        completed = self.histogram.count
+        failed = sum(self.errors.values())
+        return {'requests': completed,
+                'errors': failed,
+                'error_rate': float(failed) / completed if completed else 0.0,
+                'error_kinds': self.errors,
+                'throughput_rps': completed / elapsed if elapsed else 0.0,
+                'latency_ms': self.histogram.summary()}
+
+
+def _error_kind(pending):
+    try:
+        response = pending.result(0)
+    except pycurl.error as error:
+        return 'curl_%s' % error.args[0]
+    if response.status >= 400:
+        return 'http_%s' % response.status
+    return None
+
+
+class LoadRun(object):
+    """ Drives shape_requests() against the target for duration seconds
+
+        With rate set, requests are sent open loop on a fixed schedule
+        and latency is measured from the intended send time, so a
+        stalled PEP shows up in the percentiles instead of silently
+        lowering the offered load. Otherwise concurrency requests are
+        kept in flight.
+    """
+
+    def __init__(self, requests, http, duration, rate=None, concurrency=8):
+        self.requests = requests
+        self.http = http
+        self.duration = duration
+        self.rate = rate
+        self.concurrency = concurrency
+        self.stats = dict((name, ShapeStats()) for name, _ in requests)
+        self.started = None
+        self._next = 0
+        self._outstanding = 0
+        self._sending = True
+        self._lock = threading.Lock()
+        self._drained = threading.Event()
+        self._deadline = None
+
+    def _send(self, intended):
+        with self._lock:
+            name, request = self.requests[self._next % len(self.requests)]
+            self._next += 1
+            self._outstanding += 1
+
+        def done(pending):
+            self.stats[name].record(time.time() - intended,
+                                    _error_kind(pending))
+            if self.rate is None and time.time() < self._deadline:
+                self._send(time.time())
+            self._release()
+        self.http.submit(request, callback=done)
+
+    def _release(self):
+        with self._lock:
+            self._outstanding -= 1
+            if self._outstanding == 0 and not self._sending:
+                self._drained.set()
+
+    def run(self):
+        """ Generates the load and returns the elapsed seconds """
+        started = self.started = time.time()
+        self._deadline = started + self.duration
+        if self.rate is None:
+            for _ in range(self.concurrency):
+                self._send(time.time())
+        else:
+            interval = 1.0 / self.rate
+            sent = 0
+            while True:
+                intended = started + sent * interval
+                if intended >= self._deadline:
+                    break
+                delay = intended - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                self._send(intended)
+                sent += 1
+        with self._lock:
+            self._sending = False
+            if self._outstanding == 0:
+                self._drained.set()
+        self._drained.wait(max(60.0, self.duration))
+        return time.time() - started
+
+    def target(self):
+        """ Returns the endpoint the requests were sent to """
+        return ', '.join(sorted(set(request.url.partition('?')[0]
+                                    for _, request in self.requests)))
+
+    def report(self, elapsed):
+        overall = ShapeStats()
+        for stats in self.stats.values():
+            overall.histogram.merge(stats.histogram)
+            for kind, count in stats.errors.items():
+                overall.errors[kind] = overall.errors.get(kind, 0) + count
+        return {'started_at': time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                                            time.gmtime(self.started)),
+                'target': self.target(),
+                'mode': 'rate' if self.rate else 'concurrency',
+                'rate': self.rate,
+                'concurrency': None if self.rate else self.concurrency,
+                'duration_s': elapsed,
+                'host': platform.node(),
+                'shapes': dict((name, stats.report(elapsed))
+                               for name, stats in self.stats.items()),
+                'overall': overall.report(elapsed)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--url', default=suite_config.WFS_POST_URL,
+                        help='PEP WFS endpoint, COBWEB_WFS_URL by default')
+    parser.add_argument('--duration', type=float, default=60,
+                        help='seconds to generate load for')
+    parser.add_argument('--rate', type=float,
+                        help='open loop request rate per second')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='requests kept in flight when no rate is given')
+    parser.add_argument('--max-in-flight', type=int, default=64,
+                        help='connection limit of the scheduler')
+    parser.add_argument('--shapes', help='comma separated shape names')
+    parser.add_argument('--user', help='uuid header to send')
+    parser.add_argument('--output', help='write the JSON report here')
+    args = parser.parse_args(argv)
+
+    names = args.shapes.split(',') if args.shapes else None
+    requests = shape_requests(args.user, names, args.url.rstrip('?'))
+    if not requests:
+        parser.error('no request shapes selected')
+    http = scheduler.MultiTransport(
+        max_concurrent=max(args.max_in_flight, args.concurrency))
+    try:
+        run = LoadRun(requests, http, args.duration, args.rate,
+                      args.concurrency)
+        report = run.report(run.run())
+        report['transport'] = http.stats()
+    finally:
+        http.close()
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as out:
+            out.write(text + '\n')
+    else:
+        print(text)
+    return 1 if report['overall']['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
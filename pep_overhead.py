@@ -0,0 +1,313 @@
+""" Cost of the PEP: direct GeoServer requests against proxied ones
+
+    For each request type (plain, filtered, bbox, featureid, POST) the
+    same GetFeature is sent two ways: through the PEP with a uuid
+    header, and straight to the WFS behind it (GEOSERVER_WFS_URL) with
+    the userid filter the PEP would add built by the client with
+    rewriting.py. Trials interleave the two paths in random order, each
+    one a closed-loop burst, so drift in the network or the backend hits
+    both alike. Per request type the report gives the median latency of
+    each path, the latency the PEP adds and the share of throughput it
+    costs, with 95% confidence intervals over the paired trials.
+
+    python stub_server.py --port 8099 --latency-ms 5 &
+    COBWEB_WFS_URL=http://127.0.0.1:8099/wfs \
+    COBWEB_GEOSERVER_URL=http://127.0.0.1:8099/geoserver/wfs \
+        python pep_overhead.py --trials 20
+"""
+import argparse
+import json
+import math
+import random
+import sys
+import threading
+import time
+
+try:
+    from urllib import quote
+except ImportError:
+    from urllib.parse import quote
+
+import feature_stream
+import latency
+import rewriting
+import scheduler
+import suite_config
+import transport
+
+GET_FEATURE = 'request=GetFeature&service=WFS&version=1.1.0'
+# Seconds a burst may take before its unfinished requests count as errors
+BURST_TIMEOUT = 300
+# two-sided 95% Student t quantiles by degrees of freedom
+T_95 = {1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447,
+        7: 2.365, 8: 2.306, 9: 2.262, 10: 2.228, 12: 2.179, 15: 2.131,
+        20: 2.086, 25: 2.060, 30: 2.042, 40: 2.021, 60: 2.000, 120: 1.980}
+
+
+def request_types(survey, featureid):
+    """ Returns (name, query string or POST body) for each request type """
+    bbox = ','.join(str(x) for x in suite_config.BBOX_CONTAINS_OBS)
+    post = ('<wfs:GetFeature service="WFS" version="1.1.0"'
+            ' xmlns:wfs="http://www.opengis.net/wfs"'
+            ' xmlns:ogc="http://www.opengis.net/ogc">'
+            '<wfs:Query typeName="%s"><ogc:Filter><ogc:PropertyIsEqualTo>'
+            '<ogc:PropertyName>%s</ogc:PropertyName><ogc:Literal>%s'
+            '</ogc:Literal></ogc:PropertyIsEqualTo></ogc:Filter></wfs:Query>'
+            '</wfs:GetFeature>' % (survey, suite_config.FILTER_ATTR,
+                                   suite_config.FILTER_VAL))
+    equal = ('Filter=<Filter><PropertyIsEqualTo><PropertyName>%s</PropertyName>'
+             '<Literal>%s</Literal></PropertyIsEqualTo></Filter>'
+             % (suite_config.FILTER_ATTR, suite_config.FILTER_VAL))
+    return [
+        ('plain', 'typeName=%s' % survey),
+        ('filtered', 'typeName=%s&%s' % (survey, equal)),
+        ('bbox', 'typeName=%s&bbox=%s' % (survey, bbox)),
+        ('featureid', 'typeName=%s&featureid=%s' % (survey, featureid)),
+        ('post', post),
+    ]
+
+
+def direct_query(query, user):
+    """ Returns the query string for the WFS behind the PEP, with the
+        userid filter the PEP would add
+    """
+    params = rewriting.parse_query(query)
+    typeNames, filters = rewriting.query_filters(params, user)
+    kept = ['%s=%s' % (quote(key), quote(value, safe=',:'))
+            for key, value in params
+            if key.lower() not in rewriting.SPATIAL_PARAMETERS]
+    filters = ','.join('(%s)' % rewriting.serialize(f) for f in filters)
+    if not isinstance(filters, bytes):
+        filters = filters.encode('utf-8')
+    return '&'.join(kept + ['FILTER=' + quote(filters, safe='')])
+
+
+def paths(name, data, user, pep_url, direct_url):
+    """ Returns the (PEP, direct) Requests for one request type """
+    if name == 'post':
+        direct = rewriting.rewrite_post(data, user)
+        if not isinstance(direct, bytes):
+            direct = direct.encode('utf-8')
+        return (transport.post(pep_url, data, ['Content-type: text/xml',
+                                               'uuid: %s' % user]),
+                transport.post(direct_url, direct, ['Content-type: text/xml']))
+    return (transport.get('%s?%s&%s' % (pep_url, GET_FEATURE, data),
+                          ['uuid: %s' % user]),
+            transport.get('%s?%s' % (direct_url,
+                                     direct_query('%s&%s' % (GET_FEATURE, data),
+                                                  user))))
+
+
+def mean_ci(samples):
+    """ Returns the mean of samples and the half width of its 95%
+        confidence interval
+    """
+    count = len(samples)
+    if not count:
+        return 0.0, 0.0
+    mean = sum(samples) / float(count)
+    if count < 2:
+        return mean, float('inf')
+    variance = sum((x - mean) ** 2 for x in samples) / (count - 1)
+    df = count - 1
+    t = T_95[max(k for k in T_95 if k <= df)] if df < 120 else 1.96
+    return mean, t * math.sqrt(variance / count)
+
+
+def burst(http, request, count, concurrency, timeout=BURST_TIMEOUT):
+    """ Sends count copies of request with concurrency in flight and
+        returns (LatencyHistogram, requests per second, errors). Requests
+        that have not finished after timeout seconds are cancelled and
+        counted as errors, and no more are sent.
+    """
+    histogram = latency.LatencyHistogram()
+    lock = threading.Lock()
+    done = threading.Event()
+    state = {'sent': 0, 'finished': 0, 'errors': 0, 'stopped': False}
+    in_flight = set()
+
+    def send():
+        with lock:
+            if state['sent'] >= count:
+                return
+            state['sent'] += 1
+        started = time.time()
+
+        def finished(pending):
+            elapsed = time.time() - started
+            try:
+                failed = pending.result(0).status >= 400
+            except Exception:
+                failed = True
+            with lock:
+                in_flight.discard(pending)
+                if state['stopped']:
+                    return
+                histogram.record(elapsed)
+                state['finished'] += 1
+                state['errors'] += failed
+                last = state['finished'] == count
+            if last:
+                done.set()
+            else:
+                send()
+        pending = http.submit(request, callback=finished)
+        with lock:
+            if not pending.done():
+                in_flight.add(pending)
+
+    started = time.time()
+    for _ in range(min(concurrency, count)):
+        send()
+    if not done.wait(timeout):
+        with lock:
+            # stop the requests still in flight from sending more
+            state['sent'] = count
+            state['stopped'] = True
+            result = (histogram, state['finished'] / (time.time() - started),
+                      state['errors'] + count - state['finished'])
+            pending = list(in_flight)
+        http.cancel(pending)
+        return result
+    return histogram, count / (time.time() - started), state['errors']
+
+
+def check_equivalent(name, pep, direct, user, http):
+    """ Raises if the two paths do not return the same features """
+    counts = []
+    for request in (pep, direct):
+        validator = feature_stream.FeatureStreamValidator(user)
+        feature_stream.validate(request, validator, http)
+        counts.append((validator.features, validator.violations))
+    if counts[0] != counts[1]:
+        raise AssertionError('%s: PEP returned %d features, the WFS %d' % (
+            name, counts[0][0], counts[1][0]))
+
+
+class Comparison(object):
+    """ Paired trial results for one request type """
+
+    def __init__(self, name):
+        self.name = name
+        self.latency = {'pep': latency.LatencyHistogram(),
+                        'direct': latency.LatencyHistogram()}
+        self.added_ms = []
+        self.lost_throughput = []
+        self.throughput = {'pep': [], 'direct': []}
+        self.errors = {'pep': 0, 'direct': 0}
+
+    def add_trial(self, results):
+        for path, (histogram, rps, errors) in results.items():
+            self.latency[path].merge(histogram)
+            self.throughput[path].append(rps)
+            self.errors[path] += errors
+        self.added_ms.append((results['pep'][0].percentile(50) -
+                              results['direct'][0].percentile(50)) * 1000)
+        direct_rps = results['direct'][1]
+        self.lost_throughput.append(
+            (direct_rps - results['pep'][1]) / direct_rps * 100)
+
+    def report(self):
+        added, added_ci = mean_ci(self.added_ms)
+        lost, lost_ci = mean_ci(self.lost_throughput)
+        return {'request_type': self.name,
+                'trials': len(self.added_ms),
+                'direct_p50_ms': self.latency['direct'].percentile(50) * 1000,
+                'pep_p50_ms': self.latency['pep'].percentile(50) * 1000,
+                'direct_p95_ms': self.latency['direct'].percentile(95) * 1000,
+                'pep_p95_ms': self.latency['pep'].percentile(95) * 1000,
+                'added_ms': added, 'added_ms_ci95': added_ci,
+                'direct_rps': mean_ci(self.throughput['direct'])[0],
+                'pep_rps': mean_ci(self.throughput['pep'])[0],
+                'lost_throughput_pct': lost,
+                'lost_throughput_pct_ci95': lost_ci,
+                'errors': self.errors}
+
+
+def run(types, user, pep_url, direct_url, trials, count, concurrency,
+        seed=0, check=True):
+    """ Runs the interleaved trials and returns one Comparison per type """
+    rng = random.Random(seed)
+    clients = {'pep': scheduler.MultiTransport(max_concurrent=concurrency),
+               'direct': scheduler.MultiTransport(max_concurrent=concurrency)}
+    try:
+        requests = {}
+        for name, data in types:
+            pep, direct = paths(name, data, user, pep_url, direct_url)
+            requests[name] = {'pep': pep, 'direct': direct}
+            if check:
+                check_equivalent(name, pep, direct, user, clients['pep'])
+            # warm both connection pools before measuring
+            for path in ('pep', 'direct'):
+                burst(clients[path], requests[name][path], concurrency,
+                      concurrency)
+        comparisons = dict((name, Comparison(name)) for name, _ in types)
+        for _ in range(trials):
+            order = [name for name, _ in types]
+            rng.shuffle(order)
+            for name in order:
+                results = {}
+                for path in rng.sample(['pep', 'direct'], 2):
+                    results[path] = burst(clients[path], requests[name][path],
+                                          count, concurrency)
+                comparisons[name].add_trial(results)
+        return [comparisons[name] for name, _ in types]
+    finally:
+        for http in clients.values():
+            http.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--pep', default=suite_config.WFS_POST_URL,
+                        help='PEP WFS endpoint, COBWEB_WFS_URL by default')
+    parser.add_argument('--direct',
+                        default=suite_config.GEOSERVER_WFS_URL,
+                        help='WFS behind the PEP, COBWEB_GEOSERVER_URL '
+                             'by default')
+    parser.add_argument('--user', default=suite_config.USER1)
+    parser.add_argument('--survey', default=suite_config.SURVEY1)
+    parser.add_argument('--featureid',
+                        help='feature id for the featureid type, the '
+                             "survey's first feature by default")
+    parser.add_argument('--types', help='comma separated request types')
+    parser.add_argument('--trials', type=int, default=10)
+    parser.add_argument('--requests', type=int, default=20,
+                        help='requests per path in each trial')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-check', action='store_true',
+                        help='skip checking that both paths agree')
+    parser.add_argument('--json', help='write the results here as JSON')
+    args = parser.parse_args(argv)
+
+    featureid = args.featureid or args.survey.rpartition(':')[2] + '.1'
+    types = request_types(args.survey, featureid)
+    if args.types:
+        wanted = args.types.split(',')
+        types = [t for t in types if t[0] in wanted]
+    comparisons = run(types, args.user, args.pep.rstrip('?'),
+                      args.direct.rstrip('?'), args.trials, args.requests,
+                      args.concurrency, args.seed, not args.no_check)
+    results = [c.report() for c in comparisons]
+
+    print('%-10s %10s %10s %18s %10s %10s %18s' % (
+        'type', 'direct ms', 'PEP ms', 'added ms', 'direct/s', 'PEP/s',
+        'lost throughput'))
+    for r in results:
+        print('%-10s %10.2f %10.2f %10.2f +-%5.2f %10.0f %10.0f %9.1f%% +-%4.1f'
+              % (r['request_type'], r['direct_p50_ms'], r['pep_p50_ms'],
+                 r['added_ms'], r['added_ms_ci95'], r['direct_rps'],
+                 r['pep_rps'], r['lost_throughput_pct'],
+                 r['lost_throughput_pct_ci95']))
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump({'pep': args.pep, 'direct': args.direct,
+                       'trials': args.trials, 'requests': args.requests,
+                       'concurrency': args.concurrency, 'results': results},
+                      out, indent=2)
+    return 1 if any(sum(r['errors'].values()) for r in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,36 @@
+import time
+import unittest
+
+import pep_overhead
+import scheduler
+import stub_server
+import transport
+
+
+""" TestBurstTimeout checks that a burst against a server that never
+    answers gives up and leaves nothing registered, without a PEP
+"""
+class TestBurstTimeout(unittest.TestCase):
+
+    def setUp(self):
+        self.server = stub_server.SilentServer()
+        self.http = scheduler.MultiTransport(max_concurrent=2)
+
+    def tearDown(self):
+        self.http.close()
+        self.server.close()
+
+    def test_unfinished_requests_are_cancelled(self):
+        histogram, rps, errors = pep_overhead.burst(
+            self.http, transport.get(self.server.url()), 5, 2, timeout=1)
+        self.assertEqual(errors, 5)
+        self.assertEqual(rps, 0)
+        # cancelled requests are not recorded as latencies
+        self.assertEqual(histogram.summary()['count'], 0)
+        started = time.time()
+        self.http.close()
+        self.assertLess(time.time() - started, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
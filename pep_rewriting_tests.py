@@ -1,64 +1,55 @@
+import sys
 import unittest
-import pycurl
 
-from StringIO import StringIO
+import environment
+import request_timing
+import scheduler
+import transport
+import xml_compare
 
-WFS_POST_URL = "https://dyfi.cobwebproject.eu/test/service/wfs"
-WFS_URL = "https://dyfi.cobwebproject.eu/test/service/wfs?request=GetFeature&service=WFS&version=1.1.0&"
-
-USER_UUID = "040522c4-e3d6-0ec7-0124-dc64602b9346"
-SURVEY_1 = "cobweb:sid-78cd6e23-583a-4ba7-ac52-9c56e492d59c"
-SURVEY_2 = "cobweb:sid-f629c133-d4af-45ce-9e8b-97545abd61cc"
-
-GEOSERVER_WFS_URL = "http://localhost:8020/geoserver/cobweb/wfs?"
+# The target, user and request shapes live in suite_config.py, set
+# COBWEB_WFS_URL to test another deployment such as stub_server.py
+from suite_config import (WFS_POST_URL, WFS_URL, USER_UUID, SINGLE_TYPE_NAME,
+                          MULTIPLE_TYPE_NAMES, SINGLE_FILTER, MULTIPLE_FILTERS,
+                          SINGLE_BBOX, MULTIPLE_BBOX, SINGLE_FEATURE_ID,
+                          MULTIPLE_FEATURE_IDS, POST_GET_FEATURE)
 
 
 def get_request(url):
-    buf = StringIO()
-    c = pycurl.Curl()
-    c.setopt(c.URL, url)
-    c.setopt(pycurl.SSL_VERIFYPEER, 0)
-    c.setopt(pycurl.SSL_VERIFYHOST, 0)
-    c.setopt(c.WRITEDATA, buf)
-    c.setopt(pycurl.HTTPHEADER, ['uuid: %s'%USER_UUID])
-    c.perform()
-    c.close()
-    return buf.getvalue()
+    request = transport.get(url, ['uuid: %s'%USER_UUID])
+    return transport.default_transport().perform(request).body
 
 
 def post_request(payload):
-    buf = StringIO()
-    c = pycurl.Curl()
-    c.setopt(c.URL, WFS_POST_URL)
-    c.setopt(c.POSTFIELDS, payload)
-    c.setopt(pycurl.SSL_VERIFYPEER, 0)
-    c.setopt(pycurl.SSL_VERIFYHOST, 0)
-    c.setopt(pycurl.HTTPHEADER, ['Content-type: text/xml', 'uuid: %s'%USER_UUID])
-    c.setopt(c.WRITEDATA, buf)
-    c.perform()
-    c.close()
-    return buf.getvalue()
+    request = transport.post(WFS_POST_URL, payload,
+                             ['Content-type: text/xml', 'uuid: %s'%USER_UUID])
+    return transport.default_transport().perform(request).body
 
 
 def print_live_or_dev():
-    import socket
-    address = socket.gethostbyname_ex('dyfi.cobwebproject.eu')
-    print(address[2][0])
-    if '192.168.10.100' in address[2]:
-        print("Testing on DEV!")
-    else:
-        print("Testing on LIVE!")
+    print(environment.describe(WFS_POST_URL))
+
+
+class RewritingTestCase(unittest.TestCase):
+    """ Compares echoed requests with their fixtures structurally, so
+        prefix and whitespace changes in the PEP output do not fail
+    """
 
+    def assertRewritten(self, result, desiredResult):
+        difference = xml_compare.difference(desiredResult, result)
+        if difference is not None:
+            self.fail(difference)
 
-class TestSimpleGetFeature(unittest.TestCase):
+
+class TestSimpleGetFeature(RewritingTestCase):
     def test_single_type_name(self):
         desiredResult = 'request=GetFeature;service=WFS;version=1.1.0;typeName=' \
                         'A;FILTER=(<fes:Filter xmlns:fes="http://www.opengis.net' \
                         '/ogc"><fes:PropertyIsEqualTo><fes:PropertyName>userid</' \
                         'fes:PropertyName><fes:Literal>Joe</fes:Literal></fes:Pro' \
                         'pertyIsEqualTo></fes:Filter>)'
-        result = get_request(WFS_URL + "typeName=A")
-        self.assertEqual(result, desiredResult)   
+        result = get_request(WFS_URL + SINGLE_TYPE_NAME)
+        self.assertRewritten(result, desiredResult)   
 
     def test_multiple_type_names(self):
         desiredResult = 'request=GetFeature;service=WFS;version=1.1.0;typeName=A,B' \
@@ -69,11 +60,11 @@ class TestSimpleGetFeature(unittest.TestCase):
                         '/ogc"><fes:PropertyIsEqualTo><fes:PropertyName>userid</fes:' \
                         'PropertyName><fes:Literal>Joe</fes:Literal></fes:PropertyIs' \
                         'EqualTo></fes:Filter>)'
-        result = get_request(WFS_URL + "typeName=A,B")
-        self.assertEqual(result, desiredResult)
+        result = get_request(WFS_URL + MULTIPLE_TYPE_NAMES)
+        self.assertRewritten(result, desiredResult)
         
 
-class TestFilteredGetFeature(unittest.TestCase):
+class TestFilteredGetFeature(RewritingTestCase):
 
     def test_single_type_name_filter(self):
         desiredResult = 'request=GetFeature;service=WFS;version=1.1.0;typeName=' \
@@ -81,8 +72,8 @@ class TestFilteredGetFeature(unittest.TestCase):
                         's="http://www.opengis.net/ogc"><fes:PropertyName>useri' \
                         'd</fes:PropertyName><fes:Literal>Joe</fes:Literal></fe' \
                         's:PropertyIsEqualTo><F1/></And></Filter>)'
-        result = get_request(WFS_URL + "typeName=A&filter=<Filter><F1/></Filter>")
-        self.assertEqual(result, desiredResult)
+        result = get_request(WFS_URL + SINGLE_FILTER)
+        self.assertRewritten(result, desiredResult)
         
     def test_multiple_name_filter(self):
         desiredResult = 'request=GetFeature;service=WFS;version=1.1.0;typeName=' \
@@ -94,12 +85,11 @@ class TestFilteredGetFeature(unittest.TestCase):
                         'is.net/ogc"><fes:PropertyName>userid</fes:PropertyName' \
                         '><fes:Literal>Joe</fes:Literal></fes:PropertyIsEqualTo' \
                         '><F2/></And></Filter>)'
-        result = get_request(WFS_URL + "typeName=A,B&filter=(<Filter><F1/></" \
-                                "Filter>),(<Filter><F2/></Filter>)")
-        self.assertEqual(result, desiredResult)
+        result = get_request(WFS_URL + MULTIPLE_FILTERS)
+        self.assertRewritten(result, desiredResult)
 
         
-class TestBoundedGetFeature(unittest.TestCase):
+class TestBoundedGetFeature(RewritingTestCase):
     
     def test_single_type_name(self):
         desiredResult = 'request=GetFeature;service=WFS;version=1.1.0;typeName=' \
@@ -113,8 +103,8 @@ class TestBoundedGetFeature(unittest.TestCase):
                         'opengis.net/ogc"><fes:PropertyName>userid</fes:Propert' \
                         'yName><fes:Literal>Joe</fes:Literal></fes:PropertyIsEq' \
                         'ualTo></fes:And></fes:Filter>)'
-        result = get_request(WFS_URL + "typeName=A&bbox=0,1,2,3")
-        self.assertEqual(result, desiredResult)
+        result = get_request(WFS_URL + SINGLE_BBOX)
+        self.assertRewritten(result, desiredResult)
         
     def test_multiple_type_name(self):
         desiredResult = 'request=GetFeature;service=WFS;version=1.1.0;typeName=' \
@@ -131,11 +121,11 @@ class TestBoundedGetFeature(unittest.TestCase):
                         's="http://www.opengis.net/ogc"><fes:And xmlns:fes="htt' \
                         'p://www.opengis.net/ogc"><fes:BBOX xmlns:fes="http://w' \
                         'ww.opengis.net/ogc"><gml:Envelope xmlns:gml="http://www.opengis.net/gml" srsName="EPSG:4326"><gml:lowerCorner>0 1</gml:lowerCorner><gml:upperCorner>2 3</gml:upperCorner></gml:Envelope></fes:BBOX><fes:PropertyIsEqualTo xmlns:fes="http://www.opengis.net/ogc"><fes:PropertyName>userid</fes:PropertyName><fes:Literal>Joe</fes:Literal></fes:PropertyIsEqualTo></fes:And></fes:Filter>)'
-        result = get_request(WFS_URL + "typeName=A,B&bbox=0,1,2,3")
-        self.assertEqual(result, desiredResult)
+        result = get_request(WFS_URL + MULTIPLE_BBOX)
+        self.assertRewritten(result, desiredResult)
 
 
-class TestFeatureIDGetFeature(unittest.TestCase):
+class TestFeatureIDGetFeature(RewritingTestCase):
     
     def test_single_feature(self):
         desiredResult = 'request=GetFeature;service=WFS;version=1.1.0;typeName=' \
@@ -146,8 +136,8 @@ class TestFeatureIDGetFeature(unittest.TestCase):
                         '://www.opengis.net/ogc"><fes:PropertyName>userid</fes:' \
                         'PropertyName><fes:Literal>Joe</fes:Literal></fes:Prope' \
                         'rtyIsEqualTo></fes:And></fes:Filter>)'
-        result = get_request(WFS_URL + "typeName=A&featureid=id_4711")
-        self.assertEqual(result, desiredResult)
+        result = get_request(WFS_URL + SINGLE_FEATURE_ID)
+        self.assertRewritten(result, desiredResult)
         
     def test_multiple_features(self):
         desiredResult = 'request=GetFeature;service=WFS;version=1.1.0;typeName=' \
@@ -159,19 +149,27 @@ class TestFeatureIDGetFeature(unittest.TestCase):
                         'xmlns:fes="http://www.opengis.net/ogc"><fes:PropertyNa' \
                         'me>userid</fes:PropertyName><fes:Literal>Joe</fes:Lite' \
                         'ral></fes:PropertyIsEqualTo></fes:And></fes:Filter>)'
-        result = get_request(WFS_URL + "typeName=A&featureid=id_4711,id_4712")
-        self.assertEqual(result, desiredResult)
+        result = get_request(WFS_URL + MULTIPLE_FEATURE_IDS)
+        self.assertRewritten(result, desiredResult)
 
 
-class TestPostFeature(unittest.TestCase):
+class TestPostFeature(RewritingTestCase):
     
     def test_single_feature(self):
         desiredResult = '<wfs:GetFeature xmlns:wfs="http://www.opengis.net/wfs" xmlns:ogc="http://www.opengis.net/ogc" xmlns:myns="http://www.example.com/myns" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" service="WFS" version="1.0.0" xsi:schemaLocation="http://www.opengis.net/wfs ../wfs/1.0.0/WFS-basic.xsd">    <wfs:Query typeName="A"><fes:Filter xmlns:fes="http://www.opengis.net/ogc"><fes:PropertyIsEqualTo><fes:PropertyName>userid</fes:PropertyName><fes:Literal>Joe</fes:Literal></fes:PropertyIsEqualTo></fes:Filter></wfs:Query>    <wfs:Query typeName="B">     <ogc:Filter><And><fes:PropertyIsEqualTo xmlns:fes="http://www.opengis.net/ogc"><fes:PropertyName>userid</fes:PropertyName><fes:Literal>Joe</fes:Literal></fes:PropertyIsEqualTo><ogc:F1 xmlns:ogc="http://www.opengis.net/ogc"/></And></ogc:Filter>    </wfs:Query>    <wfs:Query typeName="C">     <ogc:Filter><ogc:And><ogc:F2/><ogc:F3/><fes:PropertyIsEqualTo xmlns:fes="http://www.opengis.net/ogc"><fes:PropertyName>userid</fes:PropertyName><fes:Literal>Joe</fes:Literal></fes:PropertyIsEqualTo></ogc:And></ogc:Filter>    </wfs:Query>    <wfs:Query typeName="D"><fes:Filter xmlns:fes="http://www.opengis.net/ogc"><fes:PropertyIsEqualTo><fes:PropertyName>userid</fes:PropertyName><fes:Literal>Joe</fes:Literal></fes:PropertyIsEqualTo></fes:Filter></wfs:Query> </wfs:GetFeature>'
-        requestXml = '<wfs:GetFeature   service="WFS"   version="1.1.0"   xmlns:wfs="http://www.opengis.net/wfs"   xmlns:ogc="http://www.opengis.net/ogc"   xmlns:myns="http://www.example.com/myns"   xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"   xsi:schemaLocation="http://www.opengis.net/wfs ../wfs/1.1.0/WFS-basic.xsd">   <wfs:Query typeName="A"/>   <wfs:Query typeName="B">    <ogc:Filter><ogc:F1/></ogc:Filter>   </wfs:Query>   <wfs:Query typeName="C">    <ogc:Filter><ogc:And><ogc:F2/><ogc:F3/></ogc:And></ogc:Filter>   </wfs:Query>   <wfs:Query typeName="D"/></wfs:GetFeature>'
-        result = post_request(requestXml)
-        self.assertEqual(result, desiredResult)
+        result = post_request(POST_GET_FEATURE)
+        self.assertRewritten(result, desiredResult)
         
 if __name__ == '__main__':
-    print_live_or_dev()
+    # resolved while the tests run, reported at the end
+    environment.start(WFS_POST_URL)
     # TODO: Add tests for AccessDenied requests
-    unittest.main()
+    concurrency = scheduler.configured_concurrency()
+    if concurrency > 1:
+        result = scheduler.run_tests(sys.modules[__name__], concurrency)
+    else:
+        result = unittest.main(exit=False,
+                               testRunner=request_timing.TimedTestRunner).result
+        print(transport.default_transport().report())
+    print_live_or_dev()
+    sys.exit(not result.wasSuccessful())
@@ -0,0 +1,385 @@
+""" Performance regression check against a stored baseline
+
+    Runs a fixed workload of the rewriting suite's request shapes (one
+    and several typeNames, filters, bboxes, featureids and the POST
+    GetFeature) against a target: --requests per shape with
+    --concurrency in flight, repeated --rounds times with the shapes in
+    a different order each round. Per shape the p95 latency and the
+    throughput of every round are kept, with their medians over the
+    rounds, which are far steadier than a single burst.
+
+    --save writes the results as the baseline, together with the
+    workload and the environment they were measured in: Python, host,
+    CPUs, pycurl and the git commit. Results with failed requests are
+    not saved. Without --save the results are compared with the stored
+    baseline and the run fails if any shape's median p95 grew, or its
+    throughput fell, by more than the tolerances and by more than the
+    round-to-round spread explains. The difference of the means over
+    the rounds has to exceed the half width of its 95% confidence
+    interval, and it has to be at least --min-effect-size pooled
+    standard deviations of the rounds, so a change the confidence
+    interval barely excludes does not fail the run. Both need
+    spread to estimate, so at least MIN_ROUNDS rounds are required. A
+    change beyond the tolerance but within the spread is reported as
+    noisy. Baselines of
+    another format version or workload are refused rather than compared;
+    a different environment is reported but compared all the same.
+
+    python perf_regression.py --stub --save
+    python perf_regression.py --stub
+    python perf_regression.py --url https://pep.example/wfs \
+        --baseline baselines/test-deployment.json --p95-tolerance 0.3
+
+    --stub starts stub_server.py in a separate process and benchmarks
+    its rewriting endpoint, so the server does not compete with the
+    load generator for the interpreter lock. It catches regressions in
+    rewriting.py but its absolute numbers say little about a real PEP.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import lazy_import
+import load_generator
+import pep_overhead
+import scheduler
+import suite_config
+
+pycurl = lazy_import.module('pycurl')
+
+FORMAT_VERSION = 2
+DEFAULT_BASELINE = 'perf_baseline.json'
+# Rounds needed before a shape can be flagged as regressed
+MIN_ROUNDS = 5
+# Smallest difference, in pooled standard deviations of the rounds,
+# that counts as a regression
+MIN_EFFECT_SIZE = 1.0
+# Keys of the workload that must match for results to be comparable
+WORKLOAD_KEYS = ('requests', 'concurrency', 'rounds', 'shapes')
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def _git_commit():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            output = subprocess.check_output(
+                ['git', 'rev-parse', '--short', 'HEAD'], stderr=devnull,
+                cwd=os.path.dirname(os.path.abspath(__file__)))
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode('ascii').strip()
+
+
+def _cpu_count():
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        return None
+
+
+def environment(target):
+    """ Returns the metadata stored alongside results """
+    return {'target': target,
+            'python': '%s %s' % (platform.python_implementation(),
+                                 platform.python_version()),
+            'platform': platform.platform(),
+            'host': platform.node(),
+            'cpus': _cpu_count(),
+            'pycurl': pycurl.version,
+            'commit': _git_commit()}
+
+
+def measure(requests, http, count, concurrency, rounds, seed=0):
+    """ Returns per shape name the p95 latency in ms and the throughput
+        of each round, their medians and that of p50, and the errors
+        over rounds bursts
+    """
+    rng = random.Random(seed)
+    samples = dict((name, []) for name, _ in requests)
+    for name, request in requests:
+        # warm the connection pool before measuring
+        pep_overhead.burst(http, request, concurrency, concurrency)
+    for _ in range(rounds):
+        order = list(requests)
+        rng.shuffle(order)
+        for name, request in order:
+            samples[name].append(pep_overhead.burst(http, request, count,
+                                                    concurrency))
+    results = {}
+    for name, bursts in samples.items():
+        p95 = [h.percentile(95) * 1000 for h, _, _ in bursts]
+        throughput = [rps for _, rps, _ in bursts]
+        results[name] = {
+            'p50_ms': _median([h.percentile(50) for h, _, _ in bursts]) * 1000,
+            'p95_ms': _median(p95),
+            'p95_rounds_ms': p95,
+            'throughput_rps': _median(throughput),
+            'throughput_rounds': throughput,
+            'errors': sum(errors for _, _, errors in bursts)}
+    return results
+
+
+def beyond_noise(lower, higher):
+    """ Returns True if the mean of the samples in higher exceeds that of
+        lower by more than the half width of the 95% confidence interval
+        of their difference
+    """
+    lower_mean, lower_ci = pep_overhead.mean_ci(lower)
+    higher_mean, higher_ci = pep_overhead.mean_ci(higher)
+    return higher_mean - lower_mean > math.sqrt(lower_ci ** 2 + higher_ci ** 2)
+
+
+def effect_size(lower, higher):
+    """ Returns how far the mean of higher exceeds that of lower, in
+        pooled standard deviations of the samples (Cohen's d)
+    """
+    variances = []
+    for samples in (lower, higher):
+        mean = sum(samples) / float(len(samples))
+        variances.append(sum((x - mean) ** 2 for x in samples) /
+                         (len(samples) - 1))
+    pooled = math.sqrt(((len(lower) - 1) * variances[0] +
+                        (len(higher) - 1) * variances[1]) /
+                       (len(lower) + len(higher) - 2))
+    difference = (sum(higher) / float(len(higher)) -
+                  sum(lower) / float(len(lower)))
+    if not pooled:
+        return float('inf') if difference > 0 else 0.0
+    return difference / pooled
+
+
+def significant(lower, higher, min_effect_size):
+    """ Returns True if higher exceeds lower beyond the noise and by at
+        least min_effect_size
+    """
+    return (beyond_noise(lower, higher) and
+            effect_size(lower, higher) >= min_effect_size)
+
+
+def compare(baseline, results, p95_tolerance, throughput_tolerance,
+            min_effect_size=MIN_EFFECT_SIZE):
+    """ Returns (rows, regressions): a row per shape comparing results
+        with baseline, and the descriptions of the regressions
+    """
+    rows = []
+    regressions = []
+    for name in sorted(results):
+        current = results[name]
+        before = baseline['results'].get(name)
+        row = {'shape': name, 'current': current, 'baseline': before,
+               'status': 'ok'}
+        rows.append(row)
+        problems = []
+        if current['errors']:
+            problems.append('%d errors' % current['errors'])
+        if before is None:
+            row['status'] = 'new'
+        else:
+            p95_change = current['p95_ms'] / before['p95_ms'] - 1
+            rps_change = current['throughput_rps'] / before['throughput_rps'] - 1
+            row['p95_change'] = p95_change
+            row['throughput_change'] = rps_change
+            noisy = False
+            if p95_change > p95_tolerance:
+                if significant(before['p95_rounds_ms'],
+                               current['p95_rounds_ms'], min_effect_size):
+                    problems.append('p95 %.2f ms -> %.2f ms (+%.0f%%, limit '
+                                    '+%.0f%%)' % (before['p95_ms'],
+                                                  current['p95_ms'],
+                                                  p95_change * 100,
+                                                  p95_tolerance * 100))
+                else:
+                    noisy = True
+            if -rps_change > throughput_tolerance:
+                if significant(current['throughput_rounds'],
+                               before['throughput_rounds'], min_effect_size):
+                    problems.append('throughput %.0f/s -> %.0f/s (%.0f%%, '
+                                    'limit -%.0f%%)' % (
+                                        before['throughput_rps'],
+                                        current['throughput_rps'],
+                                        rps_change * 100,
+                                        throughput_tolerance * 100))
+                else:
+                    noisy = True
+            if noisy:
+                row['status'] = 'noisy'
+        if problems:
+            row['status'] = 'REGRESSED'
+            regressions.extend('%s: %s' % (name, p) for p in problems)
+    return rows, regressions
+
+
+def environment_differences(baseline, current):
+    return ['%s: %s -> %s' % (key, baseline['environment'].get(key),
+                              current.get(key))
+            for key in sorted(current)
+            if key != 'commit' and baseline['environment'].get(key) !=
+            current.get(key)]
+
+
+def load_baseline(path):
+    """ Returns the stored baseline, raising ValueError if it is of
+        another format version
+    """
+    with open(path) as data:
+        baseline = json.load(data)
+    if baseline.get('format') != FORMAT_VERSION:
+        raise ValueError('%s has format %s, this version reads %d; '
+                         'rerun with --save' % (path, baseline.get('format'),
+                                                FORMAT_VERSION))
+    return baseline
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--url', default=suite_config.WFS_POST_URL,
+                        help='PEP WFS endpoint, COBWEB_WFS_URL by default')
+    parser.add_argument('--stub', action='store_true',
+                        help='benchmark stub_server.py in a separate process')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save', action='store_true',
+                        help='store the results as the new baseline')
+    parser.add_argument('--shapes', help='comma separated shape names')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='requests per shape in each round')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--rounds', type=int, default=7)
+    parser.add_argument('--p95-tolerance', type=float, default=0.25,
+                        help='allowed relative growth of p95 latency')
+    parser.add_argument('--throughput-tolerance', type=float, default=0.2,
+                        help='allowed relative drop of throughput')
+    parser.add_argument('--min-effect-size', type=float,
+                        default=MIN_EFFECT_SIZE,
+                        help='smallest regression, in standard deviations '
+                             'of the rounds, that fails the run')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    if args.rounds < MIN_ROUNDS:
+        parser.error('--rounds must be at least %d to estimate the spread'
+                     % MIN_ROUNDS)
+
+    names = args.shapes.split(',') if args.shapes else None
+    if names and not load_generator.shape_requests(names=names):
+        parser.error('no request shapes selected')
+    server = None
+    url = target = args.url.rstrip('?')
+    if args.stub:
+        import stub_server
+        server, url = stub_server.spawn()
+        # the port changes from run to run
+        target = 'stub_server.py'
+    try:
+        return _run(args, names, url, target)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+def _run(args, names, url, target):
+    requests = load_generator.shape_requests(names=names, url=url)
+    workload = {'requests': args.requests, 'concurrency': args.concurrency,
+                'rounds': args.rounds,
+                'shapes': sorted(name for name, _ in requests)}
+
+    baseline = None
+    if not args.save:
+        if not os.path.exists(args.baseline):
+            sys.stderr.write('No baseline at %s, run with --save first\n'
+                             % args.baseline)
+            return 2
+        try:
+            baseline = load_baseline(args.baseline)
+        except ValueError as error:
+            sys.stderr.write('%s\n' % error)
+            return 2
+        different = [key for key in WORKLOAD_KEYS
+                     if baseline['workload'].get(key) != workload[key]]
+        if different:
+            sys.stderr.write('The baseline workload differs in %s, rerun '
+                             'with the same workload or --save\n'
+                             % ', '.join(different))
+            return 2
+
+    http = scheduler.MultiTransport(max_concurrent=args.concurrency)
+    try:
+        results = measure(requests, http, args.requests, args.concurrency,
+                          args.rounds, args.seed)
+    finally:
+        http.close()
+    current = {'format': FORMAT_VERSION,
+               'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                                           time.gmtime()),
+               'environment': environment(target),
+               'workload': workload,
+               'results': results}
+
+    if args.save:
+        failed = sum(r['errors'] for r in results.values())
+        if not failed:
+            with open(args.baseline, 'w') as out:
+                json.dump(current, out, indent=2, sort_keys=True)
+                out.write('\n')
+        print('%-22s %10s %10s %12s %8s' % ('shape', 'p50 ms', 'p95 ms',
+                                            'requests/s', 'errors'))
+        for name in sorted(results):
+            r = results[name]
+            print('%-22s %10.2f %10.2f %12.0f %8d' % (
+                name, r['p50_ms'], r['p95_ms'], r['throughput_rps'],
+                r['errors']))
+        if failed:
+            print('%d requests failed, baseline not saved' % failed)
+            return 1
+        print('Baseline saved to %s' % args.baseline)
+        return 0
+
+    rows, regressions = compare(baseline, results, args.p95_tolerance,
+                                args.throughput_tolerance,
+                                args.min_effect_size)
+    print('Baseline %s from %s (commit %s)' % (
+        args.baseline, baseline['created_at'],
+        baseline['environment'].get('commit')))
+    for difference in environment_differences(baseline,
+                                              current['environment']):
+        print('  environment differs, %s' % difference)
+    print('%-22s %20s %8s %22s %8s  %s' % (
+        'shape', 'p95 ms', 'change', 'requests/s', 'change', 'status'))
+    for row in rows:
+        before, now = row['baseline'], row['current']
+        if before is None:
+            print('%-22s %20s %8s %22s %8s  %s' % (
+                row['shape'], '%.2f' % now['p95_ms'], '',
+                '%.0f' % now['throughput_rps'], '', row['status']))
+            continue
+        print('%-22s %20s %+7.0f%% %22s %+7.0f%%  %s' % (
+            row['shape'], '%.2f -> %.2f' % (before['p95_ms'], now['p95_ms']),
+            row['p95_change'] * 100,
+            '%.0f -> %.0f' % (before['throughput_rps'],
+                              now['throughput_rps']),
+            row['throughput_change'] * 100, row['status']))
+    if regressions:
+        print('\nFAILED, %d regressions beyond tolerance:' % len(regressions))
+        for regression in regressions:
+            print('  ' + regression)
+        return 1
+    print('\nOK, within +%.0f%% p95 and -%.0f%% throughput of the baseline'
+          % (args.p95_tolerance * 100, args.throughput_tolerance * 100))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
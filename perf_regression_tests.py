@@ -0,0 +1,55 @@
+import unittest
+
+import perf_regression
+
+
+def _results(p95_rounds, throughput_rounds):
+    return {'p95_ms': perf_regression._median(p95_rounds),
+            'p95_rounds_ms': p95_rounds,
+            'throughput_rps': perf_regression._median(throughput_rounds),
+            'throughput_rounds': throughput_rounds,
+            'errors': 0}
+
+
+BASELINE = {'results': {'shape': _results([2.0, 2.1, 1.9, 2.0, 2.2],
+                                          [1000, 980, 1020, 1010, 990])}}
+
+
+""" TestCompare checks which changes between a baseline and the current
+    rounds fail the run, without a PEP
+"""
+class TestCompare(unittest.TestCase):
+
+    def assertStatus(self, current, status, min_effect_size=1.0):
+        rows, regressions = perf_regression.compare(
+            BASELINE, {'shape': current}, 0.25, 0.2, min_effect_size)
+        self.assertEqual(rows[0]['status'], status)
+        self.assertEqual(bool(regressions), status == 'REGRESSED')
+
+    def test_unchanged_rounds_pass(self):
+        self.assertStatus(_results([2.1, 2.0, 2.2, 1.9, 2.0],
+                                   [990, 1000, 1015, 985, 1005]), 'ok')
+
+    def test_consistent_slowdown_regresses(self):
+        self.assertStatus(_results([3.0, 3.1, 2.9, 3.0, 3.2],
+                                   [700, 690, 710, 705, 695]), 'REGRESSED')
+
+    def test_change_within_the_spread_is_noisy(self):
+        self.assertStatus(_results([1.5, 4.5, 2.0, 2.6, 5.0],
+                                   [1000, 990, 1010, 1005, 995]), 'noisy')
+
+    def test_small_effect_is_noisy(self):
+        current = _results([3.0, 3.1, 2.9, 3.0, 3.2], [1000] * 5)
+        self.assertStatus(current, 'REGRESSED')
+        self.assertStatus(current, 'noisy', min_effect_size=50)
+
+    def test_effect_size(self):
+        self.assertAlmostEqual(perf_regression.effect_size([1, 2, 3],
+                                                           [2, 3, 4]), 1.0)
+        self.assertEqual(perf_regression.effect_size([1, 1], [1, 1]), 0.0)
+        self.assertEqual(perf_regression.effect_size([1, 1], [2, 2]),
+                         float('inf'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,272 @@
+""" Per-request timings from curl
+
+    Once enable() has been called, every request the transports perform
+    is recorded with curl's phase timestamps (NAMELOOKUP, CONNECT,
+    APPCONNECT, PRETRANSFER, STARTTRANSFER, TOTAL), its byte counts, the
+    id of the test that made it and its request shape. That is enough to
+    tell DNS, TCP, TLS, the PEP and GeoServer apart when a run is slow:
+    everything up to pretransfer is the client's connection set-up,
+    pretransfer to starttransfer is the time the PEP and GeoServer take
+    to answer, the rest is the transfer of the body.
+
+    The suites print a per-phase breakdown at the end of a run. With
+    COBWEB_TIMINGS set the records are also written there, as Prometheus
+    text if the name ends in .prom and as JSON lines otherwise.
+
+    COBWEB_TIMINGS=timings.jsonl python endpoint_tests.py
+"""
+import json
+import os
+import threading
+import unittest
+
+try:
+    from urlparse import urlparse, parse_qsl
+except ImportError:
+    from urllib.parse import urlparse, parse_qsl
+
+import latency
+import lazy_import
+
+pycurl = lazy_import.module('pycurl')
+
+# curl's getinfo options by name, looked up once pycurl is loaded: the
+# integer microsecond and curl_off_t ones, and the deprecated double
+# ones for a libcurl or pycurl that lacks them
+PHASES = [('namelookup', 'NAMELOOKUP_TIME_T', 'NAMELOOKUP_TIME'),
+          ('connect', 'CONNECT_TIME_T', 'CONNECT_TIME'),
+          ('appconnect', 'APPCONNECT_TIME_T', 'APPCONNECT_TIME'),
+          ('pretransfer', 'PRETRANSFER_TIME_T', 'PRETRANSFER_TIME'),
+          ('starttransfer', 'STARTTRANSFER_TIME_T', 'STARTTRANSFER_TIME'),
+          ('total', 'TOTAL_TIME_T', 'TOTAL_TIME')]
+BYTE_COUNTS = [('request_bytes', 'REQUEST_SIZE', 'REQUEST_SIZE'),
+               ('header_bytes', 'HEADER_SIZE', 'HEADER_SIZE'),
+               ('upload_bytes', 'SIZE_UPLOAD_T', 'SIZE_UPLOAD'),
+               ('download_bytes', 'SIZE_DOWNLOAD_T', 'SIZE_DOWNLOAD')]
+# Durations derived from the cumulative timestamps, in request order
+BREAKDOWN = ['dns', 'tcp', 'tls', 'send', 'server', 'transfer']
+SPATIAL_PARAMETERS = ('filter', 'bbox', 'featureid')
+
+_log = None
+_local = threading.local()
+# (record key, getinfo option, scale to seconds or bytes), see _infos
+_infos_cache = None
+
+
+def request_shape(request):
+    """ Returns a short name for the kind of request: the method, the
+        spatial parameter if any and whether several typeNames are asked
+        for, e.g. get_plain, get_bbox_multi or post
+    """
+    if request.method == 'POST':
+        return 'post'
+    params = dict((k.lower(), v)
+                  for k, v in parse_qsl(urlparse(request.url).query, True))
+    kind = 'plain'
+    for name in SPATIAL_PARAMETERS:
+        if params.get(name):
+            kind = name
+            break
+    multi = len([n for n in params.get('typename', '').split(',') if n]) > 1
+    return 'get_%s%s' % (kind, '_multi' if multi else '')
+
+
+def durations(record):
+    """ Returns the BREAKDOWN durations of a record in seconds """
+    connect = record['connect']
+    secure = max(record['appconnect'], connect)
+    pretransfer = max(record['pretransfer'], secure)
+    starttransfer = max(record['starttransfer'], pretransfer)
+    return dict(zip(BREAKDOWN, [
+        record['namelookup'], connect - record['namelookup'],
+        secure - connect, pretransfer - secure,
+        starttransfer - pretransfer,
+        max(record['total'] - starttransfer, 0.0)]))
+
+
+def _infos():
+    """ Returns the record key, getinfo option and the factor that turns
+        its value into seconds or bytes for each of PHASES and
+        BYTE_COUNTS, preferring the options that are not deprecated
+    """
+    global _infos_cache
+    if _infos_cache is None:
+        libcurl = pycurl.version_info()[2]
+        infos = []
+        for name, option, fallback in PHASES + BYTE_COUNTS:
+            timed = option.endswith('_TIME_T')
+            # the *_TIME_T options came with libcurl 7.61.0, SIZE_*_T
+            # with 7.55.0, and pycurl only has them if built against those
+            since = 0x073d00 if timed else 0x073700
+            if (option != fallback and
+                    (not hasattr(pycurl, option) or libcurl < since)):
+                infos.append((name, getattr(pycurl, fallback), 1))
+            else:
+                infos.append((name, getattr(pycurl, option),
+                              1e-6 if timed else 1))
+        _infos_cache = infos
+    return _infos_cache
+
+
+class TimingLog(object):
+    """ The timing records of one run """
+
+    def __init__(self):
+        self.records = []
+        self._lock = threading.Lock()
+
+    def observe(self, handle, request, status, test=None, error=None):
+        record = {'test': test, 'shape': request_shape(request),
+                  'method': request.method, 'url': request.url,
+                  'status': status,
+                  'reused': handle.getinfo(pycurl.NUM_CONNECTS) == 0}
+        for name, info, scale in _infos():
+            value = handle.getinfo(info)
+            record[name] = value * scale if scale != 1 else value
+        if error is not None:
+            record['error'] = error
+        with self._lock:
+            self.records.append(record)
+
+    def _by_shape(self):
+        with self._lock:
+            records = list(self.records)
+        shapes = {}
+        for record in records:
+            shapes.setdefault(record['shape'], []).append(record)
+        return shapes
+
+    def write_json_lines(self, out):
+        with self._lock:
+            records = list(self.records)
+        for record in records:
+            out.write(json.dumps(record, sort_keys=True) + '\n')
+
+    def write_prometheus(self, out):
+        """ Writes a summary of each phase per shape and byte counters in
+            the Prometheus text exposition format
+        """
+        out.write('# HELP cobweb_request_phase_seconds Time spent in each '
+                  'phase of a request\n'
+                  '# TYPE cobweb_request_phase_seconds summary\n')
+        shapes = sorted(self._by_shape().items())
+        for shape, records in shapes:
+            for phase in BREAKDOWN + ['total']:
+                histogram = latency.LatencyHistogram()
+                total = 0.0
+                for record in records:
+                    value = (record['total'] if phase == 'total'
+                             else durations(record)[phase])
+                    histogram.record(value)
+                    total += value
+                labels = 'shape="%s",phase="%s"' % (shape, phase)
+                for quantile in (0.5, 0.9, 0.99):
+                    out.write('cobweb_request_phase_seconds{%s,quantile="%s"}'
+                              ' %.6f\n' % (labels, quantile,
+                                           histogram.percentile(quantile * 100)))
+                out.write('cobweb_request_phase_seconds_sum{%s} %.6f\n'
+                          % (labels, total))
+                out.write('cobweb_request_phase_seconds_count{%s} %d\n'
+                          % (labels, len(records)))
+        out.write('# HELP cobweb_request_bytes_total Bytes sent and received\n'
+                  '# TYPE cobweb_request_bytes_total counter\n')
+        for shape, records in shapes:
+            for name, _, _ in BYTE_COUNTS:
+                out.write('cobweb_request_bytes_total{shape="%s",kind="%s"} '
+                          '%d\n' % (shape, name[:-len('_bytes')],
+                                    sum(r[name] for r in records)))
+
+    def write(self, path):
+        with open(path, 'w') as out:
+            if path.endswith('.prom'):
+                self.write_prometheus(out)
+            else:
+                self.write_json_lines(out)
+
+    def breakdown(self):
+        """ Returns a table of the mean duration of each phase in ms and
+            the bytes received, per request shape
+        """
+        lines = ['%-22s %6s' % ('shape', 'count') +
+                 ''.join('%9s' % phase for phase in BREAKDOWN + ['total']) +
+                 '%12s' % 'bytes in']
+        shapes = self._by_shape()
+        everything = [r for records in shapes.values() for r in records]
+        rows = sorted(shapes.items()) + [('all', everything)]
+        for shape, records in rows:
+            if not records:
+                continue
+            means = dict((phase, 0.0) for phase in BREAKDOWN)
+            for record in records:
+                for phase, value in durations(record).items():
+                    means[phase] += value
+            total = sum(r['total'] for r in records)
+            lines.append('%-22s %6d' % (shape, len(records)) +
+                         ''.join('%9.2f' % (means[phase] * 1000 / len(records))
+                                 for phase in BREAKDOWN) +
+                         '%9.2f' % (total * 1000 / len(records)) +
+                         '%12d' % sum(r['download_bytes'] for r in records))
+        return '\n'.join(lines)
+
+
+def enable():
+    """ Starts recording and returns the TimingLog """
+    global _log
+    if _log is None:
+        _log = TimingLog()
+    return _log
+
+
+def disable():
+    global _log
+    _log = None
+
+
+def current_test():
+    """ Returns the id of the test running on this thread, if any """
+    return getattr(_local, 'test', None)
+
+
+def set_current_test(test_id):
+    """ Tags the requests this thread makes from now on with test_id """
+    _local.test = test_id
+
+
+def observe(handle, request, status, test=None, error=None):
+    """ Records the timings of a finished request on handle, before it is
+        reset. test defaults to the test running on this thread.
+    """
+    log = _log
+    if log is not None:
+        log.observe(handle, request, status,
+                    current_test() if test is None else test, error)
+
+
+class TimedTestResult(unittest.TextTestResult):
+    """ Tags the requests made by each test with its id """
+
+    def startTest(self, test):
+        set_current_test(test.id())
+        unittest.TextTestResult.startTest(self, test)
+
+    def stopTest(self, test):
+        unittest.TextTestResult.stopTest(self, test)
+        set_current_test(None)
+
+
+class TimedTestRunner(unittest.TextTestRunner):
+    """ A TextTestRunner that records request timings and prints their
+        breakdown after the run, writing them to COBWEB_TIMINGS if set
+    """
+    resultclass = TimedTestResult
+
+    def run(self, test):
+        log = enable()
+        result = unittest.TextTestRunner.run(self, test)
+        if log.records:
+            self.stream.writeln('Request phases (mean ms):')
+            self.stream.writeln(log.breakdown())
+        path = os.environ.get('COBWEB_TIMINGS')
+        if path:
+            log.write(path)
+        return result
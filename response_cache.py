@@ -0,0 +1,303 @@
+""" Record and replay of HTTP responses
+
+    CachingTransport sits between the suites' HTTP helpers and a
+    Transport and keeps every response on disk, keyed by method, URL,
+    a hash of the body and the uuid header. Entries are zlib compressed
+    and read back through mmap, streaming into the caller's sink chunk
+    by chunk, so replaying a large FeatureCollection costs no more
+    memory than fetching it.
+
+    Modes, chosen with COBWEB_CACHE:
+
+    record   serve fresh entries, fetch and store missing or stale ones
+    replay   serve entries only, a missing one raises CacheMiss
+    refresh  always fetch, overwriting the stored entries
+
+    COBWEB_CACHE_DIR (default .cobweb-cache), COBWEB_CACHE_TTL (seconds)
+    and COBWEB_CACHE_MAX_MB bound where entries live and how many are
+    kept. Expired entries are never served and the least recently used
+    ones are evicted once the cache grows past its size limit.
+
+    Server errors (status 500 and above) are passed on but not stored,
+    so a failing PEP is asked again on the next run, unless
+    COBWEB_CACHE_ERRORS=1 asks for them to be recorded as well.
+
+    COBWEB_CACHE=record python endpoint_tests.py
+    COBWEB_CACHE=replay python endpoint_tests.py
+"""
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+import time
+import zlib
+from io import BytesIO
+
+import lazy_import
+import transport
+
+pycurl = lazy_import.module('pycurl')
+
+MODES = ('record', 'replay', 'refresh')
+MAGIC = b'COBWEB-CACHE-1'
+# status, creation time and body size, fixed width so that the header
+# can be written once the response is complete
+HEADER = b'%s %3d %12d %16d\n'
+CHUNK_SIZE = 1 << 16
+DEFAULT_DIRECTORY = '.cobweb-cache'
+
+
+class CacheMiss(Exception):
+    pass
+
+
+def request_key(request):
+    """ Returns the hex key of request: method, URL, body hash and uuid """
+    body = request.body or b''
+    if not isinstance(body, bytes):
+        body = body.encode('utf-8')
+    uuid = transport.header_value(request, 'uuid')
+    text = '\n'.join([request.method, request.url,
+                      hashlib.sha1(body).hexdigest(),
+                      '' if uuid is None else uuid])
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class _Recorder(object):
+    """ Compresses a response body into a temporary file as it arrives,
+        passing each chunk on to sink
+    """
+
+    def __init__(self, directory, sink):
+        fd, self.path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        self.out = os.fdopen(fd, 'wb')
+        self.out.write(HEADER % (MAGIC, 0, 0, 0))
+        self.compressor = zlib.compressobj(6)
+        self.sink = sink
+        self.size = 0
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        self.out.write(self.compressor.compress(chunk))
+        if self.sink is not None:
+            return self.sink(chunk)
+        return None
+
+    def finish(self, path, status):
+        self.out.write(self.compressor.flush())
+        self.out.seek(0)
+        self.out.write(HEADER % (MAGIC, status, int(time.time()), self.size))
+        self.out.close()
+        os.rename(self.path, path)
+
+    def discard(self):
+        self.out.close()
+        os.remove(self.path)
+
+
+class CachingTransport(object):
+    """ Wraps a Transport with an on-disk response cache """
+
+    def __init__(self, inner, directory=DEFAULT_DIRECTORY, mode='record',
+                 ttl=None, max_bytes=None, store_errors=False):
+        if mode not in MODES:
+            raise ValueError('cache mode must be one of %s' % ', '.join(MODES))
+        self.inner = inner
+        self.directory = directory
+        self.mode = mode
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.store_errors = store_errors
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+        self.evicted = 0
+        self._size = None
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.evict()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _read_header(self, data):
+        header = data.readline().split()
+        if len(header) != 4 or header[0] != MAGIC:
+            return None
+        return int(header[1]), int(header[2]), int(header[3])
+
+    def _expired(self, created, now=None):
+        return (self.ttl is not None and
+                (now or time.time()) - created > self.ttl)
+
+    def _replay(self, path, sink):
+        """ Returns a Response for the entry at path, None if there is no
+            fresh entry
+        """
+        try:
+            data = open(path, 'rb')
+        except IOError:
+            return None
+        with data:
+            header = self._read_header(data)
+            if header is None or self._expired(header[1]):
+                return None
+            status = header[0]
+            offset = data.tell()
+            body = [] if sink is None else None
+            view = mmap.mmap(data.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                decompressor = zlib.decompressobj()
+                for start in range(offset, len(view), CHUNK_SIZE):
+                    chunk = decompressor.decompress(
+                        view[start:start + CHUNK_SIZE])
+                    if body is not None:
+                        body.append(chunk)
+                    elif chunk and sink(chunk) == 0:
+                        raise pycurl.error(pycurl.E_WRITE_ERROR,
+                                           'Failed writing body')
+                tail = decompressor.flush()
+                if body is not None:
+                    body.append(tail)
+                elif tail and sink(tail) == 0:
+                    raise pycurl.error(pycurl.E_WRITE_ERROR,
+                                       'Failed writing body')
+            finally:
+                view.close()
+        # the modification time marks recent use for eviction
+        os.utime(path, None)
+        with self._lock:
+            self.hits += 1
+        return transport.Response(status, b''.join(body) if body is not None
+                                  else None, True)
+
+    def _fetch(self, request, path, sink):
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                pass
+        buf = None
+        if sink is None:
+            buf = BytesIO()
+            sink = buf.write
+        recorder = _Recorder(directory, sink)
+        try:
+            response = self.inner.perform(request, recorder.write)
+            keep = response.status < 500 or self.store_errors
+            if keep:
+                recorder.finish(path, response.status)
+        except Exception:
+            recorder.discard()
+            raise
+        if not keep:
+            recorder.discard()
+        stored = os.path.getsize(path) if keep else 0
+        with self._lock:
+            self.misses += 1
+            self.recorded += keep
+            if self._size is not None:
+                self._size += stored
+            over = self.max_bytes is not None and self._size > self.max_bytes
+        if over:
+            self.evict()
+        return transport.Response(response.status,
+                                  buf.getvalue() if buf else None,
+                                  response.reused)
+
+    def perform(self, request, sink=None):
+        """ Performs request like Transport.perform, through the cache """
+        path = self._path(request_key(request))
+        if self.mode != 'refresh':
+            response = self._replay(path, sink)
+            if response is not None:
+                return response
+            if self.mode == 'replay':
+                with self._lock:
+                    self.misses += 1
+                raise CacheMiss('no fresh cached response for %s %s' % (
+                    request.method, request.url))
+        return self._fetch(request, path, sink)
+
+    def _entries(self):
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                yield os.path.join(root, name)
+
+    def evict(self):
+        """ Removes expired entries, then the least recently used ones
+            until the cache fits in max_bytes
+        """
+        now = time.time()
+        entries = []
+        removed = 0
+        for path in self._entries():
+            try:
+                stat = os.stat(path)
+                if path.endswith('.tmp'):
+                    expired = now - stat.st_mtime > 3600
+                else:
+                    with open(path, 'rb') as data:
+                        header = self._read_header(data)
+                    expired = header is None or self._expired(header[1], now)
+                if expired:
+                    os.remove(path)
+                    removed += 1
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, path))
+            except (IOError, OSError):
+                continue
+        size = sum(entry[1] for entry in entries)
+        if self.max_bytes is not None and size > self.max_bytes:
+            entries.sort()
+            for _, entry_size, path in entries:
+                if size <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                size -= entry_size
+                removed += 1
+        with self._lock:
+            self._size = size
+            self.evicted += removed
+        return removed
+
+    def stats(self):
+        stats = dict(self.inner.stats())
+        with self._lock:
+            stats.update({'cache_mode': self.mode, 'cache_hits': self.hits,
+                          'cache_misses': self.misses,
+                          'cache_recorded': self.recorded,
+                          'cache_evicted': self.evicted,
+                          'cache_bytes': self._size})
+        return stats
+
+    def report(self):
+        with self._lock:
+            cached = 'Response cache (%s): %d hits, %d recorded' % (
+                self.mode, self.hits, self.recorded)
+        return '%s\n%s' % (self.inner.report(), cached)
+
+    def close(self):
+        self.inner.close()
+
+
+def from_environment(inner):
+    """ Returns inner wrapped in a CachingTransport if COBWEB_CACHE
+        selects a mode, else inner itself
+    """
+    mode = os.environ.get('COBWEB_CACHE', '').strip().lower()
+    if not mode or mode == 'off':
+        return inner
+    ttl = os.environ.get('COBWEB_CACHE_TTL')
+    max_mb = os.environ.get('COBWEB_CACHE_MAX_MB')
+    return CachingTransport(
+        inner, os.environ.get('COBWEB_CACHE_DIR', DEFAULT_DIRECTORY), mode,
+        ttl=float(ttl) if ttl else None,
+        max_bytes=int(float(max_mb) * 1e6) if max_mb else None,
+        store_errors=os.environ.get('COBWEB_CACHE_ERRORS') == '1')
@@ -0,0 +1,78 @@
+import shutil
+import tempfile
+import unittest
+
+import response_cache
+import transport
+
+
+""" Stands in for a Transport, answering every request with status
+"""
+class _CannedTransport(object):
+
+    def __init__(self, status, body=b'<ows:ExceptionReport/>'):
+        self.status = status
+        self.body = body
+        self.performed = 0
+
+    def perform(self, request, sink=None):
+        self.performed += 1
+        sink(self.body)
+        return transport.Response(self.status, None, False)
+
+    def stats(self):
+        return {}
+
+
+""" TestRecord checks which responses record mode stores, without a PEP
+"""
+class TestRecord(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.request = transport.get('http://pep/wfs', ['uuid: Joe'])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _cache(self, inner, **options):
+        return response_cache.CachingTransport(inner, self.directory,
+                                               'record', **options)
+
+    def test_responses_are_replayed(self):
+        inner = _CannedTransport(200, b'<wfs:FeatureCollection/>')
+        cache = self._cache(inner)
+        for _ in range(2):
+            response = cache.perform(self.request)
+            self.assertEqual(response.body, b'<wfs:FeatureCollection/>')
+        self.assertEqual(inner.performed, 1)
+        self.assertEqual((cache.hits, cache.recorded), (1, 1))
+
+    def test_client_errors_are_stored(self):
+        inner = _CannedTransport(403)
+        cache = self._cache(inner)
+        cache.perform(self.request)
+        self.assertEqual(cache.perform(self.request).status, 403)
+        self.assertEqual(inner.performed, 1)
+
+    def test_server_errors_are_not_stored(self):
+        inner = _CannedTransport(503)
+        cache = self._cache(inner)
+        for _ in range(2):
+            response = cache.perform(self.request)
+            self.assertEqual(response.status, 503)
+            self.assertEqual(response.body, b'<ows:ExceptionReport/>')
+        self.assertEqual(inner.performed, 2)
+        self.assertEqual((cache.hits, cache.recorded), (0, 0))
+        self.assertEqual(cache.stats()['cache_bytes'], 0)
+
+    def test_server_errors_are_stored_on_request(self):
+        inner = _CannedTransport(500)
+        cache = self._cache(inner, store_errors=True)
+        cache.perform(self.request)
+        self.assertEqual(cache.perform(self.request).status, 500)
+        self.assertEqual(inner.performed, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
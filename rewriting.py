@@ -0,0 +1,373 @@
+""" The PEP's WFS request rewriting contract
+
+    This is the behaviour pep_rewriting_tests.py asserts: every
+    GetFeature query gets a userid predicate ANDed into its filter. A
+    query without a filter gets a plain userid filter; a bbox or
+    featureid parameter becomes an fes:And of that operator and the
+    userid predicate; an existing filter has the predicate appended to
+    its top level And, or is wrapped in a new And otherwise.
+
+    Whatever the rules above do not cover is refused rather than
+    forwarded: operations other than GetFeature that may return
+    features, filters outside the OGC namespace, a Query with more than
+    one Filter and anything but Queries inside a posted GetFeature.
+    Only the metadata operations in PASS_THROUGH are forwarded as they
+    are.
+
+    Filters are handled as a small prefix-preserving element tree rather
+    than a namespace-resolving DOM, so that rewritten output keeps the
+    exact prefixes and whitespace of the request.
+"""
+import re
+import xml.parsers.expat
+
+try:
+    from urllib import unquote
+except ImportError:
+    from urllib.parse import unquote
+
+OGC_NS = 'http://www.opengis.net/ogc'
+GML_NS = 'http://www.opengis.net/gml'
+USERID_PROPERTY = 'userid'
+SPATIAL_PARAMETERS = ('filter', 'bbox', 'featureid')
+# Operations forwarded unchanged, none of them returns features
+PASS_THROUGH = ('getcapabilities', 'describefeaturetype')
+
+
+class RewriteError(Exception):
+    """ Raised for requests the PEP refuses, code is the OWS exception code """
+
+    def __init__(self, code, message):
+        Exception.__init__(self, message)
+        self.code = code
+
+
+class Element(object):
+    """ An XML element that keeps its qualified tag, attribute order and
+        surrounding text. Only element children are kept in children,
+        text before the first child is in text and text after an
+        element's end tag in its tail.
+    """
+    __slots__ = ('tag', 'attrs', 'children', 'text', 'tail')
+
+    def __init__(self, tag, attrs=None, children=None, text=''):
+        self.tag = tag
+        self.attrs = attrs if attrs is not None else []
+        self.children = children if children is not None else []
+        self.text = text
+        self.tail = ''
+
+    @property
+    def prefix(self):
+        return self.tag.partition(':')[0] if ':' in self.tag else ''
+
+    @property
+    def local(self):
+        return self.tag.rpartition(':')[2]
+
+    def get(self, name, default=None):
+        for key, value in self.attrs:
+            if key == name:
+                return value
+        return default
+
+    def set(self, name, value, first=False):
+        self.attrs = [(k, v) for k, v in self.attrs if k != name]
+        if first:
+            self.attrs.insert(0, (name, value))
+        else:
+            self.attrs.append((name, value))
+
+    def namespaces(self):
+        """ Returns the prefix to URI declarations made on this element """
+        declared = {}
+        for key, value in self.attrs:
+            if key == 'xmlns':
+                declared[''] = value
+            elif key.startswith('xmlns:'):
+                declared[key[6:]] = value
+        return declared
+
+
+def _refuse_doctype(*args):
+    raise RewriteError('OperationParsingFailed',
+                       'document type declarations are not accepted')
+
+
+def parse(text):
+    """ Parses an XML document or fragment into an Element tree """
+    if not isinstance(text, bytes):
+        text = text.encode('utf-8')
+    parser = xml.parsers.expat.ParserCreate()
+    parser.buffer_text = True
+    parser.ordered_attributes = True
+    stack = []
+    roots = []
+
+    def start(tag, attrs):
+        element = Element(tag, list(zip(attrs[::2], attrs[1::2])))
+        if stack:
+            stack[-1].children.append(element)
+        else:
+            roots.append(element)
+        stack.append(element)
+
+    def end(tag):
+        stack.pop()
+
+    def data(text):
+        if not stack:
+            return
+        parent = stack[-1]
+        if parent.children:
+            parent.children[-1].tail += text
+        else:
+            parent.text += text
+
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.CharacterDataHandler = data
+    parser.StartDoctypeDeclHandler = _refuse_doctype
+    parser.EntityDeclHandler = _refuse_doctype
+    try:
+        parser.Parse(text, True)
+    except xml.parsers.expat.ExpatError as error:
+        raise RewriteError('OperationParsingFailed', str(error))
+    return roots[0]
+
+
+def escape(text, quote=False):
+    text = text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+    if quote:
+        text = text.replace('"', '&quot;')
+    return text
+
+
+def serialize(element, out=None):
+    """ Serialises an Element tree, namespace declarations first """
+    parts = [] if out is None else out
+    attrs = sorted(element.attrs,
+                   key=lambda item: not (item[0] == 'xmlns' or
+                                         item[0].startswith('xmlns:')))
+    parts.append('<' + element.tag)
+    for key, value in attrs:
+        parts.append(' %s="%s"' % (key, escape(value, True)))
+    if element.children or element.text:
+        parts.append('>' + escape(element.text))
+        for child in element.children:
+            serialize(child, parts)
+            parts.append(escape(child.tail))
+        parts.append('</%s>' % element.tag)
+    else:
+        parts.append('/>')
+    if out is None:
+        return ''.join(parts)
+
+
+def check_prefixes(element, scope=None):
+    """ Raises RewriteError if element uses a prefix that is not bound """
+    scope = dict(scope or {}, xml='http://www.w3.org/XML/1998/namespace')
+    scope.update(element.namespaces())
+    for name in [element.tag] + [k for k, v in element.attrs]:
+        if ':' in name and not name.startswith('xmlns:'):
+            prefix = name.partition(':')[0]
+            if prefix not in scope:
+                raise RewriteError('InvalidParameterValue',
+                                   'unbound prefix %s in %s' % (prefix, name))
+    for child in element.children:
+        check_prefixes(child, scope)
+    return scope
+
+
+def userid_predicate(user, declare=True):
+    """ Returns the fes:PropertyIsEqualTo element restricting to user """
+    return parse('<fes:PropertyIsEqualTo%s><fes:PropertyName>%s'
+                 '</fes:PropertyName><fes:Literal>%s</fes:Literal>'
+                 '</fes:PropertyIsEqualTo>' % (
+                     ' xmlns:fes="%s"' % OGC_NS if declare else '',
+                     USERID_PROPERTY, escape(user)))
+
+
+def userid_filter(user):
+    """ Returns the filter the PEP sends for a query without one """
+    predicate = userid_predicate(user, declare=False)
+    return Element('fes:Filter', [('xmlns:fes', OGC_NS)], [predicate])
+
+
+def _and_filter(operators, user):
+    operators = operators + [userid_predicate(user)]
+    conjunction = Element('fes:And', [('xmlns:fes', OGC_NS)], operators)
+    return Element('fes:Filter', [('xmlns:fes', OGC_NS)], [conjunction])
+
+
+def bbox_filter(bbox, user):
+    """ Returns the rewritten filter for a bbox=a,b,c,d[,srs] parameter """
+    values = bbox.split(',')
+    if len(values) not in (4, 5):
+        raise RewriteError('InvalidParameterValue', 'bad bbox %r' % bbox)
+    try:
+        [float(value) for value in values[:4]]
+    except ValueError:
+        raise RewriteError('InvalidParameterValue', 'bad bbox %r' % bbox)
+    srs = values[4] if len(values) == 5 else 'EPSG:4326'
+    envelope = parse('<gml:Envelope xmlns:gml="%s" srsName="%s">'
+                     '<gml:lowerCorner>%s %s</gml:lowerCorner>'
+                     '<gml:upperCorner>%s %s</gml:upperCorner>'
+                     '</gml:Envelope>' % tuple(
+                         [GML_NS, escape(srs, True)] + values[:4]))
+    operator = Element('fes:BBOX', [('xmlns:fes', OGC_NS)], [envelope])
+    return _and_filter([operator], user)
+
+
+def featureid_filter(featureids, user):
+    """ Returns the rewritten filter for a featureid=a,b,... parameter """
+    operators = [Element('fes:FeatureId', [('xmlns:fes', OGC_NS),
+                                           ('fid', fid)])
+                 for fid in featureids.split(',') if fid]
+    if not operators:
+        raise RewriteError('InvalidParameterValue', 'empty featureid')
+    return _and_filter(operators, user)
+
+
+def _is_ogc(element, scope):
+    """ Returns True if element is in the OGC namespace or in none """
+    scope = dict(scope)
+    scope.update(element.namespaces())
+    return scope.get(element.prefix) in (None, '', OGC_NS)
+
+
+def rewrite_filter(root, user, scope=None):
+    """ ANDs the userid predicate into the parsed Filter element root """
+    if root.local != 'Filter':
+        raise RewriteError('InvalidParameterValue',
+                           'expected a Filter, got %s' % root.tag)
+    scope = check_prefixes(root, scope)
+    if not _is_ogc(root, scope):
+        raise RewriteError('InvalidParameterValue',
+                           '%s is not an OGC Filter' % root.tag)
+    children = root.children
+    if (len(children) == 1 and children[0].local == 'And' and
+            _is_ogc(children[0], scope)):
+        children[0].children.append(userid_predicate(user))
+        return root
+    for child in children:
+        if child.prefix and child.prefix in scope:
+            child.set('xmlns:' + child.prefix, scope[child.prefix], True)
+    conjunction = Element('And', children=[userid_predicate(user)] + children)
+    if not _is_ogc(conjunction, scope):
+        # a prefixed Filter under a foreign default namespace, which the
+        # unprefixed operators keep
+        conjunction.set('xmlns', OGC_NS)
+        for child in children:
+            if not child.prefix and child.get('xmlns') is None:
+                child.set('xmlns', scope[''], True)
+    root.children = [conjunction]
+    root.text = ''
+    return root
+
+
+def split_filter_list(value):
+    """ Splits a filter parameter into its (...),(...) filters """
+    value = value.strip()
+    if value.startswith('(') and value.endswith(')'):
+        return re.split(r'\)\s*,\s*\(', value[1:-1])
+    return [value]
+
+
+def _text(value):
+    # Python 2's unquote returns bytes, which must not meet the unicode
+    # text of parsed filters
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    return value
+
+
+def parse_query(query):
+    """ Splits a query string into ordered (key, value) pairs """
+    params = []
+    for part in query.split('&'):
+        if part:
+            key, _, value = part.partition('=')
+            params.append((_text(unquote(key)), _text(unquote(value))))
+    return params
+
+
+def query_filters(params, user):
+    """ Returns the typeNames of a GetFeature request and the rewritten
+        Filter element for each of them
+    """
+    values = dict((key.strip().lower(), value) for key, value in params)
+    typeNames = [name for name in values.get('typename', '').split(',')
+                 if name]
+    if not typeNames:
+        raise RewriteError('MissingParameterValue', 'typeName is required')
+    given = [name for name in SPATIAL_PARAMETERS if values.get(name)]
+    if len(given) > 1:
+        raise RewriteError('InvalidParameterValue',
+                           '%s are mutually exclusive' % ' and '.join(given))
+    if 'filter' in given:
+        filters = split_filter_list(values['filter'])
+        if len(filters) == 1:
+            filters = filters * len(typeNames)
+        if len(filters) != len(typeNames):
+            raise RewriteError('InvalidParameterValue',
+                               'expected one filter per typeName')
+        return typeNames, [rewrite_filter(parse(text), user)
+                           for text in filters]
+    if 'bbox' in given:
+        return typeNames, [bbox_filter(values['bbox'], user)
+                           for _ in typeNames]
+    if 'featureid' in given:
+        return typeNames, [featureid_filter(values['featureid'], user)
+                           for _ in typeNames]
+    return typeNames, [userid_filter(user) for _ in typeNames]
+
+
+def rewrite_get(query, user):
+    """ Returns the request the PEP forwards for a GET query string, in
+        the key=value;... form echoed by the test deployment
+    """
+    params = parse_query(query)
+    request = dict((k.strip().lower(), v) for k, v in params).get('request')
+    if request is None:
+        raise RewriteError('MissingParameterValue', 'request is required')
+    request = request.strip().lower()
+    if request in PASS_THROUGH:
+        return ';'.join('%s=%s' % param for param in params)
+    if request != 'getfeature':
+        raise RewriteError('OperationNotSupported',
+                           'request=%s is not supported' % request)
+    typeNames, filters = query_filters(params, user)
+    kept = ['%s=%s' % (key, value) for key, value in params
+            if key.strip().lower() not in SPATIAL_PARAMETERS]
+    kept.append('FILTER=' + ','.join('(%s)' % serialize(f) for f in filters))
+    return ';'.join(kept)
+
+
+def rewrite_post(payload, user):
+    """ Returns the rewritten wfs:GetFeature document for a POST body """
+    return serialize(rewrite_post_tree(payload, user))
+
+
+def rewrite_post_tree(payload, user):
+    """ Returns the rewritten wfs:GetFeature Element for a POST body """
+    root = parse(payload)
+    if root.local != 'GetFeature':
+        raise RewriteError('OperationNotSupported',
+                           'only GetFeature may be posted')
+    scope = check_prefixes(root)
+    for query in root.children:
+        if query.local != 'Query':
+            raise RewriteError('InvalidParameterValue',
+                               'unexpected %s in GetFeature' % query.tag)
+        filters = [child for child in query.children if child.local == 'Filter']
+        if len(filters) > 1:
+            raise RewriteError('InvalidParameterValue',
+                               'more than one Filter in a Query')
+        if filters:
+            query_scope = dict(scope)
+            query_scope.update(query.namespaces())
+            rewrite_filter(filters[0], user, query_scope)
+        else:
+            query.children.append(userid_filter(user))
+    return root
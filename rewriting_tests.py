@@ -0,0 +1,205 @@
+import unittest
+
+import rewriting
+import xml_compare
+from suite_config import (SINGLE_TYPE_NAME, MULTIPLE_TYPE_NAMES, SINGLE_FILTER,
+                          MULTIPLE_FILTERS, SINGLE_BBOX, SINGLE_FEATURE_ID,
+                          MULTIPLE_FEATURE_IDS, POST_GET_FEATURE)
+
+GET_FEATURE = 'request=GetFeature&service=WFS&version=1.1.0&'
+HEAD = 'request=GetFeature;service=WFS;version=1.1.0;'
+FES = 'xmlns:fes="http://www.opengis.net/ogc"'
+USERID = ('<fes:PropertyIsEqualTo %s><fes:PropertyName>userid'
+          '</fes:PropertyName><fes:Literal>Joe</fes:Literal>'
+          '</fes:PropertyIsEqualTo>' % FES)
+USERID_FILTER = '<fes:Filter %s>%s</fes:Filter>' % (FES, USERID)
+
+
+""" Base class comparing rewritten requests structurally, as
+    pep_rewriting_tests.py does with the echoed ones
+"""
+class RewritingTestCase(unittest.TestCase):
+
+    def assertRewritten(self, result, desiredResult):
+        difference = xml_compare.difference(desiredResult, result)
+        if difference is not None:
+            self.fail(difference)
+
+    def assertRefused(self, code, function, *args):
+        with self.assertRaises(rewriting.RewriteError) as raised:
+            function(*args)
+        self.assertEqual(raised.exception.code, code)
+
+
+""" TestRewriteGet checks rewrite_get, the rewriting contract the stub
+    server echoes, without a PEP or the stub
+"""
+class TestRewriteGet(RewritingTestCase):
+
+    def test_type_names_get_the_userid_filter(self):
+        self.assertRewritten(
+            rewriting.rewrite_get(GET_FEATURE + SINGLE_TYPE_NAME, 'Joe'),
+            HEAD + 'typeName=A;FILTER=(%s)' % USERID_FILTER)
+        self.assertRewritten(
+            rewriting.rewrite_get(GET_FEATURE + MULTIPLE_TYPE_NAMES, 'Joe'),
+            HEAD + 'typeName=A,B;FILTER=(%s),(%s)' % (USERID_FILTER,
+                                                      USERID_FILTER))
+
+    def test_filters_are_anded_with_the_userid(self):
+        self.assertRewritten(
+            rewriting.rewrite_get(GET_FEATURE + SINGLE_FILTER, 'Joe'),
+            HEAD + 'typeName=A;FILTER=(<Filter><And>%s<F1/></And></Filter>)'
+            % USERID)
+        self.assertRewritten(
+            rewriting.rewrite_get(GET_FEATURE + MULTIPLE_FILTERS, 'Joe'),
+            HEAD + 'typeName=A,B;FILTER=(<Filter><And>%s<F1/></And></Filter>),'
+            '(<Filter><And>%s<F2/></And></Filter>)' % (USERID, USERID))
+
+    def test_existing_and_gets_the_userid_appended(self):
+        query = 'typeName=A&filter=<Filter><And><F1/><F2/></And></Filter>'
+        self.assertRewritten(
+            rewriting.rewrite_get(GET_FEATURE + query, 'Joe'),
+            HEAD + 'typeName=A;FILTER=(<Filter><And><F1/><F2/>%s</And>'
+            '</Filter>)' % USERID)
+
+    def test_bbox_becomes_an_envelope(self):
+        self.assertRewritten(
+            rewriting.rewrite_get(GET_FEATURE + SINGLE_BBOX, 'Joe'),
+            HEAD + 'typeName=A;FILTER=(<fes:Filter %s><fes:And><fes:BBOX>'
+            '<gml:Envelope xmlns:gml="http://www.opengis.net/gml" '
+            'srsName="EPSG:4326"><gml:lowerCorner>0 1</gml:lowerCorner>'
+            '<gml:upperCorner>2 3</gml:upperCorner></gml:Envelope></fes:BBOX>'
+            '%s</fes:And></fes:Filter>)' % (FES, USERID))
+
+    def test_bbox_keeps_its_srs(self):
+        result = rewriting.rewrite_get(
+            GET_FEATURE + 'typeName=A&bbox=0,1,2,3,EPSG:3857', 'Joe')
+        self.assertIn('srsName="EPSG:3857"', result)
+
+    def test_featureids(self):
+        self.assertRewritten(
+            rewriting.rewrite_get(GET_FEATURE + SINGLE_FEATURE_ID, 'Joe'),
+            HEAD + 'typeName=A;FILTER=(<fes:Filter %s><fes:And>'
+            '<fes:FeatureId fid="id_4711"/>%s</fes:And></fes:Filter>)'
+            % (FES, USERID))
+        self.assertRewritten(
+            rewriting.rewrite_get(GET_FEATURE + MULTIPLE_FEATURE_IDS, 'Joe'),
+            HEAD + 'typeName=A;FILTER=(<fes:Filter %s><fes:And>'
+            '<fes:FeatureId fid="id_4711"/><fes:FeatureId fid="id_4712"/>%s'
+            '</fes:And></fes:Filter>)' % (FES, USERID))
+
+    def test_user_is_escaped(self):
+        result = rewriting.rewrite_get(GET_FEATURE + SINGLE_TYPE_NAME,
+                                       'Joe</fes:Literal><x a="&')
+        self.assertIn('<fes:Literal>Joe&lt;/fes:Literal&gt;&lt;x a="&amp;'
+                      '</fes:Literal>', result)
+
+    def test_metadata_requests_pass_unchanged(self):
+        query = 'request=GetCapabilities&service=WFS'
+        self.assertEqual(rewriting.rewrite_get(query, 'Joe'),
+                         'request=GetCapabilities;service=WFS')
+
+    def test_other_operations_are_refused(self):
+        for operation in ('GetFeatureWithLock', 'GetPropertyValue',
+                          'GetGmlObject', 'Transaction'):
+            self.assertRefused('OperationNotSupported', rewriting.rewrite_get,
+                               'request=%s&service=WFS&typeName=A'
+                               % operation, 'Joe')
+        self.assertRefused('MissingParameterValue', rewriting.rewrite_get,
+                           'service=WFS&typeName=A', 'Joe')
+
+    def test_request_name_is_trimmed(self):
+        self.assertRewritten(
+            rewriting.rewrite_get('request=%20GetFeature&service=WFS&'
+                                  'version=1.1.0&' + SINGLE_TYPE_NAME, 'Joe'),
+            'request= GetFeature;service=WFS;version=1.1.0;typeName=A;'
+            'FILTER=(%s)' % USERID_FILTER)
+
+    def test_filters_outside_the_ogc_namespace_are_refused(self):
+        self.assertRefused('InvalidParameterValue', rewriting.rewrite_get,
+                           GET_FEATURE + 'typeName=A&filter=<Filter xmlns='
+                           '"urn:example:other"><F1/></Filter>', 'Joe')
+        self.assertRefused('InvalidParameterValue', rewriting.rewrite_get,
+                           GET_FEATURE + 'typeName=A&filter=<p:Filter xmlns:p='
+                           '"urn:example:other"><p:F1/></p:Filter>', 'Joe')
+
+    def test_foreign_and_is_not_extended(self):
+        query = ('typeName=A&filter=<ogc:Filter xmlns:ogc="%s" xmlns='
+                 '"urn:example:other"><And><F1/></And></ogc:Filter>'
+                 % rewriting.OGC_NS)
+        self.assertRewritten(
+            rewriting.rewrite_get(GET_FEATURE + query, 'Joe'),
+            HEAD + 'typeName=A;FILTER=(<ogc:Filter xmlns:ogc="%s"><ogc:And>'
+            '%s<And xmlns="urn:example:other"><F1/></And></ogc:And>'
+            '</ogc:Filter>)' % (rewriting.OGC_NS, USERID))
+
+    def test_invalid_requests_are_refused(self):
+        self.assertRefused('MissingParameterValue', rewriting.rewrite_get,
+                           GET_FEATURE + 'bbox=0,1,2,3', 'Joe')
+        self.assertRefused('InvalidParameterValue', rewriting.rewrite_get,
+                           GET_FEATURE + 'typeName=A&bbox=0,1,2', 'Joe')
+        self.assertRefused('InvalidParameterValue', rewriting.rewrite_get,
+                           GET_FEATURE + 'typeName=A&bbox=0,1,2,x', 'Joe')
+        self.assertRefused('InvalidParameterValue', rewriting.rewrite_get,
+                           GET_FEATURE + 'typeName=A&featureid=,', 'Joe')
+        self.assertRefused('InvalidParameterValue', rewriting.rewrite_get,
+                           GET_FEATURE + 'typeName=A&bbox=0,1,2,3'
+                           '&featureid=id_1', 'Joe')
+        self.assertRefused('InvalidParameterValue', rewriting.rewrite_get,
+                           GET_FEATURE + 'typeName=A,B,C&filter=(<Filter/>),'
+                           '(<Filter/>)', 'Joe')
+        self.assertRefused('InvalidParameterValue', rewriting.rewrite_get,
+                           GET_FEATURE + 'typeName=A&filter=<Other/>', 'Joe')
+        self.assertRefused('OperationParsingFailed', rewriting.rewrite_get,
+                           GET_FEATURE + 'typeName=A&filter=<Filter>', 'Joe')
+
+
+""" TestRewritePost checks rewrite_post on wfs:GetFeature documents
+"""
+class TestRewritePost(RewritingTestCase):
+
+    def test_every_query_is_restricted(self):
+        desiredResult = (
+            '<wfs:GetFeature xmlns:wfs="http://www.opengis.net/wfs" '
+            'xmlns:ogc="http://www.opengis.net/ogc" '
+            'xmlns:myns="http://www.example.com/myns" '
+            'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+            'service="WFS" version="1.1.0" xsi:schemaLocation="http://www.'
+            'opengis.net/wfs ../wfs/1.1.0/WFS-basic.xsd">'
+            '<wfs:Query typeName="A">%s</wfs:Query>'
+            '<wfs:Query typeName="B"><ogc:Filter><And>%s<ogc:F1/></And>'
+            '</ogc:Filter></wfs:Query>'
+            '<wfs:Query typeName="C"><ogc:Filter><ogc:And><ogc:F2/><ogc:F3/>'
+            '%s</ogc:And></ogc:Filter></wfs:Query>'
+            '<wfs:Query typeName="D">%s</wfs:Query></wfs:GetFeature>'
+            % (USERID_FILTER, USERID, USERID, USERID_FILTER))
+        self.assertRewritten(
+            'POSTDATA=' + rewriting.rewrite_post(POST_GET_FEATURE, 'Joe'),
+            desiredResult)
+
+    def test_only_get_feature_is_accepted(self):
+        self.assertRefused('OperationNotSupported', rewriting.rewrite_post,
+                           '<wfs:Transaction xmlns:wfs="http://www.opengis.net'
+                           '/wfs"/>', 'Joe')
+
+    def test_unexpected_structure_is_refused(self):
+        self.assertRefused('InvalidParameterValue', rewriting.rewrite_post,
+                           '<wfs:GetFeature xmlns:wfs="http://www.opengis.net'
+                           '/wfs"><wfs:Wrapper><wfs:Query typeName="A"/>'
+                           '</wfs:Wrapper></wfs:GetFeature>', 'Joe')
+        self.assertRefused('InvalidParameterValue', rewriting.rewrite_post,
+                           '<wfs:GetFeature xmlns:wfs="http://www.opengis.net'
+                           '/wfs"><wfs:Query typeName="A"><Filter><F1/>'
+                           '</Filter><Filter/></wfs:Query></wfs:GetFeature>',
+                           'Joe')
+
+    def test_malformed_documents_are_refused(self):
+        self.assertRefused('OperationParsingFailed', rewriting.rewrite_post,
+                           '<wfs:GetFeature', 'Joe')
+        self.assertRefused('OperationParsingFailed', rewriting.rewrite_post,
+                           '<!DOCTYPE x [<!ENTITY e "e">]><GetFeature/>',
+                           'Joe')
+
+
+if __name__ == '__main__':
+    unittest.main()
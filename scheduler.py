@@ -0,0 +1,345 @@
+""" Concurrent request scheduling over a single pycurl.CurlMulti
+
+    MultiTransport is a drop-in replacement for transport.Transport that
+    keeps up to max_concurrent requests in flight on one CurlMulti,
+    driven from a background thread. Callers either block in perform()
+    as before, or submit() requests and collect them later.
+
+    run_tests() runs the test cases of a suite module on a bounded pool
+    of threads sharing one MultiTransport, so a suite takes roughly as
+    long as its slowest test rather than the sum of all of them.
+"""
+import os
+import select
+import sys
+import threading
+import traceback
+import unittest
+from collections import deque
+from io import BytesIO
+
+import lazy_import
+import request_timing
+import transport
+
+pycurl = lazy_import.module('pycurl')
+
+# Seconds close() waits for the scheduler thread to wind down
+CLOSE_TIMEOUT = 10
+
+
+class PendingResponse(object):
+    """ A submitted request whose Response may not have arrived yet """
+
+    def __init__(self, request, sink, callback):
+        self.request = request
+        self.callback = callback
+        self.buffer = None
+        # the id of the submitting test, for request_timing
+        self.test = request_timing.current_test()
+        if sink is None:
+            self.buffer = BytesIO()
+            sink = self.buffer.write
+        self.sink = sink
+        self._done = threading.Event()
+        self._response = None
+        self._error = None
+        # what the callback raised, if it did
+        self.callback_error = None
+
+    def _finish(self, response, error):
+        self._response, self._error = response, error
+        self._done.set()
+        if self.callback is not None:
+            # an exception escaping here would stop the scheduler thread
+            # and leave every other request waiting forever
+            try:
+                self.callback(self)
+            except Exception:
+                self.callback_error = sys.exc_info()[1]
+                sys.stderr.write('Callback of %s failed:\n%s' % (
+                    self.request.url, traceback.format_exc()))
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """ Waits for the request and returns its Response, raising the
+            pycurl.error if it failed
+        """
+        if not self._done.wait(timeout):
+            raise RuntimeError('request did not finish within %ss' % timeout)
+        if self._error is not None:
+            raise self._error
+        return self._response
+
+
+class MultiTransport(transport.Transport):
+    """ A Transport that multiplexes requests over one CurlMulti
+
+        At most max_concurrent requests are in flight at once, the rest
+        wait in submission order. Completion callbacks run on the
+        scheduler thread and should return quickly. cancel() and close()
+        abort requests that are queued or in flight: their
+        PendingResponses fail with a pycurl.error E_ABORTED_BY_CALLBACK.
+    """
+
+    def __init__(self, max_concurrent=16):
+        transport.Transport.__init__(self, pool_size=max_concurrent)
+        self.max_concurrent = max_concurrent
+        self.multi = pycurl.CurlMulti()
+        self._queue = deque()
+        self._active = {}
+        self._wakeup = threading.Condition(threading.Lock())
+        self._closed = False
+        # (pendings, event) pairs for the scheduler thread to abort
+        self._cancels = []
+        # written to by submit() to wake the scheduler from select()
+        self._wake_read, self._wake_write = os.pipe()
+        self._thread = threading.Thread(target=self._run,
+                                        name='curl-multi-scheduler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, request, sink=None, callback=None):
+        """ Queues request and returns its PendingResponse. callback,
+            if given, is called with the PendingResponse once it is done.
+        """
+        pending = PendingResponse(request, sink, callback)
+        with self._wakeup:
+            if self._closed:
+                raise RuntimeError('scheduler is closed')
+            self._queue.append(pending)
+            self._wakeup.notify()
+        os.write(self._wake_write, b'.')
+        return pending
+
+    def perform(self, request, sink=None):
+        return self.submit(request, sink).result()
+
+    def cancel(self, pendings):
+        """ Aborts those of pendings that are still queued or in flight
+            and returns once their callbacks have run
+        """
+        done = threading.Event()
+        with self._wakeup:
+            self._cancels.append((list(pendings), done))
+            self._wakeup.notify()
+        if threading.current_thread() is self._thread:
+            self._process_cancels()
+            return
+        os.write(self._wake_write, b'.')
+        while not done.wait(0.1):
+            if not self._thread.is_alive():
+                return
+
+    def _abort(self, pending, error):
+        """ Removes pending from the queue or the multi and fails it """
+        if pending.done():
+            return
+        for handle, active in list(self._active.items()):
+            if active is pending:
+                del self._active[handle]
+                self.multi.remove_handle(handle)
+                handle.close()
+                break
+        else:
+            with self._wakeup:
+                if pending not in self._queue:
+                    return
+                self._queue.remove(pending)
+        pending._finish(None, error)
+
+    def _process_cancels(self):
+        with self._wakeup:
+            cancels, self._cancels = self._cancels, []
+        for pendings, done in cancels:
+            for pending in pendings:
+                self._abort(pending, pycurl.error(pycurl.E_ABORTED_BY_CALLBACK,
+                                                  'request cancelled'))
+            done.set()
+
+    def _abort_all(self):
+        """ Fails every queued and active request, on close """
+        with self._wakeup:
+            pendings = list(self._active.values()) + list(self._queue)
+        for pending in pendings:
+            self._abort(pending, pycurl.error(pycurl.E_ABORTED_BY_CALLBACK,
+                                              'transport closed'))
+        self._process_cancels()
+
+    def _start_queued(self):
+        with self._wakeup:
+            while (not self._queue and not self._active and
+                   not self._closed and not self._cancels):
+                self._wakeup.wait(1.0)
+            started = []
+            while self._queue and len(self._active) < self.max_concurrent:
+                started.append(self._queue.popleft())
+        for pending in started:
+            handle = self._checkout()
+            transport.configure_handle(handle, pending.request, pending.sink)
+            self._active[handle] = pending
+            self.multi.add_handle(handle)
+
+    def _complete(self, handle, error):
+        pending = self._active.pop(handle, None)
+        if pending is None:
+            # cancelled by a callback earlier in the same batch
+            return
+        self.multi.remove_handle(handle)
+        response = None
+        if error is None:
+            reused = handle.getinfo(pycurl.NUM_CONNECTS) == 0
+            body = pending.buffer.getvalue() if pending.buffer else None
+            response = transport.Response(
+                handle.getinfo(pycurl.RESPONSE_CODE), body, reused)
+            request_timing.observe(handle, pending.request, response.status,
+                                   pending.test)
+            handle.reset()
+            self._checkin(handle)
+            self._record(reused)
+        else:
+            request_timing.observe(handle, pending.request, None,
+                                   pending.test, error.args[0])
+            handle.close()
+        pending._finish(response, error)
+
+    def _run(self):
+        while True:
+            self._start_queued()
+            self._process_cancels()
+            if self._closed:
+                self._abort_all()
+                return
+            while True:
+                status, running = self.multi.perform()
+                if status != pycurl.E_CALL_MULTI_PERFORM:
+                    break
+            while True:
+                queued, ok, failed = self.multi.info_read()
+                for handle in ok:
+                    self._complete(handle, None)
+                for handle, errno, message in failed:
+                    self._complete(handle, pycurl.error(errno, message))
+                if not queued:
+                    break
+            if self._active:
+                self._select()
+
+    def _select(self):
+        """ Waits for socket activity, curl's next timeout or a submit """
+        timeout = self.multi.timeout()
+        timeout = 1.0 if timeout < 0 else timeout / 1000.0
+        reads, writes, errors = self.multi.fdset()
+        if not (reads or writes or errors):
+            timeout = min(timeout, 0.01)
+        ready = select.select(reads + [self._wake_read], writes, errors,
+                              timeout)[0]
+        if self._wake_read in ready:
+            os.read(self._wake_read, 4096)
+
+    def close(self, timeout=CLOSE_TIMEOUT):
+        """ Aborts the requests still queued or in flight and releases
+            the handles, waiting at most timeout seconds for the
+            scheduler thread
+        """
+        with self._wakeup:
+            if self._closed:
+                return
+            self._closed = True
+            self._wakeup.notify()
+        os.write(self._wake_write, b'.')
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            # stuck in a callback: leave the multi to it rather than
+            # closing it underneath
+            return
+        os.close(self._wake_read)
+        os.close(self._wake_write)
+        self.multi.close()
+        transport.Transport.close(self)
+
+
+class _LockedResult(object):
+    """ Serialises calls into a TestResult shared between threads """
+
+    def __init__(self, result):
+        self._result = result
+        self._lock = threading.RLock()
+
+    def __getattr__(self, name):
+        attr = getattr(self._result, name)
+        if not callable(attr):
+            return attr
+
+        def locked(*args, **kwargs):
+            with self._lock:
+                return attr(*args, **kwargs)
+        return locked
+
+
+def _flatten(suite):
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            for case in _flatten(test):
+                yield case
+        else:
+            yield test
+
+
+class ConcurrentSuite(unittest.TestSuite):
+    """ Runs its test cases on `concurrency` threads at once
+
+        Class and module fixtures are not supported, the suites in this
+        repository do not use them.
+    """
+
+    def __init__(self, tests=(), concurrency=8):
+        unittest.TestSuite.__init__(self, tests)
+        self.concurrency = concurrency
+
+    def run(self, result):
+        cases = deque(_flatten(self))
+        shared = _LockedResult(result)
+        lock = threading.Lock()
+
+        def worker():
+            while not result.shouldStop:
+                with lock:
+                    if not cases:
+                        return
+                    case = cases.popleft()
+                case(shared)
+
+        workers = [threading.Thread(target=worker)
+                   for _ in range(min(self.concurrency, len(cases)))]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return result
+
+
+def configured_concurrency():
+    """ Returns the COBWEB_CONCURRENCY setting, 1 meaning sequential """
+    return max(1, int(os.environ.get('COBWEB_CONCURRENCY', '1')))
+
+
+def run_tests(module, concurrency, verbosity=2):
+    """ Runs the tests of module concurrently over a shared MultiTransport
+        and returns the TestResult
+    """
+    import response_cache
+    http = response_cache.from_environment(
+        MultiTransport(max_concurrent=concurrency))
+    transport.set_default_transport(http)
+    try:
+        tests = unittest.defaultTestLoader.loadTestsFromModule(module)
+        suite = ConcurrentSuite(tests, concurrency)
+        result = request_timing.TimedTestRunner(verbosity=verbosity).run(suite)
+        print(http.report())
+    finally:
+        transport.set_default_transport(None)
+        http.close()
+    return result
@@ -0,0 +1,75 @@
+import threading
+import time
+import unittest
+
+import lazy_import
+import scheduler
+import stub_server
+import transport
+
+pycurl = lazy_import.module('pycurl')
+
+
+""" TestCancellation checks that requests to a server that never answers
+    can be given up on, without a PEP
+"""
+class TestCancellation(unittest.TestCase):
+
+    def setUp(self):
+        self.server = stub_server.SilentServer()
+        self.http = scheduler.MultiTransport(max_concurrent=2)
+
+    def tearDown(self):
+        self.http.close()
+        self.server.close()
+
+    def _submit(self, count, callback=None):
+        return [self.http.submit(transport.get(self.server.url()),
+                                 callback=callback)
+                for _ in range(count)]
+
+    def assertAborted(self, pending):
+        with self.assertRaises(pycurl.error) as raised:
+            pending.result(0)
+        self.assertEqual(raised.exception.args[0],
+                         pycurl.E_ABORTED_BY_CALLBACK)
+
+    def test_close_aborts_active_and_queued_requests(self):
+        called = []
+        # two in flight, one still queued behind them
+        pendings = self._submit(3, called.append)
+        time.sleep(0.2)
+        started = time.time()
+        self.http.close()
+        self.assertLess(time.time() - started, 2)
+        for pending in pendings:
+            self.assertAborted(pending)
+        self.assertEqual(len(called), 3)
+
+    def test_cancel_aborts_only_the_given_requests(self):
+        pendings = self._submit(3)
+        time.sleep(0.2)
+        self.http.cancel(pendings[:2])
+        for pending in pendings[:2]:
+            self.assertAborted(pending)
+        self.assertFalse(pendings[2].done())
+
+    def test_callbacks_may_cancel(self):
+        done = threading.Event()
+        pendings = self._submit(2)
+
+        def callback(pending):
+            self.http.cancel(pendings[1:])
+            done.set()
+        self.http.cancel([self.http.submit(transport.get(self.server.url()),
+                                           callback=callback)])
+        self.assertTrue(done.wait(5))
+        self.assertAborted(pendings[1])
+
+    def test_close_twice(self):
+        self.http.close()
+        self.http.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
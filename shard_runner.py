@@ -0,0 +1,398 @@
+""" Runs the suites or the fuzzer across several processes
+
+    Test cases are handed out to a pool of worker processes a few at a
+    time, so a slow test does not hold up a whole shard. Every worker
+    has its own pooled transport and request timing log; their results,
+    failures, timings and connection counts are merged into one report
+    in the usual unittest format. Fuzz cases are split by seed, one
+    FuzzRun per worker, and their findings deduplicated across workers.
+    Load runs start one load_generator.LoadRun per worker, the request
+    rate split between them, and merge their latency histograms.
+
+    A worker that has not returned --timeout seconds after the one
+    before it (plus --duration for fuzz and load runs) is given up on:
+    the pool is terminated and its tests are reported as errors, or
+    its share of the cases as missing.
+
+    python shard_runner.py tests endpoint_tests pep_rewriting_tests
+    python shard_runner.py --processes 8 fuzz --cases 200000
+    python shard_runner.py --processes 4 load --duration 60 --rate 200
+
+    multiprocessing.Pool is used rather than concurrent.futures so the
+    runner works on Python 2.7 as well.
+"""
+import argparse
+import importlib
+import json
+import sys
+import time
+import unittest
+
+import filter_fuzzer
+import latency
+import lazy_import
+import load_generator
+import request_timing
+import scheduler
+import suite_config
+import transport
+
+multiprocessing = lazy_import.module('multiprocessing')
+
+# Seconds a worker may take for one job
+WORKER_TIMEOUT = 600
+
+# Transports inherited from the parent on fork. They are kept alive and
+# never used, closing them would close connections the parent still has.
+_inherited = []
+
+
+def _init_worker():
+    inherited = transport.set_default_transport(None)
+    if inherited is not None:
+        _inherited.append(inherited)
+    request_timing.enable()
+
+
+def _gather(pool, function, jobs, timeout):
+    """ Returns the results of function over jobs, run on pool one job
+        at a time, in order. If a result has not come in timeout seconds
+        after the one before, the pool is terminated and the jobs still
+        outstanding get None.
+    """
+    results = []
+    iterator = pool.imap(function, jobs, 1)
+    for _ in jobs:
+        try:
+            results.append(iterator.next(timeout))
+        except multiprocessing.TimeoutError:
+            pool.terminate()
+            break
+    return results + [None] * (len(jobs) - len(results))
+
+
+class _ShardResult(unittest.TestResult):
+    """ Collects picklable outcomes instead of printing them """
+
+    def __init__(self):
+        unittest.TestResult.__init__(self)
+        self.outcomes = []
+        self._started = None
+
+    def startTest(self, test):
+        unittest.TestResult.startTest(self, test)
+        request_timing.set_current_test(test.id())
+        self._started = time.time()
+
+    def stopTest(self, test):
+        unittest.TestResult.stopTest(self, test)
+        request_timing.set_current_test(None)
+
+    def _outcome(self, test, outcome, detail=None):
+        self.outcomes.append({'id': test.id(), 'description': str(test),
+                              'outcome': outcome, 'detail': detail,
+                              'seconds': time.time() - self._started})
+
+    def addSuccess(self, test):
+        self._outcome(test, 'ok')
+
+    def addFailure(self, test, err):
+        self._outcome(test, 'FAIL', self._exc_info_to_string(err, test))
+
+    def addError(self, test, err):
+        self._outcome(test, 'ERROR', self._exc_info_to_string(err, test))
+
+    def addSkip(self, test, reason):
+        self._outcome(test, 'skipped', reason)
+
+    def addExpectedFailure(self, test, err):
+        self._outcome(test, 'expected failure')
+
+    def addUnexpectedSuccess(self, test):
+        self._outcome(test, 'unexpected success')
+
+
+def _run_tests(ids):
+    """ Worker: runs the tests named by ids and returns their outcomes,
+        request timings and transport counts
+    """
+    log = request_timing.enable()
+    del log.records[:]
+    http = transport.default_transport()
+    before = http.stats()
+    result = _ShardResult()
+    unittest.defaultTestLoader.loadTestsFromNames(ids).run(result)
+    after = http.stats()
+    return {'outcomes': result.outcomes,
+            'timings': list(log.records),
+            'requests': after['requests'] - before['requests'],
+            'reused': after['reused'] - before['reused']}
+
+
+def test_ids(module_names):
+    """ Returns the ids of all tests in the named modules """
+    ids = []
+
+    def collect(suite):
+        for test in suite:
+            if isinstance(test, unittest.TestSuite):
+                collect(test)
+            else:
+                ids.append(test.id())
+    for name in module_names:
+        collect(unittest.defaultTestLoader.loadTestsFromModule(
+            importlib.import_module(name)))
+    return ids
+
+
+def run_tests(module_names, processes, chunk=2, stream=sys.stderr,
+              timeout=WORKER_TIMEOUT):
+    """ Runs the modules' tests over processes workers, prints the merged
+        report and returns True if everything passed
+    """
+    ids = test_ids(module_names)
+    chunks = [ids[i:i + chunk] for i in range(0, len(ids), chunk)]
+    started = time.time()
+    pool = multiprocessing.Pool(processes, _init_worker)
+    try:
+        shards = _gather(pool, _run_tests, chunks, timeout)
+    finally:
+        pool.close()
+        pool.join()
+    elapsed = time.time() - started
+
+    for index, shard in enumerate(shards):
+        if shard is None:
+            shards[index] = {
+                'outcomes': [{'id': i, 'description': i, 'outcome': 'ERROR',
+                              'detail': 'worker timed out after %ds\n'
+                                        % timeout, 'seconds': None}
+                             for i in chunks[index]],
+                'timings': [], 'requests': 0, 'reused': 0}
+    outcomes = dict((o['id'], o) for shard in shards
+                    for o in shard['outcomes'])
+    ordered = [outcomes[i] for i in ids if i in outcomes]
+    for outcome in ordered:
+        stream.write('%s ... %s\n' % (outcome['description'],
+                                      outcome['outcome']))
+    problems = [o for o in ordered if o['outcome'] in ('FAIL', 'ERROR')]
+    for outcome in problems:
+        stream.write('\n%s\n%s: %s\n%s\n%s' % (
+            '=' * 70, outcome['outcome'], outcome['description'], '-' * 70,
+            outcome['detail']))
+    stream.write('\n%s\nRan %d tests in %.3fs on %d processes\n\n' % (
+        '-' * 70, len(ordered), elapsed, processes))
+    failures = len([o for o in problems if o['outcome'] == 'FAIL'])
+    errors = len(problems) - failures
+    if problems:
+        stream.write('FAILED (%s)\n' % ', '.join(
+            '%s=%d' % (kind, count) for kind, count in
+            (('failures', failures), ('errors', errors)) if count))
+    else:
+        stream.write('OK\n')
+
+    requests = sum(shard['requests'] for shard in shards)
+    reused = sum(shard['reused'] for shard in shards)
+    print('HTTP requests: %d, connections reused: %d (%.0f%%)' % (
+        requests, reused, 100.0 * reused / requests if requests else 0))
+    log = request_timing.TimingLog()
+    for shard in shards:
+        log.records.extend(shard['timings'])
+    if log.records:
+        print('Request phases (mean ms):')
+        print(log.breakdown())
+    return not problems and len(ordered) == len(ids)
+
+
+def _fuzz(args):
+    """ Worker: runs one FuzzRun and returns its report and findings """
+    seed, cases, duration, concurrency, user, echo_user, url = args
+    http = scheduler.MultiTransport(max_concurrent=concurrency)
+    try:
+        run = filter_fuzzer.FuzzRun(filter_fuzzer.Grammar(seed, user),
+                                    filter_fuzzer.Oracle(echo_user), http,
+                                    concurrency, url)
+        report = run.report(run.run(cases, duration))
+    finally:
+        http.close()
+    return report
+
+
+def run_fuzz(processes, cases, duration=None, concurrency=32, seed=0,
+             user=None, echo_user='Joe', url=None, timeout=WORKER_TIMEOUT):
+    """ Runs the fuzzer with one seed per worker and returns the merged
+        report
+    """
+    share = None if cases is None else -(-cases // processes)
+    jobs = [(seed + index, share, duration, concurrency, user, echo_user,
+             url) for index in range(processes)]
+    pool = multiprocessing.Pool(processes, _init_worker)
+    try:
+        reports = _gather(pool, _fuzz, jobs, timeout + (duration or 0))
+    finally:
+        pool.close()
+        pool.join()
+    timed_out = reports.count(None)
+    reports = [report for report in reports if report is not None]
+    if not reports:
+        return {'target': url, 'processes': processes, 'timed_out': timed_out,
+                'cases': 0, 'duration_s': 0.0, 'requests_per_s': 0.0,
+                'outcomes': {}, 'findings': []}
+
+    findings = {}
+    outcomes = {}
+    for report in reports:
+        for kind, count in report['outcomes'].items():
+            outcomes[kind] = outcomes.get(kind, 0) + count
+        for finding in report['findings']:
+            key = (finding['kind'],
+                   filter_fuzzer.normalize_reason(finding['reason']),
+                   finding['method'])
+            best = findings.get(key)
+            if best is None:
+                findings[key] = dict(finding)
+                continue
+            best['count'] += finding['count']
+            if len(finding['data']) < len(best['data']):
+                best.update(dict(finding, count=best['count']))
+    sent = sum(report['cases'] for report in reports)
+    elapsed = max(report['duration_s'] for report in reports)
+    return {'target': reports[0]['target'], 'processes': processes,
+            'timed_out': timed_out, 'cases': sent, 'duration_s': elapsed,
+            'requests_per_s': sent / elapsed if elapsed else 0.0,
+            'outcomes': outcomes,
+            'findings': sorted(findings.values(),
+                               key=lambda f: (f['kind'], -f['count']))}
+
+
+def _load(args):
+    """ Worker: runs one LoadRun and returns its start time, elapsed
+        seconds, per shape histograms and errors, and transport counts
+    """
+    names, user, url, duration, rate, concurrency, max_in_flight = args
+    requests = load_generator.shape_requests(user, names, url)
+    http = scheduler.MultiTransport(
+        max_concurrent=max(max_in_flight, concurrency))
+    try:
+        run = load_generator.LoadRun(requests, http, duration, rate,
+                                     concurrency)
+        elapsed = run.run()
+        stats = http.stats()
+    finally:
+        http.close()
+    return {'started': run.started, 'elapsed': elapsed, 'transport': stats,
+            'shapes': dict((name, {'histogram': shape.histogram.to_dict(),
+                                   'errors': shape.errors})
+                           for name, shape in run.stats.items())}
+
+
+def run_load(processes, duration, rate=None, concurrency=8, names=None,
+             user=None, url=None, max_in_flight=64, timeout=WORKER_TIMEOUT):
+    """ Runs a LoadRun in each worker, rate split between them and
+        concurrency requests in flight per worker, and returns the merged
+        report in load_generator's format
+    """
+    if url is None:
+        url = suite_config.WFS_POST_URL
+    share = None if rate is None else float(rate) / processes
+    jobs = [(names, user, url, duration, share, concurrency, max_in_flight)
+            for _ in range(processes)]
+    pool = multiprocessing.Pool(processes, _init_worker)
+    try:
+        shards = _gather(pool, _load, jobs, timeout + duration)
+    finally:
+        pool.close()
+        pool.join()
+
+    merged = load_generator.LoadRun(
+        load_generator.shape_requests(user, names, url), None, duration,
+        rate, concurrency * processes)
+    finished = [shard for shard in shards if shard is not None]
+    transport_stats = {}
+    for shard in finished:
+        for name, shape in shard['shapes'].items():
+            stats = merged.stats[name]
+            stats.histogram.merge(
+                latency.LatencyHistogram.from_dict(shape['histogram']))
+            for kind, count in shape['errors'].items():
+                stats.errors[kind] = stats.errors.get(kind, 0) + count
+        for key, value in shard['transport'].items():
+            if isinstance(value, int):
+                transport_stats[key] = transport_stats.get(key, 0) + value
+    merged.started = min([s['started'] for s in finished] or [time.time()])
+    report = merged.report(max([s['elapsed'] for s in finished] or [0.0]))
+    requests = transport_stats.get('requests', 0)
+    transport_stats['reuse_ratio'] = (
+        float(transport_stats.get('reused', 0)) / requests if requests else 0.0)
+    report.update({'processes': processes,
+                   'timed_out': len(shards) - len(finished),
+                   'transport': transport_stats})
+    return report
+
+
+def _write(report, output):
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if output:
+        with open(output, 'w') as out:
+            out.write(text + '\n')
+    else:
+        print(text)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--processes', type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument('--timeout', type=float, default=WORKER_TIMEOUT,
+                        help='seconds a worker may take for one job, on '
+                             'top of --duration for fuzz and load runs')
+    commands = parser.add_subparsers(dest='command')
+    tests = commands.add_parser('tests', help='run test modules')
+    tests.add_argument('modules', nargs='+')
+    tests.add_argument('--chunk', type=int, default=2,
+                       help='tests handed to a worker at a time')
+    fuzz = commands.add_parser('fuzz', help='run filter_fuzzer.py')
+    fuzz.add_argument('--cases', type=int, default=10000)
+    fuzz.add_argument('--duration', type=float)
+    fuzz.add_argument('--concurrency', type=int, default=32,
+                      help='requests in flight per process')
+    fuzz.add_argument('--seed', type=int, default=0)
+    fuzz.add_argument('--user')
+    fuzz.add_argument('--echo-user', default='Joe')
+    fuzz.add_argument('--url')
+    fuzz.add_argument('--output', help='write the JSON report here')
+    load = commands.add_parser('load', help='run load_generator.py')
+    load.add_argument('--duration', type=float, default=60)
+    load.add_argument('--rate', type=float,
+                      help='open loop request rate per second, in total')
+    load.add_argument('--concurrency', type=int, default=8,
+                      help='requests in flight per process when no rate '
+                           'is given')
+    load.add_argument('--max-in-flight', type=int, default=64,
+                      help='connection limit of each scheduler')
+    load.add_argument('--shapes', help='comma separated shape names')
+    load.add_argument('--user')
+    load.add_argument('--url')
+    load.add_argument('--output', help='write the JSON report here')
+    args = parser.parse_args(argv)
+
+    if args.command == 'tests':
+        return 0 if run_tests(args.modules, args.processes, args.chunk,
+                              timeout=args.timeout) else 1
+    if args.command == 'load':
+        report = run_load(args.processes, args.duration, args.rate,
+                          args.concurrency,
+                          args.shapes.split(',') if args.shapes else None,
+                          args.user, args.url, args.max_in_flight,
+                          args.timeout)
+        _write(report, args.output)
+        return 1 if report['overall']['errors'] or report['timed_out'] else 0
+    report = run_fuzz(args.processes, args.cases, args.duration,
+                      args.concurrency, args.seed, args.user, args.echo_user,
+                      args.url, args.timeout)
+    _write(report, args.output)
+    return 1 if report['findings'] or report['timed_out'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,59 @@
+import sys
+import time
+import types
+import unittest
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+import shard_runner
+
+# A module of tests for the workers to run, built here so that the
+# stalling test is not collected with this file's own tests
+STALL_MODULE = 'shard_runner_stall'
+
+
+class _Stalling(object):
+
+    def test_quick(self):
+        pass
+
+    def test_stall(self):
+        time.sleep(60)
+
+
+def _stall_module():
+    module = types.ModuleType(STALL_MODULE)
+    module.TestStall = type('TestStall', (_Stalling, unittest.TestCase),
+                            {'__module__': STALL_MODULE})
+    sys.modules[STALL_MODULE] = module
+
+
+""" TestWorkerTimeout checks that a worker stuck in a test is given up
+    on and its tests reported as errors
+"""
+class TestWorkerTimeout(unittest.TestCase):
+
+    def setUp(self):
+        _stall_module()
+
+    def tearDown(self):
+        del sys.modules[STALL_MODULE]
+
+    def test_stalled_worker_is_reported(self):
+        stream = StringIO()
+        started = time.time()
+        passed = shard_runner.run_tests([STALL_MODULE], 2, chunk=1,
+                                        stream=stream, timeout=1)
+        self.assertLess(time.time() - started, 20)
+        self.assertFalse(passed)
+        report = stream.getvalue()
+        self.assertIn('test_quick', report)
+        self.assertIn('worker timed out after 1s', report)
+        self.assertIn('FAILED (errors=1)', report)
+
+
+if __name__ == '__main__':
+    unittest.main()
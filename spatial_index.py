@@ -0,0 +1,150 @@
+""" Client-side verification of bbox results
+
+    Feature coordinates are kept in a CoordinateStore, two array('d')
+    columns plus the feature ids, and indexed by a uniform GridIndex.
+    That lets the suites check that every returned geometry lies inside
+    the requested envelope, and compute the expected result of
+    thousands of random envelopes from one downloaded dataset without
+    asking the server for it again.
+
+    Envelopes are (lower_a, lower_b, upper_a, upper_b) tuples in the
+    axis order of gml:pos, the same order as the WFS bbox parameter.
+"""
+import math
+import random
+from array import array
+
+
+class CoordinateStore(object):
+    """ Point coordinates and ids of features, in arrival order """
+
+    def __init__(self):
+        self.a = array('d')
+        self.b = array('d')
+        self.fids = []
+
+    def __len__(self):
+        return len(self.a)
+
+    def add(self, fid, a, b):
+        self.fids.append(fid)
+        self.a.append(a)
+        self.b.append(b)
+
+    def add_pos(self, fid, pos):
+        """ Adds a feature from the text of its gml:pos """
+        a, b = pos.split()[:2]
+        self.add(fid, float(a), float(b))
+
+    def extent(self):
+        """ Returns the envelope of all coordinates, None when empty """
+        if not self.a:
+            return None
+        return min(self.a), min(self.b), max(self.a), max(self.b)
+
+    def all_inside(self, envelope):
+        """ Returns True if every coordinate lies inside envelope """
+        extent = self.extent()
+        return extent is None or (envelope[0] <= extent[0] and
+                                  envelope[1] <= extent[1] and
+                                  extent[2] <= envelope[2] and
+                                  extent[3] <= envelope[3])
+
+    def outside(self, envelope):
+        """ Returns the ids of the features outside envelope """
+        if self.all_inside(envelope):
+            return []
+        lower_a, lower_b, upper_a, upper_b = envelope
+        return [self.fids[i] for i, (a, b) in enumerate(zip(self.a, self.b))
+                if not (lower_a <= a <= upper_a and lower_b <= b <= upper_b)]
+
+
+class GridIndex(object):
+    """ A uniform grid over a CoordinateStore
+
+        Cells entirely inside a query envelope contribute all their
+        points without a per-point test, so a query costs roughly the
+        number of cells it touches plus the points on its border.
+    """
+
+    def __init__(self, store, points_per_cell=16):
+        self.store = store
+        extent = store.extent() or (0.0, 0.0, 0.0, 0.0)
+        self.extent = extent
+        cells = max(1, int(math.sqrt(len(store) / float(points_per_cell))))
+        self.cells = cells
+        self.size_a = (extent[2] - extent[0]) / cells or 1.0
+        self.size_b = (extent[3] - extent[1]) / cells or 1.0
+        self.buckets = {}
+        for i, (a, b) in enumerate(zip(store.a, store.b)):
+            key = (self._cell_a(a), self._cell_b(b))
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = array('l')
+            bucket.append(i)
+
+    def _cell_a(self, a):
+        return min(self.cells - 1,
+                   max(0, int((a - self.extent[0]) / self.size_a)))
+
+    def _cell_b(self, b):
+        return min(self.cells - 1,
+                   max(0, int((b - self.extent[1]) / self.size_b)))
+
+    def query(self, envelope):
+        """ Returns the store indices of the points inside envelope """
+        lower_a, lower_b, upper_a, upper_b = envelope
+        extent = self.extent
+        if (upper_a < extent[0] or upper_b < extent[1] or
+                lower_a > extent[2] or lower_b > extent[3] or
+                not self.store.a):
+            return array('l')
+        store_a, store_b = self.store.a, self.store.b
+        found = array('l')
+        for cell_a in range(self._cell_a(lower_a), self._cell_a(upper_a) + 1):
+            cell_lower_a = extent[0] + cell_a * self.size_a
+            inner_a = (lower_a < cell_lower_a and
+                       cell_lower_a + self.size_a < upper_a and
+                       cell_a < self.cells - 1)
+            for cell_b in range(self._cell_b(lower_b),
+                                self._cell_b(upper_b) + 1):
+                bucket = self.buckets.get((cell_a, cell_b))
+                if bucket is None:
+                    continue
+                cell_lower_b = extent[1] + cell_b * self.size_b
+                if (inner_a and lower_b < cell_lower_b and
+                        cell_lower_b + self.size_b < upper_b and
+                        cell_b < self.cells - 1):
+                    found.extend(bucket)
+                    continue
+                found.extend(i for i in bucket
+                             if lower_a <= store_a[i] <= upper_a and
+                             lower_b <= store_b[i] <= upper_b)
+        return found
+
+    def fids(self, envelope):
+        """ Returns the set of feature ids inside envelope """
+        fids = self.store.fids
+        return set(fids[i] for i in self.query(envelope))
+
+    def counts(self, envelopes):
+        """ Returns the number of points inside each of envelopes """
+        return [len(self.query(envelope)) for envelope in envelopes]
+
+
+def random_envelopes(extent, count, seed=0, max_fraction=0.5):
+    """ Returns count reproducible envelopes inside extent, each side at
+        most max_fraction of the extent's
+    """
+    rng = random.Random(seed)
+    lower_a, lower_b, upper_a, upper_b = extent
+    span_a, span_b = upper_a - lower_a, upper_b - lower_b
+    envelopes = []
+    for _ in range(count):
+        size_a = rng.uniform(0, span_a * max_fraction)
+        size_b = rng.uniform(0, span_b * max_fraction)
+        a = rng.uniform(lower_a, upper_a - size_a)
+        b = rng.uniform(lower_b, upper_b - size_b)
+        envelopes.append((round(a, 6), round(b, 6),
+                          round(a + size_a, 6), round(b + size_b, 6)))
+    return envelopes
@@ -0,0 +1,89 @@
+import random
+import unittest
+
+import spatial_index
+
+
+def _brute_force(store, envelope):
+    lower_a, lower_b, upper_a, upper_b = envelope
+    return set(fid for fid, a, b in zip(store.fids, store.a, store.b)
+               if lower_a <= a <= upper_a and lower_b <= b <= upper_b)
+
+
+def _random_store(count, seed, extent=(50.0, -5.0, 55.0, 0.0)):
+    rng = random.Random(seed)
+    store = spatial_index.CoordinateStore()
+    for i in range(count):
+        store.add('f%d' % i, rng.uniform(extent[0], extent[2]),
+                  rng.uniform(extent[1], extent[3]))
+    return store
+
+
+""" TestGridIndex compares GridIndex queries with a scan of every point
+"""
+class TestGridIndex(unittest.TestCase):
+
+    def assertMatchesBruteForce(self, store, envelopes, points_per_cell=16):
+        index = spatial_index.GridIndex(store, points_per_cell)
+        for envelope in envelopes:
+            self.assertEqual(index.fids(envelope),
+                             _brute_force(store, envelope), envelope)
+            self.assertEqual(len(index.query(envelope)),
+                             len(_brute_force(store, envelope)), envelope)
+
+    def test_random_envelopes(self):
+        store = _random_store(5000, 1)
+        envelopes = spatial_index.random_envelopes(store.extent(), 200, 1)
+        self.assertMatchesBruteForce(store, envelopes)
+        self.assertMatchesBruteForce(store, envelopes, points_per_cell=1)
+
+    def test_envelopes_beyond_the_extent(self):
+        store = _random_store(1000, 2)
+        lower_a, lower_b, upper_a, upper_b = store.extent()
+        self.assertMatchesBruteForce(store, [
+            (lower_a - 10, lower_b - 10, upper_a + 10, upper_b + 10),
+            (upper_a + 1, upper_b + 1, upper_a + 2, upper_b + 2),
+            (lower_a - 2, lower_b - 2, lower_a - 1, lower_b - 1),
+            (lower_a - 1, lower_b, (lower_a + upper_a) / 2, upper_b + 1)])
+
+    def test_points_on_cell_and_envelope_borders(self):
+        store = spatial_index.CoordinateStore()
+        for a in range(11):
+            for b in range(11):
+                store.add('f%d_%d' % (a, b), float(a), float(b))
+        envelopes = [(0, 0, 10, 10), (2, 3, 7, 7), (5, 5, 5, 5),
+                     (2.5, 2.5, 2.5, 2.5), (0, 0, 0, 10), (10, 0, 10, 10)]
+        self.assertMatchesBruteForce(store, envelopes, points_per_cell=4)
+
+    def test_degenerate_stores(self):
+        self.assertMatchesBruteForce(spatial_index.CoordinateStore(),
+                                     [(0, 0, 1, 1)])
+        store = spatial_index.CoordinateStore()
+        for i in range(50):
+            store.add('f%d' % i, 3.0, 4.0)
+        self.assertMatchesBruteForce(store, [(3, 4, 3, 4), (0, 0, 2, 2)])
+
+    def test_counts(self):
+        store = _random_store(2000, 3)
+        envelopes = spatial_index.random_envelopes(store.extent(), 20, 3)
+        index = spatial_index.GridIndex(store)
+        self.assertEqual(index.counts(envelopes),
+                         [len(_brute_force(store, e)) for e in envelopes])
+
+
+""" TestCoordinateStore checks the bbox assertions made on responses
+"""
+class TestCoordinateStore(unittest.TestCase):
+
+    def test_outside(self):
+        store = spatial_index.CoordinateStore()
+        store.add_pos('inside', '51.5 -1.0')
+        store.add_pos('outside', '49.0 -1.0 12.0')
+        self.assertFalse(store.all_inside((50, -5, 55, 0)))
+        self.assertEqual(store.outside((50, -5, 55, 0)), ['outside'])
+        self.assertEqual(store.outside((40, -5, 55, 0)), [])
+        self.assertTrue(spatial_index.CoordinateStore().all_inside((0, 0, 0, 0)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,381 @@
+""" Local stand-in for the PEP and the WFS behind it
+
+    Serves two endpoints so the suites can run offline, in parallel and
+    with deterministic latency:
+
+    /echo/wfs  implements the rewriting contract of rewriting.py and
+               echoes the forwarded request, as the test deployment
+               does for pep_rewriting_tests.py. Requests the contract
+               does not cover are refused, so filter_fuzzer.py findings
+               against it point at rewriting.py, not at gaps in the stub
+    /wfs       rewrites like the PEP and then answers like GeoServer,
+               with FeatureCollections from a seeded synthetic survey
+               dataset, for endpoint_tests.py
+    /geoserver/wfs
+               answers like GeoServer without the PEP in front, the
+               filters are evaluated as given, for pep_overhead.py
+
+    Point a suite at it through COBWEB_WFS_URL, e.g.
+
+    python stub_server.py --port 8099 &
+    COBWEB_WFS_URL=http://127.0.0.1:8099/echo/wfs python pep_rewriting_tests.py
+    COBWEB_WFS_URL=http://127.0.0.1:8099/wfs \
+        COBWEB_ECHO_URL=http://127.0.0.1:8099/echo/wfs python endpoint_tests.py
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+import feature_generator
+import rewriting
+import suite_config
+
+EXCEPTION_REPORT = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<ows:ExceptionReport xmlns:ows="http://www.opengis.net/ows"'
+    ' version="1.0.0"><ows:Exception exceptionCode="%s">'
+    '<ows:ExceptionText>%s</ows:ExceptionText></ows:Exception>'
+    '</ows:ExceptionReport>')
+
+
+class SyntheticSurveys(object):
+    """ A reproducible set of observations for any survey typeName,
+        regenerated from the seed on every request so that large
+        surveys cost no memory
+
+        Every user gets at least one observation with pos_acc -1.0
+        inside England in every survey, the rest are spread over the
+        British Isles.
+    """
+
+    def __init__(self, users, features_per_survey=200, seed=0):
+        self.users = list(users)
+        self.features_per_survey = max(features_per_survey, len(self.users))
+        self.seed = seed
+
+    def features(self, typeName):
+        return feature_generator.survey_features(
+            typeName, self.users, self.features_per_survey, self.seed)
+
+
+COMPARISONS = {
+    'PropertyIsEqualTo': lambda a, b: a == b,
+    'PropertyIsNotEqualTo': lambda a, b: a != b,
+    'PropertyIsLessThan': lambda a, b: a < b,
+    'PropertyIsGreaterThan': lambda a, b: a > b,
+    'PropertyIsLessThanOrEqualTo': lambda a, b: a <= b,
+    'PropertyIsGreaterThanOrEqualTo': lambda a, b: a >= b,
+}
+ID_OPERATORS = ('FeatureId', 'GmlObjectId')
+
+
+def _child_text(element, local):
+    return [c.text.strip() for c in element.children if c.local == local]
+
+
+def _corners(envelope):
+    lower = _child_text(envelope, 'lowerCorner')[0].split()
+    upper = _child_text(envelope, 'upperCorner')[0].split()
+    return [float(v) for v in lower + upper]
+
+
+def direct_queries(query, body):
+    """ Returns the (typeName, filter) queries of a request sent straight
+        to the WFS, a missing filter matching everything
+    """
+    if body is not None:
+        root = rewriting.parse(body)
+        return [(q.get('typeName'),
+                 ([c for c in q.children if c.local == 'Filter'] or
+                  [rewriting.Element('Filter')])[0])
+                for q in root.children if q.local == 'Query']
+    values = dict((k.lower(), v) for k, v in rewriting.parse_query(query))
+    typeNames = [name for name in values.get('typename', '').split(',')
+                 if name]
+    if not values.get('filter'):
+        return [(name, rewriting.Element('Filter')) for name in typeNames]
+    filters = [rewriting.parse(text)
+               for text in rewriting.split_filter_list(values['filter'])]
+    if len(filters) == 1:
+        filters = filters * len(typeNames)
+    if len(filters) != len(typeNames):
+        raise rewriting.RewriteError('InvalidParameterValue',
+                                     'expected one filter per typeName')
+    return list(zip(typeNames, filters))
+
+
+def check_filter(element):
+    """ Raises RewriteError for filters the stand-in WFS cannot evaluate """
+    local = element.local
+    if local in ('Filter', 'And', 'Or', 'Not'):
+        if local == 'Not' and len(element.children) != 1:
+            raise rewriting.RewriteError('InvalidParameterValue',
+                                         'Not takes one operand')
+        for child in element.children:
+            check_filter(child)
+    elif local in COMPARISONS:
+        if (len(_child_text(element, 'PropertyName')) != 1 or
+                len(_child_text(element, 'Literal')) != 1):
+            raise rewriting.RewriteError('InvalidParameterValue',
+                                         'malformed %s' % element.tag)
+    elif local == 'BBOX':
+        envelopes = [c for c in element.children if c.local == 'Envelope']
+        try:
+            if len(_corners(envelopes[0])) != 4:
+                raise ValueError()
+        except (IndexError, ValueError):
+            raise rewriting.RewriteError('InvalidParameterValue',
+                                         'malformed BBOX')
+    elif local not in ID_OPERATORS:
+        raise rewriting.RewriteError('InvalidParameterValue',
+                                     'unsupported operator %s' % element.tag)
+
+
+def _compare(element, feature, compare):
+    value = feature.attribute(_child_text(element, 'PropertyName')[0])
+    if value is None:
+        return False
+    literal = _child_text(element, 'Literal')[0]
+    try:
+        return compare(float(value), float(literal))
+    except ValueError:
+        return compare(str(value), literal)
+
+
+def _fid(element):
+    return element.get('fid') or element.get('gml:id')
+
+
+def matches(element, feature):
+    """ Evaluates a filter Element that passed check_filter() against a
+        Feature the way the WFS behind the PEP does. Sibling FeatureIds
+        form one id set.
+    """
+    local = element.local
+    if local in ('Filter', 'And'):
+        fids = [_fid(c) for c in element.children if c.local in ID_OPERATORS]
+        if fids and feature.fid not in fids:
+            return False
+        return all(matches(child, feature) for child in element.children
+                   if child.local not in ID_OPERATORS)
+    if local == 'Or':
+        return any(matches(child, feature) for child in element.children)
+    if local == 'Not':
+        return not matches(element.children[0], feature)
+    if local in COMPARISONS:
+        return _compare(element, feature, COMPARISONS[local])
+    if local in ID_OPERATORS:
+        return feature.fid == _fid(element)
+    envelopes = [c for c in element.children if c.local == 'Envelope']
+    lower_a, lower_b, upper_a, upper_b = _corners(envelopes[0])
+    return (lower_a <= feature.lat <= upper_a and
+            lower_b <= feature.lon <= upper_b)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def _send(self, status, body, content_type='text/xml'):
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_exception(self, status, code, message):
+        self._send(status, EXCEPTION_REPORT % (code, rewriting.escape(message)))
+
+    def _send_features(self, queries):
+        """ Streams a FeatureCollection for (typeName, filter) queries
+            using chunked transfer encoding
+        """
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        features = ((typeName, feature)
+                    for typeName, filter in queries
+                    for feature in self.server.surveys.features(typeName)
+                    if matches(filter, feature))
+        for chunk in feature_generator.iter_chunks(features):
+            self.wfile.write(('%x\r\n' % len(chunk)).encode('ascii') +
+                             chunk + b'\r\n')
+        self.wfile.write(b'0\r\n\r\n')
+
+    def _handle(self, body):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        path, _, query = self.path.partition('?')
+        user = self.headers.get('uuid')
+        if path not in ('/echo/wfs', '/wfs', '/geoserver/wfs'):
+            return self._send(404, 'not found', 'text/plain')
+        if path == '/geoserver/wfs':
+            try:
+                queries = direct_queries(query, body)
+                for typeName, filter in queries:
+                    check_filter(filter)
+            except rewriting.RewriteError as error:
+                return self._send_exception(400, error.code, str(error))
+            return self._send_features(queries)
+        if not user:
+            return self._send_exception(403, 'AccessDenied',
+                                        'no uuid header given')
+        try:
+            if path == '/echo/wfs':
+                user = self.server.echo_user or user
+                if body is None:
+                    echoed = rewriting.rewrite_get(query, user)
+                else:
+                    echoed = 'POSTDATA=' + rewriting.rewrite_post(body, user)
+                return self._send(200, echoed, 'text/plain')
+            if body is None:
+                params = rewriting.parse_query(query)
+                queries = list(zip(*rewriting.query_filters(params, user)))
+            else:
+                root = rewriting.rewrite_post_tree(body, user)
+                queries = [(q.get('typeName'),
+                            [c for c in q.children if c.local == 'Filter'][0])
+                           for q in root.children if q.local == 'Query']
+            for typeName, filter in queries:
+                check_filter(filter)
+        except rewriting.RewriteError as error:
+            return self._send_exception(400, error.code, str(error))
+        except Exception as error:
+            # Answer like a failing PEP rather than dropping the connection
+            return self._send_exception(500, 'NoApplicableCode',
+                                        '%s: %s' % (type(error).__name__,
+                                                    error))
+        self._send_features(queries)
+
+    def do_GET(self):
+        self._handle(None)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self._handle(self.rfile.read(length))
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, address, surveys, echo_user='Joe', latency=0.0,
+                 verbose=False):
+        HTTPServer.__init__(self, address, StubHandler)
+        self.surveys = surveys
+        self.echo_user = echo_user
+        self.latency = latency
+        self.verbose = verbose
+
+    def url(self, path='/wfs'):
+        return 'http://%s:%d%s' % (self.server_address[0],
+                                   self.server_address[1], path)
+
+
+def start(surveys, port=0, host='127.0.0.1', **options):
+    """ Starts a StubServer on a daemon thread and returns it """
+    server = StubServer((host, port), surveys, **options)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+class SilentServer(object):
+    """ Accepts connections and never answers, to test how clients deal
+        with a stalled PEP. The kernel completes the handshakes, nothing
+        ever reads the requests.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.bind((host, port))
+        self.socket.listen(128)
+        self.server_address = self.socket.getsockname()
+
+    def url(self, path='/wfs'):
+        return 'http://%s:%d%s' % (self.server_address[0],
+                                   self.server_address[1], path)
+
+    def close(self):
+        self.socket.close()
+
+
+def spawn(*arguments):
+    """ Starts stub_server.py with arguments in a separate interpreter on
+        a free port and returns (process, the URL of its /echo/wfs).
+        Terminate the process when done.
+    """
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'stub_server.py')
+    process = subprocess.Popen([sys.executable, '-u', script, '--port', '0']
+                               + list(arguments), stdout=subprocess.PIPE)
+    # main() prints the /echo/wfs URL first, once it is listening
+    line = process.stdout.readline().decode('ascii')
+    if not line.startswith('COBWEB_WFS_URL='):
+        process.terminate()
+        process.wait()
+        raise RuntimeError('stub_server.py did not start')
+    return process, line.split('=', 1)[1].split()[0]
+
+
+def default_users():
+    """ The suite's users plus a few others whose data must stay hidden """
+    users = [suite_config.USER1, suite_config.USER2]
+    return sorted(set(users)) + ['stub-user-%d' % i for i in range(1, 4)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency-ms', type=float, default=0.0,
+                        help='fixed delay added to every response')
+    parser.add_argument('--users',
+                        help='comma separated userids owning observations')
+    parser.add_argument('--features-per-survey', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--echo-user', default='Joe',
+                        help='identity the rewriting echo reports, as on '
+                             'the test deployment; empty for the uuid header')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    users = args.users.split(',') if args.users else default_users()
+    surveys = SyntheticSurveys(users, args.features_per_survey, args.seed)
+    server = StubServer((args.host, args.port), surveys,
+                        echo_user=args.echo_user or None,
+                        latency=args.latency_ms / 1000.0,
+                        verbose=args.verbose)
+    print('COBWEB_WFS_URL=%s  # pep_rewriting_tests.py' % server.url('/echo/wfs'))
+    print('COBWEB_WFS_URL=%s COBWEB_ECHO_URL=%s  # endpoint_tests.py'
+          % (server.url('/wfs'), server.url('/echo/wfs')))
+    print('COBWEB_GEOSERVER_URL=%s  # pep_overhead.py'
+          % server.url('/geoserver/wfs'))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+""" Targets, users, surveys and request shapes shared by the suites
+
+    endpoint_tests.py and pep_rewriting_tests.py import their settings
+    from here, as do the tools that reuse them (isolation_matrix.py,
+    pep_overhead.py, load_generator.py and the rest), so none of those
+    has to import a test module.
+"""
+import os
+
+# The following define the base URLs we will use for WFS request,
+# set COBWEB_WFS_URL to test another deployment such as stub_server.py
+WFS_POST_URL = os.environ.get('COBWEB_WFS_URL',
+                              "https://dyfi.cobwebproject.eu/test/service/wfs")
+WFS_URL = WFS_POST_URL + "?request=GetFeature&service=WFS&version=1.1.0&"
+
+# The deployment that echoes the request it forwards, compared by the
+# featureid and POST tests of endpoint_tests.py. It is the one above
+# unless COBWEB_ECHO_URL is set, e.g. to the /echo/wfs of stub_server.py
+ECHO_POST_URL = os.environ.get('COBWEB_ECHO_URL', WFS_POST_URL)
+ECHO_URL = ECHO_POST_URL + "?request=GetFeature&service=WFS&version=1.1.0&"
+
+# Seconds allowed to connect to, and to complete a request against,
+# the targets above. Set COBWEB_CONNECT_TIMEOUT and COBWEB_TIMEOUT to
+# override them, 0 waits without limit.
+CONNECT_TIMEOUT = float(os.environ.get('COBWEB_CONNECT_TIMEOUT', 10))
+REQUEST_TIMEOUT = float(os.environ.get('COBWEB_TIMEOUT', 300))
+
+# The WFS behind the PEP, used by pep_overhead.py
+GEOSERVER_WFS_URL = os.environ.get('COBWEB_GEOSERVER_URL',
+                                   "http://localhost:8020/geoserver/cobweb/wfs?")
+
+# The following are the UUID of users and surveys for endpoint_tests.py
+# Both users should have observations on both surveys
+# Each user should only see their own observations (because we
+# do not pass the cookie "surveys" parameter).
+USER1 = "UUID"
+USER2 = "UUID"
+SURVEY1 = "cobweb:sid-UUID"
+SURVEY2 = "cobweb:sid-UUID"
+FILTER_ATTR = "cobweb:pos_acc"
+FILTER_VAL = "-1.0"
+BBOX_CONTAINS_OBS = (50,-5,55,0)
+BBOX_NO_CONTAIN_OBS = (1, 2, 2, 3)
+
+# The user and surveys of pep_rewriting_tests.py
+USER_UUID = "040522c4-e3d6-0ec7-0124-dc64602b9346"
+SURVEY_1 = "cobweb:sid-78cd6e23-583a-4ba7-ac52-9c56e492d59c"
+SURVEY_2 = "cobweb:sid-f629c133-d4af-45ce-9e8b-97545abd61cc"
+
+# The request shapes exercised by pep_rewriting_tests.py, also replayed
+# by load_generator.py
+SINGLE_TYPE_NAME = "typeName=A"
+MULTIPLE_TYPE_NAMES = "typeName=A,B"
+SINGLE_FILTER = "typeName=A&filter=<Filter><F1/></Filter>"
+MULTIPLE_FILTERS = "typeName=A,B&filter=(<Filter><F1/></Filter>),(<Filter><F2/></Filter>)"
+SINGLE_BBOX = "typeName=A&bbox=0,1,2,3"
+MULTIPLE_BBOX = "typeName=A,B&bbox=0,1,2,3"
+SINGLE_FEATURE_ID = "typeName=A&featureid=id_4711"
+MULTIPLE_FEATURE_IDS = "typeName=A&featureid=id_4711,id_4712"
+POST_GET_FEATURE = '<wfs:GetFeature   service="WFS"   version="1.1.0"   xmlns:wfs="http://www.opengis.net/wfs"   xmlns:ogc="http://www.opengis.net/ogc"   xmlns:myns="http://www.example.com/myns"   xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"   xsi:schemaLocation="http://www.opengis.net/wfs ../wfs/1.1.0/WFS-basic.xsd">   <wfs:Query typeName="A"/>   <wfs:Query typeName="B">    <ogc:Filter><ogc:F1/></ogc:Filter>   </wfs:Query>   <wfs:Query typeName="C">    <ogc:Filter><ogc:And><ogc:F2/><ogc:F3/></ogc:And></ogc:Filter>   </wfs:Query>   <wfs:Query typeName="D"/></wfs:GetFeature>'
+
+REQUEST_SHAPES = [
+    ('single_type_name', 'GET', SINGLE_TYPE_NAME),
+    ('multiple_type_names', 'GET', MULTIPLE_TYPE_NAMES),
+    ('single_filter', 'GET', SINGLE_FILTER),
+    ('multiple_filters', 'GET', MULTIPLE_FILTERS),
+    ('single_bbox', 'GET', SINGLE_BBOX),
+    ('multiple_bbox', 'GET', MULTIPLE_BBOX),
+    ('single_feature_id', 'GET', SINGLE_FEATURE_ID),
+    ('multiple_feature_ids', 'GET', MULTIPLE_FEATURE_IDS),
+    ('post_get_feature', 'POST', POST_GET_FEATURE),
+]
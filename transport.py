@@ -0,0 +1,192 @@
+""" Shared HTTP transport for the PEP test suites
+
+    Every request used to build a fresh pycurl.Curl handle, paying for a
+    DNS lookup and a full TLS handshake against the PEP each time. The
+    Transport below keeps a pool of persistent handles joined through a
+    pycurl.CurlShare, so DNS answers, SSL sessions and open connections
+    are reused across requests and across threads.
+"""
+import threading
+from collections import namedtuple
+from io import BytesIO
+
+import lazy_import
+import request_timing
+import suite_config
+
+pycurl = lazy_import.module('pycurl')
+
+
+""" A single HTTP request. headers is a tuple of 'Name: value' strings
+    and body is None for a GET.
+"""
+Request = namedtuple('Request', 'method url body headers')
+
+""" The outcome of a Request. body is None when the caller streamed
+    the response into its own sink.
+"""
+Response = namedtuple('Response', 'status body reused')
+
+
+def get(url, headers=()):
+    return Request('GET', url, None, tuple(headers))
+
+
+def post(url, payload, headers=()):
+    return Request('POST', url, payload, tuple(headers))
+
+
+def header_value(request, name):
+    """ Returns the value of the named header of request, or None """
+    prefix = name.lower() + ':'
+    for header in request.headers:
+        if header.lower().startswith(prefix):
+            return header[len(prefix):].strip()
+    return None
+
+
+def configure_handle(handle, request, sink):
+    """ Sets the options for request on a (reset) curl handle. sink
+        receives the response body chunks as they arrive. The connect and
+        total timeouts come from suite_config.
+    """
+    handle.setopt(pycurl.URL, request.url)
+    handle.setopt(pycurl.CONNECTTIMEOUT_MS,
+                  int(suite_config.CONNECT_TIMEOUT * 1000))
+    handle.setopt(pycurl.TIMEOUT_MS, int(suite_config.REQUEST_TIMEOUT * 1000))
+    handle.setopt(pycurl.SSL_VERIFYPEER, 0)
+    handle.setopt(pycurl.SSL_VERIFYHOST, 0)
+    handle.setopt(pycurl.NOSIGNAL, 1)
+    handle.setopt(pycurl.HTTPHEADER, list(request.headers))
+    handle.setopt(pycurl.WRITEFUNCTION, sink)
+    if request.body is not None:
+        handle.setopt(pycurl.POSTFIELDS, request.body)
+
+
+def make_share():
+    """ Returns a CurlShare for DNS, SSL session and, where libcurl
+        supports it, connection cache sharing
+    """
+    share = pycurl.CurlShare()
+    share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_DNS)
+    share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_SSL_SESSION)
+    connect = getattr(pycurl, 'LOCK_DATA_CONNECT', None)
+    if connect is not None:
+        try:
+            share.setopt(pycurl.SH_SHARE, connect)
+        except pycurl.error:
+            pass
+    return share
+
+
+class Transport(object):
+    """ A thread-safe pool of keep-alive curl handles
+
+        Handles are checked out for the duration of a single request,
+        so any number of threads may call perform() at once. Idle
+        handles keep their connections open for the next caller.
+    """
+
+    def __init__(self, pool_size=8):
+        self.pool_size = pool_size
+        self.share = make_share()
+        self._idle = []
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.reused = 0
+
+    def _checkout(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        handle = pycurl.Curl()
+        handle.setopt(pycurl.SHARE, self.share)
+        return handle
+
+    def _checkin(self, handle):
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(handle)
+                return
+        handle.close()
+
+    def _record(self, reused):
+        with self._lock:
+            self.requests += 1
+            if reused:
+                self.reused += 1
+
+    def perform(self, request, sink=None):
+        """ Performs request and returns a Response. If sink is given
+            the body is passed to it chunk by chunk instead of being
+            buffered.
+        """
+        buf = None
+        if sink is None:
+            buf = BytesIO()
+            sink = buf.write
+        handle = self._checkout()
+        try:
+            configure_handle(handle, request, sink)
+            handle.perform()
+            status = handle.getinfo(pycurl.RESPONSE_CODE)
+            reused = handle.getinfo(pycurl.NUM_CONNECTS) == 0
+        except Exception as error:
+            if isinstance(error, pycurl.error):
+                request_timing.observe(handle, request, None,
+                                       error=error.args[0])
+            handle.close()
+            raise
+        request_timing.observe(handle, request, status)
+        # reset() keeps the connection cache and the share
+        handle.reset()
+        self._checkin(handle)
+        self._record(reused)
+        return Response(status, buf.getvalue() if buf else None, reused)
+
+    def stats(self):
+        """ Returns a dict of request and connection reuse counts """
+        with self._lock:
+            requests, reused = self.requests, self.reused
+        return {'requests': requests,
+                'reused': reused,
+                'new_connections': requests - reused,
+                'reuse_ratio': float(reused) / requests if requests else 0.0}
+
+    def report(self):
+        stats = self.stats()
+        return 'HTTP requests: %d, connections reused: %d (%.0f%%)' % (
+            stats['requests'], stats['reused'], stats['reuse_ratio'] * 100)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for handle in idle:
+            handle.close()
+        self.share.close()
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_transport():
+    """ Returns the process wide Transport, creating it on first use.
+        COBWEB_CACHE puts a response_cache.CachingTransport in front.
+    """
+    global _default
+    with _default_lock:
+        if _default is None:
+            import response_cache
+            _default = response_cache.from_environment(Transport())
+        return _default
+
+
+def set_default_transport(instance):
+    """ Replaces the process wide Transport, None restores the default.
+        Returns the Transport replaced, None if none had been created.
+    """
+    global _default
+    with _default_lock:
+        previous, _default = _default, instance
+    return previous
@@ -0,0 +1,35 @@
+import time
+import unittest
+
+import lazy_import
+import stub_server
+import suite_config
+import transport
+
+pycurl = lazy_import.module('pycurl')
+
+
+""" TestTimeouts checks that requests to a server that never answers
+    fail after suite_config.REQUEST_TIMEOUT, without a PEP
+"""
+class TestTimeouts(unittest.TestCase):
+
+    def setUp(self):
+        self.server = stub_server.SilentServer()
+        self.timeout = suite_config.REQUEST_TIMEOUT
+        suite_config.REQUEST_TIMEOUT = 0.5
+
+    def tearDown(self):
+        suite_config.REQUEST_TIMEOUT = self.timeout
+        self.server.close()
+
+    def test_request_times_out(self):
+        started = time.time()
+        with self.assertRaises(pycurl.error) as raised:
+            transport.Transport().perform(transport.get(self.server.url()))
+        self.assertEqual(raised.exception.args[0], pycurl.E_OPERATION_TIMEDOUT)
+        self.assertLess(time.time() - started, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
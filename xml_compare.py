@@ -0,0 +1,169 @@
+""" Structural comparison of rewritten requests
+
+    The PEP echoes GET requests as key=value;...;FILTER=(...) and POST
+    requests as POSTDATA=<wfs:GetFeature ...>. Both are reduced to a
+    canonical form before comparing: prefixes are replaced by the
+    namespace URI they are bound to, namespace declarations and
+    whitespace-only text are dropped and attributes are sorted. Two
+    requests that differ only in prefix choice, redundant declarations
+    or indentation compare equal, and a real difference is reported by
+    the path of the first element where the trees part.
+
+    Expected fixtures are canonicalized once and cached.
+"""
+import rewriting
+
+XMLNS = 'xmlns'
+POST_PREFIX = 'POSTDATA='
+FILTER_KEY = 'FILTER='
+
+
+def _resolve(name, scope, default=True):
+    """ Returns {uri}local for a qualified name, the name itself when its
+        prefix is unbound
+    """
+    prefix, _, local = name.rpartition(':')
+    if not prefix and not default:
+        return local
+    uri = scope.get(prefix)
+    if uri is None:
+        return name
+    return '{%s}%s' % (uri, local)
+
+
+def canonical(element, scope=None):
+    """ Returns the canonical form of an Element tree, nested
+        (name, attrs, text, children) tuples
+    """
+    declared = element.namespaces()
+    if declared:
+        scope = dict(scope or {})
+        scope.update(declared)
+    elif scope is None:
+        scope = {}
+    attrs = tuple(sorted(
+        (_resolve(key, scope, False), value) for key, value in element.attrs
+        if key != XMLNS and not key.startswith(XMLNS + ':')))
+    text = element.text + ''.join(child.tail for child in element.children)
+    return (_resolve(element.tag, scope), attrs, text.strip(),
+            tuple(canonical(child, scope) for child in element.children))
+
+
+def _canonical_xml(text):
+    try:
+        return canonical(rewriting.parse(text))
+    except rewriting.RewriteError as error:
+        return ('#unparseable', (), str(error), ())
+
+
+def canonical_get(text):
+    """ Returns the canonical form of an echoed GET request,
+        ('GET', params, filters)
+    """
+    head, found, filters = text.partition(';' + FILTER_KEY)
+    if not found and text.startswith(FILTER_KEY):
+        head, filters = '', text[len(FILTER_KEY):]
+    params = tuple(tuple(p.partition('=')[::2]) for p in head.split(';') if p)
+    if filters:
+        filters = tuple(_canonical_xml(f)
+                        for f in rewriting.split_filter_list(filters))
+    return ('GET', params, filters or ())
+
+
+def canonical_post(text):
+    """ Returns the canonical form of an echoed POST request,
+        ('POST', tree)
+    """
+    if text.startswith(POST_PREFIX):
+        text = text[len(POST_PREFIX):]
+    return ('POST', _canonical_xml(text))
+
+
+def canonical_request(text):
+    """ Returns the canonical form of an echoed GET or POST request """
+    if isinstance(text, bytes):
+        text = text.decode('utf-8')
+    stripped = text.lstrip()
+    if stripped.startswith(POST_PREFIX) or stripped.startswith('<'):
+        return canonical_post(stripped)
+    return canonical_get(text.strip())
+
+
+_expected = {}
+
+
+def expected_form(text):
+    """ canonical_request() for a fixture, cached """
+    form = _expected.get(text)
+    if form is None:
+        form = _expected[text] = canonical_request(text)
+    return form
+
+
+def _display(name):
+    return name.rpartition('}')[2]
+
+
+def tree_difference(expected, actual, path='', position=1):
+    """ Returns a description of the first difference between two
+        canonical trees, None if they are equal. Paths number elements
+        among their siblings of the same name.
+    """
+    if expected == actual:
+        return None
+    name, attrs, text, children = expected
+    path = '%s/%s' % (path, _display(name))
+    if position > 1:
+        path += '[%d]' % position
+    if name != actual[0]:
+        return '%s: element %s, expected %s' % (path, actual[0], name)
+    if attrs != actual[1]:
+        expected_attrs, actual_attrs = dict(attrs), dict(actual[1])
+        for key in sorted(set(expected_attrs) | set(actual_attrs)):
+            if expected_attrs.get(key) != actual_attrs.get(key):
+                return '%s/@%s: %r, expected %r' % (
+                    path, _display(key), actual_attrs.get(key),
+                    expected_attrs.get(key))
+    if text != actual[2]:
+        return '%s: text %r, expected %r' % (path, actual[2], text)
+    seen = {}
+    for index, child in enumerate(children):
+        seen[child[0]] = seen.get(child[0], 0) + 1
+        if index >= len(actual[3]):
+            return '%s: missing %s[%d]' % (path, _display(child[0]),
+                                           seen[child[0]])
+        difference = tree_difference(child, actual[3][index], path,
+                                     seen[child[0]])
+        if difference:
+            return difference
+    extra = actual[3][len(children)]
+    return '%s: unexpected %s' % (path, _display(extra[0]))
+
+
+def difference(expected, actual):
+    """ Compares an echoed request with the expected fixture and returns
+        the first difference, None if they are equivalent
+    """
+    if expected == actual:
+        return None
+    want, got = expected_form(expected), canonical_request(actual)
+    if want == got:
+        return None
+    if want[0] != got[0]:
+        return 'request: %s, expected %s' % (got[0], want[0])
+    if want[0] == 'POST':
+        return tree_difference(want[1], got[1])
+    if want[1] != got[1]:
+        for index, param in enumerate(want[1]):
+            if index >= len(got[1]) or got[1][index] != param:
+                found = got[1][index] if index < len(got[1]) else None
+                return 'param %d: %r, expected %r' % (index + 1, found, param)
+        return 'param %d: unexpected %r' % (len(want[1]) + 1,
+                                            got[1][len(want[1])])
+    for index, tree in enumerate(want[2]):
+        if index >= len(got[2]):
+            return 'FILTER(%d): missing' % (index + 1)
+        found = tree_difference(tree, got[2][index], 'FILTER(%d)' % (index + 1))
+        if found:
+            return found
+    return 'FILTER(%d): unexpected' % (len(want[2]) + 1)
@@ -0,0 +1,92 @@
+import unittest
+
+import xml_compare
+
+HEAD = 'request=GetFeature;service=WFS;version=1.1.0;typeName=A;FILTER='
+FILTER = ('(<fes:Filter xmlns:fes="http://www.opengis.net/ogc">'
+          '<fes:PropertyIsEqualTo><fes:PropertyName>userid</fes:PropertyName>'
+          '<fes:Literal>Joe</fes:Literal></fes:PropertyIsEqualTo>'
+          '</fes:Filter>)')
+POST = ('POSTDATA=<wfs:GetFeature xmlns:wfs="http://www.opengis.net/wfs" '
+        'service="WFS" version="1.1.0"><wfs:Query typeName="A">'
+        '<ogc:Filter xmlns:ogc="http://www.opengis.net/ogc"><ogc:F1/>'
+        '</ogc:Filter></wfs:Query></wfs:GetFeature>')
+
+
+""" TestCanonicalComparison checks which differences in echoed requests
+    xml_compare ignores and which it reports
+"""
+class TestCanonicalComparison(unittest.TestCase):
+
+    def assertEquivalent(self, expected, actual):
+        self.assertEqual(xml_compare.difference(expected, actual), None)
+
+    def assertDifference(self, expected, actual, description):
+        self.assertEqual(xml_compare.difference(expected, actual),
+                         description)
+
+    # values are shown with %r, which differs between Python 2 and 3
+    def assertDifferenceAt(self, expected, actual, where, *values):
+        difference = xml_compare.difference(expected, actual)
+        self.assertTrue(difference.startswith(where + ':'), difference)
+        for value in values:
+            self.assertIn(value, difference)
+
+    def test_prefixes_declarations_and_whitespace_are_ignored(self):
+        self.assertEquivalent(HEAD + FILTER, HEAD + FILTER.replace(
+            'fes:', 'ogc:').replace('xmlns:fes', 'xmlns:ogc'))
+        self.assertEquivalent(HEAD + FILTER, HEAD + FILTER.replace(
+            '<fes:PropertyIsEqualTo>', '<fes:PropertyIsEqualTo xmlns:fes='
+            '"http://www.opengis.net/ogc">\n  '))
+        self.assertEquivalent(POST, POST.replace('><', '>\n    <'))
+        self.assertEquivalent(POST, POST.replace(
+            'service="WFS" version="1.1.0"', 'version="1.1.0" service="WFS"'))
+
+    def test_literal_text_is_compared(self):
+        self.assertDifferenceAt(
+            HEAD + FILTER, HEAD + FILTER.replace('Joe', 'Jim'),
+            'FILTER(1)/Filter/PropertyIsEqualTo/Literal', 'Jim', 'Joe')
+
+    def test_namespace_uri_is_compared(self):
+        self.assertDifference(
+            HEAD + FILTER, HEAD + FILTER.replace('opengis.net/ogc',
+                                                 'opengis.net/fes/2.0'),
+            'FILTER(1)/Filter: element {http://www.opengis.net/fes/2.0}'
+            'Filter, expected {http://www.opengis.net/ogc}Filter')
+
+    def test_params_and_filters_are_compared(self):
+        self.assertDifferenceAt(
+            HEAD + FILTER, HEAD.replace('typeName=A', 'typeName=B') + FILTER,
+            'param 4', "'B'", "'A'")
+        self.assertDifference(HEAD + FILTER, HEAD + FILTER + ',' + FILTER,
+                              'FILTER(2): unexpected')
+        self.assertDifference(HEAD + FILTER + ',' + FILTER, HEAD + FILTER,
+                              'FILTER(2): missing')
+
+    def test_post_attributes_and_children_are_compared(self):
+        self.assertDifferenceAt(
+            POST, POST.replace('version="1.1.0"', 'version="1.0.0"'),
+            '/GetFeature/@version', "'1.0.0'", "'1.1.0'")
+        self.assertDifference(
+            POST, POST.replace('<ogc:F1/>', '<ogc:F1/><ogc:F2/>'),
+            '/GetFeature/Query/Filter: unexpected F2')
+        self.assertDifference(
+            POST, POST.replace('<ogc:F1/>', ''),
+            '/GetFeature/Query/Filter: missing F1[1]')
+
+    def test_get_and_post_differ(self):
+        self.assertDifference(HEAD + FILTER, POST,
+                              'request: POST, expected GET')
+
+    def test_unparseable_filters_are_reported(self):
+        difference = xml_compare.difference(HEAD + FILTER,
+                                            HEAD + '(<fes:Filter>)')
+        self.assertTrue(difference.startswith('FILTER(1)'), difference)
+
+    def test_canonical_form_is_cached_for_fixtures(self):
+        self.assertTrue(xml_compare.expected_form(POST) is
+                        xml_compare.expected_form(POST))
+
+
+if __name__ == '__main__':
+    unittest.main()